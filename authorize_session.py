@@ -3,75 +3,89 @@
 Session Authorization Script for Railway Deployment
 
 Run this script locally to authorize your Telegram session before deploying to Railway.
-The authorized session file will be created in the sessions/ directory.
+The authorized session is saved in the sessions/ directory, and a SESSION_STRING value
+(auth key plus the routed chats and notify users) is printed for the Railway variables.
+Every configured account (see ACCOUNTS / [account.<name>]) is authorized in turn.
 """
 
 from telethon import TelegramClient, errors
 import asyncio
 import os
-import configparser
 
-def load_config():
-    """Load configuration from config.ini"""
-    parser = configparser.ConfigParser()
-    if not os.path.exists('config.ini'):
-        print("🔴 [CRITICAL] config.ini not found!")
-        print("Please copy config.example.ini to config.ini and fill in your details.")
-        exit(1)
-    
-    parser.read('config.ini')
-    cfg = {}
+from config import SESSIONS_DIR, ConfigError, load_config, session_path
+from routing import RoutingTable
+from session_backend import open_session
+
+async def main():
     try:
-        cfg['api_id'] = parser.getint('telegram_credentials', 'api_id')
-        cfg['api_hash'] = parser.get('telegram_credentials', 'api_hash')
-        cfg['phone_number'] = parser.get('telegram_credentials', 'phone_number')
-        cfg['session_name'] = parser.get('bot_settings', 'session_name', fallback='my_telegram_session')
-    except Exception as e:
-        print(f"🔴 [CRITICAL] Error in config.ini: {e}")
+        # Same loader as the bot; the routes are only needed to pick the entities for SESSION_STRING
+        try:
+            config = load_config()
+            routes = RoutingTable.from_config(config)
+        except (ConfigError, KeyError, ValueError, TypeError):
+            config, routes = load_config(credentials_only=True), None
+    except ConfigError as e:
+        print(f"🔴 [CRITICAL] {e}")
         exit(1)
-    
-    return cfg
 
-async def main():
-    config = load_config()
-    
     # Create sessions directory
-    sessions_dir = 'sessions'
-    if not os.path.exists(sessions_dir):
-        os.makedirs(sessions_dir)
-        print(f"✅ Created sessions directory: {sessions_dir}")
-    
-    session_path = os.path.join(sessions_dir, config['session_name'])
-    
-    print(f"🔐 Authorizing session: {session_path}")
-    client = TelegramClient(session_path, config['api_id'], config['api_hash'])
-    
+    if not os.path.exists(SESSIONS_DIR):
+        os.makedirs(SESSIONS_DIR)
+        print(f"✅ Created sessions directory: {SESSIONS_DIR}")
+
+    pinned_ids = [*routes.chat_ids, *routes.notify_user_ids] if routes else []
+    for index, account in enumerate(config['accounts']):
+        await authorize_account(config, account, pinned_ids, primary=index == 0)
+
+async def authorize_account(config, account, pinned_ids, primary):
+    path = session_path(account)
+    session = open_session({**config, 'session_string': account['session_string']}, path, pinned_ids=pinned_ids)
+    phone_number = account['phone_number'] or input(f"Phone number for account {account['name']}: ")
+
+    print(f"🔐 Authorizing session: {path}")
+    client = TelegramClient(session, config['api_id'], config['api_hash'])
+
     try:
         await client.connect()
-        
+
         if not await client.is_user_authorized():
             print("📱 Sending authorization code...")
-            await client.send_code_request(config['phone_number'])
+            await client.send_code_request(phone_number)
             code = input("Enter the code sent to your Telegram: ")
-            
+
             try:
-                await client.sign_in(config['phone_number'], code)
+                await client.sign_in(phone_number, code)
             except errors.SessionPasswordNeededError:
                 password = input("Enter your 2FA password: ")
                 await client.sign_in(password=password)
-        
+
         if await client.is_user_authorized():
             me = await client.get_me()
             print(f"✅ Successfully authorized as: {me.first_name} {me.last_name or ''} (@{me.username or ''})")
-            print(f"✅ Session file created: {session_path}.session")
+            if isinstance(session, str):
+                print(f"✅ Session file created: {path}.session")
+            else:
+                # Fetching the dialogs stores the access hashes of the routed chats
+                await client.get_dialogs()
+                missing = [peer_id for peer_id in pinned_ids if session.get_entity_rows_by_id(peer_id) is None]
+                if missing:
+                    print(f"⚠️ Not found among your dialogs (resolved on the server at startup): {missing}")
+                session.save(force=True)
+                print(f"✅ Session snapshot created: {session.path}")
+                if primary:
+                    print("🔑 Set this Railway variable to restore the session:")
+                    print(f"SESSION_STRING={session.to_string()}")
+                else:
+                    print(f"🔑 Set \"session_string\" of account {account['name']} in ACCOUNTS to restore the session:")
+                    print(session.to_string())
             print("🚀 You can now deploy to Railway!")
         else:
             print("🔴 Authorization failed!")
-            
+
     except Exception as e:
         print(f"🔴 Error: {e}")
     finally:
         await client.disconnect()
 
 if __name__ == '__main__':
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
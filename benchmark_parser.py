@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for message_parser.
+
+Runs parse_offer and extract_amount over a fixed corpus of realistic and
+synthetic messages, reports per-call latency percentiles and messages/sec throughput,
+and compares the results against a saved baseline file.
+
+Usage:
+    python benchmark_parser.py                    # run and compare against the baseline if present
+    python benchmark_parser.py --check            # regression gate: fail if the baseline is missing
+    python benchmark_parser.py --save-baseline    # run and store the results as the new baseline
+    python benchmark_parser.py --tolerance 0.3    # allow up to 30% slowdown before failing
+
+The baseline is machine-specific, so it is not committed: record it with --save-baseline
+on the machine that runs the gate. Exit code is 1 when any tracked metric regresses
+beyond the tolerance, and 2 when --check is given but there is no baseline to compare to.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from message_parser import CURRENCY_GBP_REGEX, CURRENCY_RUB_REGEX, extract_amount, normalize_text, parse_offer
+
+# Next to this script, so the gate finds it whatever the working directory
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser_benchmark_baseline.json')
+
+REALISTIC_MESSAGES = [
+    "Продам 200 фунтов за рубли",
+    "Продаю gbp 350, хочу рубли.",
+    "Куплю рубли на 50000.",
+    "Нужно 120к рублей, есть фунты",
+    "Привет! Хочу поменять 600 фунтов на рубли",
+    "всем привет! обменяю ваши 450к рублей на мои фунты завтра пишите в ЛС",
+    "Продам 100к рублей куплю гбп",
+    "Ищу рубли, предлагаю gbp. Сумма 300.",
+    "Есть 1000 фунтов, нужны рубли.",
+    "Текст без конкретики фунты рубли просто так",
+    "Тест сбщ: продаю £50.",
+    "продам £150 за рубли сейчас",
+    "Хочу купить рубли на 100 gbp",
+    "просто текст с £ и рублями без продажи",
+    "Продам штуку баксов",
+    "£300 в наличии, нужны рубли",
+    "Куплю руб 200 000, перевод на Сбер, фунты на Monzo",
+    "Меняю gbp на rub по курсу 105, сумма 2 500 gbp",
+    "Добрый день! Кто подскажет хороший коворкинг в Лондоне?",
+    "Спасибо, обмен состоялся 👍",
+]
+
+_FILLER_WORDS = [
+    "привет", "всем", "сегодня", "завтра", "лондон", "перевод", "карта", "сбер", "тинькофф",
+    "monzo", "revolut", "курс", "пишите", "лс", "срочно", "наличные", "встреча", "метро",
+]
+_OFFER_WORDS = [
+    "продам", "куплю", "меняю", "обменяю", "отдам", "нужны", "есть", "надо", "фунты", "фунтов",
+    "гбп", "gbp", "£", "рубли", "рублей", "руб", "rub", "на", "за",
+]
+_EMOJI = ["💷", "💶", "💰", "🔥", "✅", "👍", "🙏", "📩", "🇬🇧", "🇷🇺"]
+
+
+def _random_amount(rng: random.Random) -> str:
+    choice = rng.random()
+    if choice < 0.3:
+        return f"{rng.randint(1, 999)}к"
+    if choice < 0.6:
+        return f"{rng.randint(1, 999)} {rng.randint(0, 999):03d}"
+    return str(rng.randint(10, 5000))
+
+
+def build_corpus(seed: int = 1234, synthetic_per_kind: int = 100) -> dict[str, list[str]]:
+    """Returns the benchmark corpus grouped by message kind; synthetic kinds are seeded and repeatable."""
+    rng = random.Random(seed)
+
+    def words(count: int, pool: list[str]) -> str:
+        return " ".join(rng.choice(pool) for _ in range(count))
+
+    corpus = {"realistic": list(REALISTIC_MESSAGES)}
+    corpus["short"] = [words(rng.randint(1, 4), _OFFER_WORDS + _FILLER_WORDS) for _ in range(synthetic_per_kind)]
+    corpus["long"] = [
+        words(rng.randint(150, 400), _FILLER_WORDS * 3 + _OFFER_WORDS) + " " + _random_amount(rng) + " gbp"
+        for _ in range(synthetic_per_kind)
+    ]
+    corpus["multi_line"] = [
+        "\n".join(words(rng.randint(3, 10), _OFFER_WORDS + _FILLER_WORDS) + " " + _random_amount(rng)
+                  for _ in range(rng.randint(3, 12)))
+        for _ in range(synthetic_per_kind)
+    ]
+    corpus["emoji_heavy"] = [
+        " ".join(rng.choice(_EMOJI) * rng.randint(1, 4) + " " + rng.choice(_OFFER_WORDS) for _ in range(rng.randint(5, 25)))
+        for _ in range(synthetic_per_kind)
+    ]
+    corpus["number_dense"] = [
+        " ".join(_random_amount(rng) + " " + rng.choice(["gbp", "руб", "£", ",", "-", "/"]) for _ in range(rng.randint(10, 60)))
+        for _ in range(synthetic_per_kind)
+    ]
+    return corpus
+
+
+def _percentiles(samples_ns: list[int]) -> dict[str, float]:
+    ordered = sorted(samples_ns)
+    last = len(ordered) - 1
+
+    def pick(q: float) -> float:
+        return ordered[min(last, int(round(q * last)))] / 1000.0  # microseconds
+
+    return {"p50_us": pick(0.50), "p90_us": pick(0.90), "p99_us": pick(0.99), "max_us": ordered[-1] / 1000.0}
+
+
+def _time_calls(func, messages: list[str], repeat: int) -> tuple[list[int], float]:
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for msg in messages:
+            t0 = time.perf_counter_ns()
+            func(msg)
+            samples.append(time.perf_counter_ns() - t0)
+    elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+
+def run_benchmark(repeat: int = 5, seed: int = 1234) -> dict:
+    """Runs the benchmark and returns a JSON-serialisable results dict."""
+    corpus = build_corpus(seed)
+    all_messages = [msg for messages in corpus.values() for msg in messages]
+    normalized = [normalize_text(msg) for msg in all_messages]
+
+    # Warm up regex caches so the first measured calls are not outliers
+    for msg in all_messages:
+        parse_offer(msg)
+
+    results = {"repeat": repeat, "seed": seed, "messages": len(all_messages), "parse": {}, "extract_amount": {}}
+
+    for kind, messages in corpus.items():
+        samples, _ = _time_calls(parse_offer, messages, repeat)
+        results["parse"][kind] = _percentiles(samples)
+
+    samples, elapsed = _time_calls(parse_offer, all_messages, repeat)
+    results["parse"]["all"] = _percentiles(samples)
+    results["parse"]["all"]["msgs_per_sec"] = len(samples) / elapsed
+
+    for name, regex in (("gbp", CURRENCY_GBP_REGEX), ("rub", CURRENCY_RUB_REGEX)):
+        samples, elapsed = _time_calls(lambda text: extract_amount(text, regex), normalized, repeat)
+        results["extract_amount"][name] = _percentiles(samples)
+        results["extract_amount"][name]["calls_per_sec"] = len(samples) / elapsed
+
+    return results
+
+
+def _tracked_metrics(results: dict) -> dict[str, tuple[float, bool]]:
+    """Flattens the metrics the regression gate checks: name -> (value, higher_is_better)."""
+    metrics = {}
+    for section in ("parse", "extract_amount"):
+        for kind, stats in results[section].items():
+            for key, value in stats.items():
+                if key in ("p50_us", "p99_us"):
+                    metrics[f"{section}.{kind}.{key}"] = (value, False)
+                elif key.endswith("_per_sec"):
+                    metrics[f"{section}.{kind}.{key}"] = (value, True)
+    return metrics
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a description of every tracked metric that is worse than the baseline by more than `tolerance`."""
+    regressions = []
+    current = _tracked_metrics(results)
+    for name, (old_value, higher_is_better) in _tracked_metrics(baseline).items():
+        if name not in current or old_value <= 0:
+            continue
+        new_value = current[name][0]
+        change = (old_value - new_value) / old_value if higher_is_better else (new_value - old_value) / old_value
+        if change > tolerance:
+            regressions.append(f"{name}: {old_value:.2f} -> {new_value:.2f} ({change:+.0%} worse)")
+    return regressions
+
+
+def print_report(results: dict):
+    print(f"--- Parser benchmark ({results['messages']} messages x {results['repeat']} runs) ---")
+    for section in ("parse", "extract_amount"):
+        for kind, stats in results[section].items():
+            line = ", ".join(f"{key}={value:.1f}" for key, value in stats.items())
+            print(f"  {section:<15} {kind:<13} {line}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Benchmark message_parser throughput and latency.")
+    arg_parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE, help="Baseline JSON file")
+    arg_parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    arg_parser.add_argument('--check', action='store_true', help="Fail (exit code 2) if there is no baseline")
+    arg_parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown (default 0.2)")
+    arg_parser.add_argument('--repeat', type=int, default=5, help="Passes over the corpus per measurement")
+    arg_parser.add_argument('--seed', type=int, default=1234, help="Seed for the synthetic corpus")
+    args = arg_parser.parse_args(argv)
+
+    # The parser logs every keyword match at INFO; keep log handling out of the measurement
+    logging.disable(logging.CRITICAL)
+
+    results = run_benchmark(repeat=args.repeat, seed=args.seed)
+    print_report(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        if args.check:
+            print(f"🔴 No baseline at {args.baseline}; run with --save-baseline on this machine first.")
+            return 2
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"🔴 Performance regression beyond {args.tolerance:.0%} tolerance:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"✅ No regression beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Startup catch-up of messages posted while the bot was down.
+
+For every route, pages through the topic history newer than the route's stored cursor
+(the last processed message id, kept in the DedupStore) and feeds the messages through
+the normal handler, oldest first, with bounded concurrency. Messages older than the age
+cutoff are skipped so a long outage does not produce a wave of stale replies. Runs as a
+background task next to the live listener; the DedupStore makes sure a message that
+arrives both live and through catch-up is handled once.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from message_handler import HandlerContext, handle_new_message
+from routing import Route, RoutingTable
+from utils.dedup_store import DedupStore
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_missed(client, route: Route, min_id: int, cutoff: datetime, limit: int) -> list:
+    """Returns the route's messages with id > min_id posted after `cutoff`, oldest first."""
+    missed = []
+    # iter_messages pages newest-first in bulk requests; stop at the age cutoff
+    async for message in client.iter_messages(route.chat_id, limit=limit, min_id=min_id, reply_to=route.topic_id):
+        if message.date is not None and message.date < cutoff:
+            break
+        if message.text:
+            missed.append(message)
+    missed.reverse()
+    return missed
+
+
+def snapshot_cursors(routes: RoutingTable, dedup: DedupStore) -> dict:
+    return {route.name: dedup.get_cursor(route.name) for route in routes.routes}
+
+
+async def catch_up(client, routes: RoutingTable, context: HandlerContext, max_age: float = 2 * 3600,
+                   limit_per_route: int = 500, concurrency: int = 8, start_cursors: dict | None = None) -> int:
+    """
+    Processes missed messages for every route through the handler with `context`, whose
+    `dedup` store is required (it holds the cursors); returns how many were handled.
+    Pass `start_cursors` (route name -> cursor) captured before live listening starts, so live
+    events advancing the cursor cannot hide older missed messages.
+    """
+    if start_cursors is None:
+        start_cursors = snapshot_cursors(routes, context.dedup)
+    started = time.monotonic()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(message, route: Route):
+        async with semaphore:
+            try:
+                await handle_new_message(message, route, context)
+            except Exception as e:
+                logger.error(f"Catch-up failed for message ID {message.id} in {route.name}: {e}")
+
+    async def catch_up_route(route: Route) -> int:
+        min_id = start_cursors.get(route.name) or 0
+        try:
+            missed = await fetch_missed(client, route, min_id, cutoff, limit_per_route)
+        except Exception as e:
+            logger.error(f"Catch-up fetch failed for {route.name}: {e}")
+            return 0
+        logger.info(f"Catch-up: {len(missed)} message(s) to process for {route.name} (after ID {min_id}).")
+        await asyncio.gather(*(handle(message, route) for message in missed))
+        return len(missed)
+
+    total = sum(await asyncio.gather(*(catch_up_route(route) for route in routes.routes)))
+    logger.info(f"Catch-up finished: {total} message(s) in {time.monotonic() - started:.2f}s.")
+    return total
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Bulk classification of recorded messages with the current parser.
+
+Streams a JSONL dump, a Telegram Desktop JSON export (result.json of a single chat or
+of the whole account) or an offer history directory, fans chunks of messages out to a process pool running
+`parse_offer`, and writes one JSON line per message (in input order) with
+the offer type, confidence, amounts, the deciding pattern and every keyword pattern
+that matched. Prints
+per-type and per-pattern hit counts at the end, including patterns that never matched,
+to help tune the keyword lists. At most `workers * 4` chunks are in flight, so memory
+stays bounded regardless of the input size.
+
+Usage:
+    python classify_export.py result.json --output classified.jsonl
+    python classify_export.py messages.jsonl --offers-only --summary summary.json --workers 8
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter, deque
+
+from message_parser import KEYWORD_MATCHER, normalize_text, parse_offer
+from replay_messages import iter_messages
+
+
+def _init_worker():
+    # Per-message INFO lines from the parser would dominate the run time
+    logging.getLogger("message_parser").setLevel(logging.WARNING)
+
+
+def classify_chunk(chunk: list[tuple]) -> tuple[list[dict], Counter, Counter]:
+    """Classifies `(id, chat_id, date, text)` tuples; returns results and the chunk's type/pattern counts."""
+    results = []
+    type_counts = Counter()
+    pattern_counts = Counter()
+    for message_id, chat_id, date, text in chunk:
+        normalized = normalize_text(text)
+        parsed = parse_offer(text, normalized) if text else None
+        patterns = [f"{category}:{pattern}" for category, pattern in KEYWORD_MATCHER.iter_matches(normalized)]
+        offer_type = parsed.offer_type.label if parsed else None
+        type_counts[offer_type or "none"] += 1
+        pattern_counts.update(patterns)
+        results.append({
+            "id": message_id,
+            "chat_id": chat_id,
+            "date": date,
+            "offer_type": offer_type,
+            "confidence": parsed.confidence.label if parsed else None,
+            "amount_gbp": parsed.amount_gbp if parsed else None,
+            "amount_rub": parsed.amount_rub if parsed else None,
+            "pattern": parsed.pattern if parsed else None,
+            "patterns": patterns,
+            "text": text,
+        })
+    return results, type_counts, pattern_counts
+
+
+def _chunks(records, chunk_size: int):
+    items = ((r.get("id"), r.get("chat_id"), r.get("date"), r.get("text") or "") for r in records)
+    while chunk := list(itertools.islice(items, chunk_size)):
+        yield chunk
+
+
+def classify(records, workers: int, chunk_size: int = 1000, max_in_flight: int | None = None):
+    """Yields `classify_chunk` results in input order, keeping at most `max_in_flight` chunks queued."""
+    max_in_flight = max_in_flight or workers * 4
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in _chunks(records, chunk_size):
+            pending.append(pool.apply_async(classify_chunk, (chunk,)))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def all_patterns() -> list[str]:
+    return [f"{category}:{pattern}" for category, pattern in KEYWORD_MATCHER.patterns]
+
+
+def main(argv: list[str] | None = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Classify recorded messages with the current parser.")
+    arg_parser.add_argument('input', help="JSONL file, Telegram Desktop JSON export (result.json) or offer history directory")
+    arg_parser.add_argument('--output', help="Write one JSON line per classified message to this file")
+    arg_parser.add_argument('--offers-only', action='store_true', help="Only write messages classified as offers")
+    arg_parser.add_argument('--summary', help="Write the hit counts as JSON to this file")
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes (default: all cores)")
+    arg_parser.add_argument('--chunk-size', type=int, default=1000, help="Messages per task sent to a worker")
+    args = arg_parser.parse_args(argv)
+
+    type_counts = Counter()
+    pattern_counts = Counter()
+    total = 0
+    started = time.perf_counter()
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        for results, chunk_types, chunk_patterns in classify(iter_messages(args.input), args.workers, args.chunk_size):
+            total += len(results)
+            type_counts.update(chunk_types)
+            pattern_counts.update(chunk_patterns)
+            if output is not None:
+                for result in results:
+                    if result["offer_type"] or not args.offers_only:
+                        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.perf_counter() - started
+
+    patterns = {pattern: pattern_counts.get(pattern, 0) for pattern in all_patterns()}
+    print(f"--- Classified {total} messages in {elapsed:.2f}s "
+          f"({total / elapsed if elapsed else 0:.0f} msgs/sec, {args.workers} workers) ---")
+    print("  Offer types:")
+    for offer_type, count in type_counts.most_common():
+        print(f"    {offer_type:<24} {count:>9} ({count / total * 100 if total else 0:.1f}%)")
+    print("  Keyword patterns (all matches, not only the deciding one):")
+    for pattern, count in sorted(patterns.items(), key=lambda item: -item[1]):
+        print(f"    {count:>9}  {pattern}{'   <- never matched' if not count else ''}")
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump({"messages": total, "seconds": elapsed, "offer_types": dict(type_counts),
+                       "patterns": patterns}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
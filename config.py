@@ -0,0 +1,144 @@
+"""
+Configuration loading shared by the bot and authorize_session.py.
+
+Settings come from environment variables when API_ID is set (Railway deployment) and
+from config.ini otherwise. Loading has no side effects: problems raise ConfigError and
+the entry points decide how to report them.
+"""
+
+import configparser
+import json
+import os
+
+from routing import parse_routes_json
+
+SESSIONS_DIR = 'sessions'
+DEFAULT_SESSION_NAME = 'my_telegram_session'
+DEFAULT_SESSION_BACKEND = 'snapshot'
+CONFIDENCE_NAMES = ('low', 'medium', 'high')
+
+
+class ConfigError(Exception):
+    """Missing or invalid configuration; the message says what to fix."""
+
+
+def load_config(path: str = 'config.ini', environ=None, credentials_only: bool = False) -> dict:
+    """
+    Returns the settings as a dict (api_id, api_hash, phone_number, session_name, the
+    session_backend/session_max_entities/session_string options, accounts, and unless
+    `credentials_only`: notify_user_id, routes or target_group_id/target_topic_id, metrics_port,
+    notify_digest_window/notify_digest_size/notify_immediate_confidence).
+    `cfg['source']` names where they came from. `cfg['accounts']` lists the Telegram accounts
+    (name, session_name, phone_number, session_string): the one configured by session_name first,
+    then those from ACCOUNTS / [account.<name>] sections.
+    """
+    environ = os.environ if environ is None else environ
+    if environ.get('API_ID'):
+        return _from_environment(environ, credentials_only)
+    return _from_ini(path, credentials_only)
+
+
+def _from_environment(environ, credentials_only: bool) -> dict:
+    cfg = {'source': 'environment variables'}
+    try:
+        cfg['api_id'] = int(environ['API_ID'])
+        cfg['api_hash'] = environ.get('API_HASH')
+        cfg['phone_number'] = environ.get('PHONE_NUMBER')
+        cfg['session_name'] = environ.get('SESSION_NAME', DEFAULT_SESSION_NAME)
+        cfg['session_backend'] = environ.get('SESSION_BACKEND', DEFAULT_SESSION_BACKEND)
+        cfg['session_max_entities'] = (int(environ['SESSION_MAX_ENTITIES'])
+                                       if environ.get('SESSION_MAX_ENTITIES') else None)
+        cfg['session_string'] = environ.get('SESSION_STRING')
+        # ACCOUNTS (JSON list) adds accounts sharing the listening and sending load
+        extra_accounts = json.loads(environ['ACCOUNTS']) if environ.get('ACCOUNTS') else []
+        if not isinstance(extra_accounts, list):
+            raise ValueError("ACCOUNTS must be a JSON list of account objects")
+        cfg['accounts'] = _accounts(cfg, extra_accounts)
+        if credentials_only:
+            return cfg
+        cfg['notify_user_id'] = int(environ.get('NOTIFY_USER_ID'))
+        # ROUTES (JSON list) replaces the single TARGET_GROUP_ID/TARGET_TOPIC_ID pair
+        if environ.get('ROUTES'):
+            cfg['routes'] = parse_routes_json(environ['ROUTES'])
+        else:
+            cfg['target_group_id'] = int(environ.get('TARGET_GROUP_ID'))
+            cfg['target_topic_id'] = int(environ.get('TARGET_TOPIC_ID'))
+        cfg['metrics_port'] = int(environ['METRICS_PORT']) if environ.get('METRICS_PORT') else None
+        # Weaker alerts are batched into one digest per window (seconds; 0 sends every alert at once)
+        cfg['notify_digest_window'] = (float(environ['NOTIFY_DIGEST_WINDOW'])
+                                       if environ.get('NOTIFY_DIGEST_WINDOW') else None)
+        cfg['notify_digest_size'] = int(environ['NOTIFY_DIGEST_SIZE']) if environ.get('NOTIFY_DIGEST_SIZE') else None
+        cfg['notify_immediate_confidence'] = _confidence_name(environ.get('NOTIFY_IMMEDIATE_CONFIDENCE'))
+    except (ValueError, TypeError, AttributeError) as e:  # json.JSONDecodeError is a ValueError
+        raise ConfigError(f"Error parsing environment variables: {e}") from e
+    return cfg
+
+
+def _from_ini(path: str, credentials_only: bool) -> dict:
+    if not os.path.exists(path):
+        raise ConfigError(f"{path} not found and no environment variables set! "
+                          "Please copy config.example.ini to config.ini and fill in your details.")
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    cfg = {'source': path}
+    try:
+        cfg['api_id'] = parser.getint('telegram_credentials', 'api_id')
+        cfg['api_hash'] = parser.get('telegram_credentials', 'api_hash')
+        cfg['phone_number'] = parser.get('telegram_credentials', 'phone_number')
+        cfg['session_name'] = parser.get('bot_settings', 'session_name', fallback=DEFAULT_SESSION_NAME)
+        cfg['session_backend'] = parser.get('bot_settings', 'session_backend', fallback=DEFAULT_SESSION_BACKEND)
+        cfg['session_max_entities'] = parser.getint('bot_settings', 'session_max_entities', fallback=None)
+        cfg['session_string'] = parser.get('bot_settings', 'session_string', fallback=None)
+        # [account.<name>] sections add accounts sharing the listening and sending load
+        cfg['accounts'] = _accounts(cfg, [dict(parser.items(s), name=s[len('account.'):])
+                                          for s in parser.sections() if s.startswith('account.')])
+        if credentials_only:
+            return cfg
+        cfg['notify_user_id'] = parser.getint('bot_settings', 'notify_user_id')
+        # [route.<name>] sections replace the single target_group_id/target_topic_id pair
+        route_sections = [s for s in parser.sections() if s.startswith('route.')]
+        if route_sections:
+            cfg['routes'] = [dict(parser.items(s), name=s[len('route.'):]) for s in route_sections]
+        else:
+            cfg['target_group_id'] = parser.getint('bot_settings', 'target_group_id')
+            cfg['target_topic_id'] = parser.getint('bot_settings', 'target_topic_id')
+        cfg['metrics_port'] = parser.getint('bot_settings', 'metrics_port', fallback=None)
+        # Weaker alerts are batched into one digest per window (seconds; 0 sends every alert at once)
+        cfg['notify_digest_window'] = parser.getfloat('bot_settings', 'notify_digest_window', fallback=None)
+        cfg['notify_digest_size'] = parser.getint('bot_settings', 'notify_digest_size', fallback=None)
+        cfg['notify_immediate_confidence'] = _confidence_name(
+            parser.get('bot_settings', 'notify_immediate_confidence', fallback=None))
+    except (configparser.NoSectionError, configparser.NoOptionError, ValueError) as e:
+        # Unreplaced YOUR_..._HERE placeholders fail the integer conversions and end up here
+        raise ConfigError(f"Error in {path}: {e}. "
+                          "Please ensure it is correctly formatted based on config.example.ini.") from e
+    return cfg
+
+
+def _confidence_name(value: str | None) -> str | None:
+    if value is None:
+        return None
+    name = value.strip().lower()
+    if name not in CONFIDENCE_NAMES:
+        raise ValueError(f"Unknown confidence '{value}' (known: {', '.join(CONFIDENCE_NAMES)})")
+    return name
+
+
+def _accounts(cfg: dict, extra_accounts: list[dict]) -> list[dict]:
+    accounts = [{'name': cfg['session_name'], 'session_name': cfg['session_name'],
+                 'phone_number': cfg['phone_number'], 'session_string': cfg['session_string']}]
+    for raw in extra_accounts:
+        name = raw.get('name') or raw.get('session_name')
+        if not name:
+            raise ValueError(f"Account needs a name or session_name: {raw}")
+        accounts.append({'name': name, 'session_name': raw.get('session_name') or name,
+                         'phone_number': raw.get('phone_number'), 'session_string': raw.get('session_string')})
+    names = [account['session_name'] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Accounts must use different session names: {names}")
+    return accounts
+
+
+def session_path(cfg: dict, sessions_dir: str = SESSIONS_DIR) -> str:
+    """Path of the session files (without the .session/.snapshot suffix)."""
+    return os.path.join(sessions_dir, cfg['session_name'])
@@ -0,0 +1,286 @@
+"""
+Message handling pipeline for the offer monitor.
+
+Takes one incoming message from a routed group topic (see routing.py) through parsing →
+sender lookup → auto-response or owner notification. Kept free of Telethon imports and module-level
+setup so it can be driven by the live bot and by offline tooling (see replay_messages.py);
+outgoing messages go through an OutboundDispatcher wrapping any client with `send_message`.
+"""
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+
+from message_parser import Confidence, OfferType, ParsedOffer
+from notification_digest import NotificationDigest
+from offer_book import OfferBook
+from parse_executor import ParseExecutor
+from rate_analytics import RateAnalytics
+from routing import Route, resolve_topic_id
+from utils.dedup_store import DedupStore
+from utils.offer_history import OfferHistory
+from utils.metrics import METRICS
+from utils.outbound_queue import PRIORITY_AUTO_RESPONSE, PRIORITY_NOTIFICATION, OutboundDispatcher
+from utils.sender_cache import SenderCache
+
+logger = logging.getLogger(__name__)
+
+AUTO_RESPONSE_TEXT = "Привет, если рубли еще нужны, скажи пожалуйста куда перевести, в течении часа переведу"
+
+# Don't auto-respond to the same sender again within this window (seconds)
+AUTO_RESPONSE_COOLDOWN = 24 * 3600
+# Don't alert the owner again about the same text from the same sender within this window (seconds)
+REPOST_COOLDOWN = 6 * 3600
+
+
+def alert_key(message) -> str:
+    """Cooldown key marking that the owner was alerted about `message`, so its edits are known after a restart."""
+    return f"alert:{message.chat_id}:{message.id}"
+
+
+def would_auto_respond(route: Route, parsed_offer: ParsedOffer, sender_id) -> bool:
+    """Whether `parsed_offer` from `sender_id` gets an auto-response instead of an owner alert on `route`."""
+    return (route.auto_respond and
+            parsed_offer.offer_type is OfferType.COUNTERPARTY_BUYS_RUB and
+            parsed_offer.confidence >= Confidence.MEDIUM and
+            sender_id is not None)
+
+
+def offer_fingerprint(sender_id, text: str) -> str:
+    """Identifies a repost: same sender and same text up to case and whitespace."""
+    normalized = " ".join(text.lower().split())
+    return f"{sender_id}:{hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()}"
+
+
+def message_link(message) -> str:
+    """Builds a t.me link to the message, preferring the public group username when there is one."""
+    # Format: https://t.me/c/CHAT_ID/MSG_ID (CHAT_ID without -100 prefix)
+    # Or for groups with username: https://t.me/GROUP_USERNAME/MSG_ID
+    if hasattr(message.chat, 'username') and message.chat.username:
+        return f"https://t.me/{message.chat.username}/{message.id}"
+    return f"https://t.me/c/{str(message.chat_id).replace('-100', '')}/{message.id}"
+
+
+def posted_at(message) -> float:
+    """Posting time of `message` as a Unix timestamp (now if the message carries no date)."""
+    date = getattr(message, 'date', None)
+    if isinstance(date, datetime):
+        return date.timestamp()
+    if isinstance(date, (int, float)):
+        return float(date)
+    return time.time()
+
+
+def build_notification(parsed_offer: ParsedOffer, sender_name: str, msg_link: str,
+                       rate_vs_market: str | None = None) -> str:
+    """Formats the Markdown alert sent to the bot owner for a parsed offer."""
+    offer_type = parsed_offer.offer_type.label
+    confidence = parsed_offer.confidence.label
+    amount_gbp = parsed_offer.amount_gbp if parsed_offer.amount_gbp is not None else "N/A"
+    amount_rub = parsed_offer.amount_rub if parsed_offer.amount_rub is not None else "N/A"
+    original_msg_text = parsed_offer.original_message
+
+    notification_lines = [
+        "🔔 *New Exchange Offer Alert!* 🔔",
+        "-------------------------------------",
+        f"*Type*: {offer_type.replace('_', ' ').title()}",
+        f"*Confidence*: {confidence.title()}",
+        f"*GBP Amount*: {amount_gbp}",
+        f"*RUB Amount*: {amount_rub}",
+    ]
+    if rate_vs_market:
+        notification_lines.append(f"*Rate vs Market*: {rate_vs_market}")
+    notification_lines += [
+        "-------------------------------------",
+        f"*Original Message (from {sender_name})*:",
+        f"> {original_msg_text}",
+        "-------------------------------------",
+        f"Link to message: {msg_link}"
+    ]
+    return "\n".join(notification_lines)
+
+
+class HandlerContext:
+    """
+    The shared state the handlers work with; only `outbound` is required.
+    Senders are looked up through `sender_cache` if given.
+    With `dedup`, already processed messages are skipped and repeat auto-responses/alerts are suppressed.
+    With `parser`, long messages are parsed off the event loop within its time budget.
+    With `book`, every offer with an amount is also recorded in the offer book.
+    With `analytics`, offers stating both amounts are scored against the recent rate band,
+    which is shown in the owner notification.
+    With `history`, every routed message is appended to the offer history with its parse result.
+    With `notifier`, owner alerts go through it (weaker ones batched into digests) instead of
+    straight onto `outbound`.
+    """
+    __slots__ = ("outbound", "sender_cache", "dedup", "parser", "book", "analytics", "history", "notifier")
+
+    def __init__(self, outbound: OutboundDispatcher, sender_cache: SenderCache | None = None,
+                 dedup: DedupStore | None = None, parser: ParseExecutor | None = None, book: OfferBook | None = None,
+                 analytics: RateAnalytics | None = None, history: OfferHistory | None = None,
+                 notifier: NotificationDigest | None = None):
+        self.outbound = outbound
+        self.sender_cache = sender_cache
+        self.dedup = dedup
+        self.parser = parser
+        self.book = book
+        self.analytics = analytics
+        self.history = history
+        self.notifier = notifier
+
+
+async def handle_new_message(message, route: Route, context: HandlerContext):
+    """
+    Processes one message from a routed group topic: auto-responds to ruble buyers (if the route
+    allows it), otherwise notifies the route's owner. Topic filtering happens before this is called.
+    The sender is only looked up once the parser has found an offer.
+    Replies are queued on `context.outbound` and sent by its dispatcher task, so the handler never
+    waits on Telegram. See HandlerContext for what each optional part of `context` adds.
+    """
+    received_at = time.perf_counter()
+    dedup = context.dedup
+    if dedup is None:
+        await _process_message(message, route, context, received_at)
+        return
+    if not dedup.claim_message(message.chat_id, message.id, route.name):
+        logger.debug(f"--- IGNORING (Already Processed) --- Message ID {message.id}")
+        return
+    # Recorded as processed only once handled, so a failure or crash leaves it to catch-up
+    try:
+        await _process_message(message, route, context, received_at)
+    except BaseException:
+        dedup.release_message(message.chat_id, message.id)
+        raise
+    dedup.complete_message(message.chat_id, message.id)
+
+
+async def _process_message(message, route: Route, context: HandlerContext, received_at: float):
+    outbound, sender_cache, dedup, parser = context.outbound, context.sender_cache, context.dedup, context.parser
+    book, analytics, history, notifier = context.book, context.analytics, context.history, context.notifier
+    notify_user_id = route.notify_user_id
+    METRICS.inc("messages_total", route=route.name)
+    logger.debug(f"==== [{route.name}] TARGET TOPIC MESSAGE from sender ID {getattr(message, 'sender_id', None)} ====")
+    logger.debug(f"  Original Text: {message.text}")
+
+    parse_started = time.perf_counter()
+    parsed_offer = await parser.parse(route.parse, message.text) if parser is not None else route.parse(message.text)
+    offer_labels = {
+        "offer_type": parsed_offer.offer_type.label if parsed_offer else "none",
+        "confidence": parsed_offer.confidence.label if parsed_offer else "none",
+    }
+    METRICS.observe("parse_seconds", time.perf_counter() - parse_started, **offer_labels)
+    if history is not None:
+        history.append(posted_at(message), message.chat_id, message.id, message.text,
+                       getattr(message, 'sender_id', None), resolve_topic_id(message), parsed_offer)
+
+    if parsed_offer:
+        METRICS.inc("offers_total", **offer_labels)
+        with METRICS.timer("stage_seconds", stage="get_sender"):
+            sender = await (sender_cache.get_sender(message) if sender_cache is not None else message.get_sender())
+        sender_name = (f"{sender.first_name} {sender.last_name or ''}").strip() if sender else "Unknown Sender"
+        logger.info(f"  Parsed Offer from {sender_name}: {parsed_offer}")
+
+        # Store sender information for potential auto-response
+        sender_id = sender.id if sender else None
+        repost_key = f"offer:{offer_fingerprint(sender_id, message.text)}"
+        is_repost = dedup is not None and dedup.in_cooldown(repost_key)
+        # Reposts are not new market information: counting them would skew the band toward frequent posters
+        rate_score = analytics.observe(parsed_offer) if analytics is not None and not is_repost else None
+        if book is not None:
+            book.add(parsed_offer, (message.chat_id, message.id), sender_id, sender_name, message_link(message),
+                     posted_at(message), route.name)
+
+        # Check if this is a ruble buying offer that should trigger auto-response
+        should_auto_respond = would_auto_respond(route, parsed_offer, sender_id)
+
+        def notify_owner(failure=None):
+            if dedup is not None:
+                dedup.start_cooldown(alert_key(message), REPOST_COOLDOWN)
+            rate_vs_market = rate_score.describe() if rate_score is not None else None
+            notification_text = build_notification(parsed_offer, sender_name, message_link(message), rate_vs_market)
+            if notifier is not None:
+                notifier.notify(notify_user_id, (message.chat_id, message.id), parsed_offer, notification_text,
+                                sender_name, message_link(message), rate_vs_market, received_at=received_at,
+                                parse_mode='md')
+                return
+            outbound.enqueue(notify_user_id, notification_text, priority=PRIORITY_NOTIFICATION,
+                             description=f"notification for message ID {message.id}",
+                             kind="notification", received_at=received_at,
+                             parse_mode='md') # Using Markdown
+
+        if should_auto_respond and dedup is not None and dedup.in_cooldown(f"auto:{sender_id}"):
+            logger.info(f"Auto-response to {sender_name} (ID: {sender_id}) skipped: already responded recently.")
+        elif should_auto_respond:
+            # Send auto-response to the person looking to buy rubles;
+            # if it fails, fall back to notification to bot owner
+            queued = outbound.enqueue(sender_id, AUTO_RESPONSE_TEXT, priority=PRIORITY_AUTO_RESPONSE,
+                                      on_failure=notify_owner,
+                                      description=f"auto-response to {sender_name} (ID: {sender_id})",
+                                      kind="auto_response", received_at=received_at,
+                                      via_message=(message.chat_id, message.id))
+            if not queued:
+                notify_owner()
+            elif dedup is not None:
+                dedup.start_cooldown(f"auto:{sender_id}", AUTO_RESPONSE_COOLDOWN)
+        elif is_repost:
+            logger.info(f"Notification for message ID {message.id} skipped: repost of a recent offer.")
+        else:
+            # Not auto-responding: send notification to bot owner
+            notify_owner()
+        if dedup is not None and not is_repost:
+            dedup.start_cooldown(repost_key, REPOST_COOLDOWN)
+    else:
+        logger.debug("  Parser Result: No relevant offer identified by parser.")
+    logger.debug("==============================================")
+
+
+async def handle_edited_message(message, route: Route, context: HandlerContext):
+    """
+    Re-parses an edited message from a routed topic. If the message is still pending in a digest or
+    was alerted since startup, the offer goes to `context.notifier` as an edit, which folds it into
+    the digest or alerts again only if the offer got stronger. Any other edit is held to the rules
+    of a new message: it is not alerted if the offer would be auto-responded, the message was
+    alerted before a restart, or the sender's auto-response or repost cooldown is running.
+    Edits never trigger auto-responses.
+    """
+    outbound, sender_cache, dedup = context.outbound, context.sender_cache, context.dedup
+    parser, notifier = context.parser, context.notifier
+    received_at = time.perf_counter()
+    parsed_offer = await parser.parse(route.parse, message.text) if parser is not None else route.parse(message.text)
+    if not parsed_offer:
+        return
+    sender = await (sender_cache.get_sender(message) if sender_cache is not None else message.get_sender())
+    sender_name = (f"{sender.first_name} {sender.last_name or ''}").strip() if sender else "Unknown Sender"
+    logger.info(f"[{route.name}] Edited message ID {message.id} parsed as {parsed_offer}")
+
+    key = (message.chat_id, message.id)
+    if notifier is None or not notifier.knows(route.notify_user_id, key):
+        sender_id = sender.id if sender else None
+        repost_key = f"offer:{offer_fingerprint(sender_id, message.text)}"
+        if would_auto_respond(route, parsed_offer, sender_id):
+            skipped = "the offer is auto-responded, not alerted"
+        elif dedup is not None and dedup.in_cooldown(alert_key(message)):
+            skipped = "already alerted before a restart"
+        elif dedup is not None and dedup.in_cooldown(f"auto:{sender_id}"):
+            skipped = "the sender was auto-responded recently"
+        elif dedup is not None and dedup.in_cooldown(repost_key):
+            skipped = "repost of a recent offer"
+        else:
+            skipped = None
+        if skipped:
+            logger.info(f"Notification for edited message ID {message.id} skipped: {skipped}.")
+            return
+        if dedup is not None:
+            dedup.start_cooldown(repost_key, REPOST_COOLDOWN)
+    if dedup is not None:
+        dedup.start_cooldown(alert_key(message), REPOST_COOLDOWN)
+
+    notification_text = f"✏️ Edited message\n{build_notification(parsed_offer, sender_name, message_link(message))}"
+    if notifier is not None:
+        notifier.notify(route.notify_user_id, key, parsed_offer, notification_text, sender_name, message_link(message),
+                        received_at=received_at, edited=True, parse_mode='md')
+        return
+    outbound.enqueue(route.notify_user_id, notification_text, priority=PRIORITY_NOTIFICATION,
+                     description=f"notification for edited message ID {message.id}",
+                     kind="notification", received_at=received_at, parse_mode='md')
@@ -1,158 +1,533 @@
+import bisect
+import enum
 import re
 import logging
+import struct
+from dataclasses import dataclass, replace
 
 logger = logging.getLogger(__name__)
 
-# Adjusted keywords to be more flexible with text between action and currency
+# Character folds applied by `normalize_text` to every message, so spelling variants need
+# no patterns of their own. Patterns are not folded: write them in the folded form.
+# Latin look-alikes of Cyrillic letters (either case); "B", "H", "M" and "T" only look
+# Cyrillic as capitals. They are only folded in runs touching a Cyrillic letter
+# ("пpoдам", "pyб"), so Latin words such as "gbp" keep their spelling.
+HOMOGLYPHS = {
+    "a": "а", "c": "с", "e": "е", "k": "к", "o": "о", "p": "р", "x": "х", "y": "у",
+    "B": "в", "H": "н", "M": "м", "T": "т",
+}
+CURRENCY_SYMBOLS = {"£": " gbp ", "￡": " gbp ", "₤": " gbp ", "💷": " gbp ", "₽": " руб "}
+# Unicode spaces (incl. no-break and thin spaces used as digit separators) become plain spaces;
+# zero-width characters and apostrophe digit separators ("1'000") are dropped
+SPACE_CHARS = "\t\u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u202f\u205f\u3000"
+DROPPED_CHARS = "\u00ad\u200b\u200c\u200d\u2060\ufeff\ufe0f'’"
+# Other emoji need no fold: like the space they would become, they end a word and count
+# as one character of distance
+
+# Folds applied after lowercasing, so "ё" is the only letter among them
+_CHAR_FOLDS = (
+    ("ё", "е"),
+    *CURRENCY_SYMBOLS.items(),
+    *((char, " ") for char in SPACE_CHARS),
+    *((char, "") for char in DROPPED_CHARS),
+)
+_HOMOGLYPH_TABLE = str.maketrans({**HOMOGLYPHS, **{char.upper(): folded for char, folded in HOMOGLYPHS.items()
+                                                   if char.islower()}})
+_LOOKALIKES = re.escape("".join(map(chr, _HOMOGLYPH_TABLE)))
+_CYRILLIC = "а-яА-ЯёЁ"
+# A run of look-alikes with a Cyrillic letter right before or right after it. Starting with
+# the look-alike class lets the regex engine skip plain Cyrillic text quickly.
+_HOMOGLYPH_RUN_RE = re.compile(
+    f"[{_LOOKALIKES}](?:(?<=[{_CYRILLIC}].)|(?=[{_LOOKALIKES}]*[{_CYRILLIC}]))[{_LOOKALIKES}]*")
+
+
+def _fold_homoglyphs(match: re.Match) -> str:
+    return match.group().translate(_HOMOGLYPH_TABLE)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Folds a message to the form the patterns are written against: lowercase, Latin look-alikes
+    in Cyrillic words and "ё" folded to plain Cyrillic, currency symbols spelled out
+    ("£" -> "gbp", "₽" -> "руб"), Unicode spaces unified, zero-width characters and
+    apostrophe digit separators dropped. Only look-alike runs are translated character by
+    character; the other folds are rare, so each is a substring check and, if present, a replace.
+    """
+    text = _HOMOGLYPH_RUN_RE.sub(_fold_homoglyphs, text).lower()
+    for char, folded in _CHAR_FOLDS:
+        if char in text:
+            text = text.replace(char, folded)
+    return text
+
+
 SELL_GBP_KEYWORDS = [
-    r"продам.*фунты", r"продам.*гбп", r"продам.*gbp", r"продам.*£",
-    r"меняю.*фунты.*на.*рубли", r"меняю.*гбп.*на.*руб", r"меняю.*gbp.*на.*rub", r"меняю.*£.*на.*руб",
-    r"обменяю.*фунты.*на.*рубли", r"обменяю.*гбп.*на.*руб", r"обменяю.*gbp.*на.*rub", r"обменяю.*£.*на.*руб",
-    r"отдам.*фунты.*за.*рубли", r"отдам.*гбп.*за.*руб", r"отдам.*gbp.*за.*rub", r"отдам.*£.*за.*руб",
+    r"продам.*фунт", r"продам.*гбп", r"продам.*gbp",
+    # "меняю" also covers "обменяю"
+    r"меняю.*фунт.*на.*руб", r"меняю.*гбп.*на.*руб", r"меняю.*gbp.*на.*rub", r"меняю.*gbp.*на.*руб",
+    r"отдам.*фунт.*за.*руб", r"отдам.*гбп.*за.*руб", r"отдам.*gbp.*за.*rub", r"отдам.*gbp.*за.*руб",
     # Simpler patterns if context is clear, but can be noisy. Retaining specific versions too.
-    r"фунты.*на.*рубли", r"гбп.*на.*руб", r"gbp.*на.*rub", r"£.*на.*руб", # Order might matter
-    r"продаю.*фунты", r"продаю.*гбп", r"продаю.*gbp", r"продаю.*£",
-    r"есть.*фунты.*надо.*рубли", r"есть.*гбп.*надо.*руб", r"есть.*gbp.*надо.*rub", r"есть.*£.*надо.*руб",
-    r"предлагаю.*фунты", r"предлагаю.*гбп", r"предлагаю.*gbp", r"предлагаю.*£", # Offering GBP
+    r"фунт.*на.*руб", r"гбп.*на.*руб", r"gbp.*на.*rub", r"gbp.*на.*руб", # Order might matter
+    r"продаю.*фунт", r"продаю.*гбп", r"продаю.*gbp",
+    r"есть.*фунт.*надо.*руб", r"есть.*гбп.*надо.*руб", r"есть.*gbp.*надо.*rub", r"есть.*gbp.*надо.*руб",
+    r"предлагаю.*фунт", r"предлагаю.*гбп", r"предлагаю.*gbp", # Offering GBP
 ]
 
 BUY_RUB_KEYWORDS = [
-    r"куплю.*рубли", r"куплю.*руб", r"куплю.*rub",
-    r"нужны.*рубли.*за.*фунты", r"нужны.*руб.*за.*гбп", r"нужны.*rub.*за.*gbp", r"нужны.*руб.*за.*£",
-    r"возьму.*рубли.*за.*фунты", r"возьму.*руб.*за.*гбп", r"возьму.*rub.*за.*gbp", r"возьму.*руб.*за.*£",
-    r"покупаю.*рубли", r"покупаю.*руб", r"покупаю.*rub",
-    r"надо.*рубли.*есть.*фунты", r"надо.*руб.*есть.*гбп", r"надо.*rub.*есть.*gbp", r"надо.*руб.*есть.*£", 
-    r"ищу.*рубли", # Looking for RUB
+    r"куплю.*руб", r"куплю.*rub",
+    r"нужны.*руб.*за.*фунт", r"нужны.*руб.*за.*гбп", r"нужны.*rub.*за.*gbp", r"нужны.*руб.*за.*gbp",
+    r"возьму.*руб.*за.*фунт", r"возьму.*руб.*за.*гбп", r"возьму.*rub.*за.*gbp", r"возьму.*руб.*за.*gbp",
+    r"покупаю.*руб", r"покупаю.*rub",
+    r"надо.*руб.*есть.*фунт", r"надо.*руб.*есть.*гбп", r"надо.*rub.*есть.*gbp", r"надо.*руб.*есть.*gbp",
+    r"ищу.*руб", # Looking for RUB
 ]
 
-CURRENCY_GBP_REGEX = r"\b(gbp|гбп|фунт(?:ов|а|ы|ами|ах)?|£)\b" # Added £ and more endings for фунт
-CURRENCY_RUB_REGEX = r"\b(rub|руб(?:л(?:ей|и|я|ь|ями|ях))?|р)\b" # Added more endings for рубль
+CURRENCY_GBP_REGEX = r"\b(gbp|гбп|фунт\w*)\b" # "£" is folded to "gbp"
+# "₽" is folded to "руб". A lone "р" (or a Latin "p" typed for it) only counts right after
+# an amount ("500р", "500 р", "5к р"); `tokenize_amounts` checks that
+CURRENCY_RUB_REGEX = r"\b(rub|rur|руб\w*)\b|([рp])\b"
+
+# Sell keywords that still count when only GBP is mentioned (e.g. "продаю £50")
+IMPLIED_GBP_SELL_KEYWORDS = [r"продам.*gbp", r"продаю.*gbp", r"отдам.*gbp", r"предлагаю.*gbp"]
+
+
+class KeywordScan:
+    """
+    One message as seen by a KeywordMatcher. Literal lookups and the line split are cached,
+    so matching several category groups against the same message costs no second scan.
+    """
+    __slots__ = ("_matcher", "_text", "_anchored", "_present", "_lines")
+
+    def __init__(self, matcher: "KeywordMatcher", text: str):
+        self._matcher = matcher
+        self._text = text
+        # No anchor means no literal chain can match: the common case for chatter
+        self._anchored = matcher._anchor_scan is not None and matcher._anchor_scan.search(text) is not None
+        self._present = {}  # literal -> whether it occurs in the text
+        self._lines = None
+
+    def _has(self, literal: str) -> bool:
+        present = self._present.get(literal)
+        if present is None:
+            present = self._present[literal] = literal in self._text
+        return present
+
+    def match(self, categories: tuple[str, ...] | None = None) -> tuple[str, str] | None:
+        """(category, pattern) of the first matching pattern in list order, or None."""
+        return next(self.iter_matches(categories), None)
+
+    def iter_matches(self, categories: tuple[str, ...] | None = None):
+        """Yields (category, pattern) for every pattern that matches, in list order."""
+        for category, pattern, compiled, chain in self._matcher._entries:
+            if categories is not None and category not in categories:
+                continue
+            if chain is None:
+                if compiled.search(self._text):
+                    yield category, pattern
+                continue
+            if not self._anchored or not all(map(self._has, chain)):
+                continue
+            if self._lines is None:
+                self._lines = self._text.split("\n")
+            if KeywordMatcher._chain_in_lines(self._lines, chain):
+                yield category, pattern
+
+
+class KeywordMatcher:
+    """
+    Matches the ordered keyword lists against a message without running the patterns one by one.
+
+    Every keyword pattern is a chain of literals joined by `.*`. One plain alternation of
+    the literals that start a chain is searched first and stops at the first hit; a message
+    without any of them (most chatter) is done after that. Otherwise patterns are checked in
+    the original priority order, and the first that matches ends the search: a pattern is
+    skipped unless all its literals occur in the text, and is then verified with sequential
+    `str.find` calls per line (same semantics as `.*`, which stops at newlines), so the cost
+    stays linear in the text length without regex backtracking.
+    """
+
+    def __init__(self, categories: list[tuple[str, list[str]]]):
+        self._entries = []  # (category, pattern, compiled regex, literal chain or None)
+        self._ids = {}  # (category, pattern) -> pattern id (index in list order)
+        anchors = set()
+        for category, patterns in categories:
+            for pattern in patterns:
+                chain = self._literal_chain(pattern)
+                if chain is not None:
+                    anchors.add(chain[0])
+                self._ids[(category, pattern)] = len(self._entries)
+                self._entries.append((category, pattern, re.compile(pattern), chain))
+        self._anchor_scan = re.compile("|".join(map(re.escape, sorted(anchors)))) if anchors else None
+
+    @property
+    def patterns(self) -> list[tuple[str, str]]:
+        """(category, pattern) for every keyword pattern, in list order."""
+        return [(category, pattern) for category, pattern, *_ in self._entries]
+
+    def pattern_id(self, category: str, pattern: str) -> int:
+        """Stable id of a pattern: its position in `patterns`."""
+        return self._ids[(category, pattern)]
+
+    @staticmethod
+    def _literal_chain(pattern: str) -> tuple[str, ...] | None:
+        parts = [part for part in pattern.split(".*") if part]
+        if not parts or any(re.escape(part) != part for part in parts):
+            return None  # Not a plain literal chain; verify with the regex
+        return tuple(parts)
+
+    @staticmethod
+    def _chain_in_lines(lines: list[str], chain: tuple[str, ...]) -> bool:
+        for line in lines:
+            pos = 0
+            for literal in chain:
+                pos = line.find(literal, pos)
+                if pos < 0:
+                    break
+                pos += len(literal)
+            else:
+                return True
+        return False
+
+    def scan(self, text: str) -> KeywordScan:
+        """Prepares `text` for matching; use the result for every category group of one message."""
+        return KeywordScan(self, text)
+
+    def match(self, text: str, categories: tuple[str, ...] | None = None) -> tuple[str, str] | None:
+        """
+        Returns (category, pattern) of the first pattern that matches `text`, honouring
+        list order, or None. `categories` restricts which categories are considered.
+        """
+        return self.scan(text).match(categories)
+
+    def iter_matches(self, text: str, categories: tuple[str, ...] | None = None):
+        """Yields (category, pattern) for every pattern that matches `text`, in list order."""
+        return self.scan(text).iter_matches(categories)
+
+
+KEYWORD_MATCHER = KeywordMatcher([
+    ("sell_gbp", SELL_GBP_KEYWORDS),
+    ("buy_rub", BUY_RUB_KEYWORDS),
+    ("implied_gbp_sell", IMPLIED_GBP_SELL_KEYWORDS),
+])
+
+# Max character gap between a number and a currency mention for them to be linked
+AMOUNT_PROXIMITY_WINDOW = 10
+
+_CURRENCY_KEYS = {CURRENCY_GBP_REGEX: "gbp", CURRENCY_RUB_REGEX: "rub"}
+# Same numbers as `\d[\d\s.,]*\d|\d+`, written so the regex engine can skip to the next digit
+_NUMBER_PATTERN = r"(?P<num>\d(?:[\d\s.,]*\d)?)(?:\s*(?P<k>[кk]))?"
+_NUMBER_RE = re.compile(_NUMBER_PATTERN)
+_NUMBER_SEPARATORS_RE = re.compile(r"[\s.,]")
+# The word mentions of CURRENCY_GBP_REGEX and CURRENCY_RUB_REGEX in one regex. Capture groups
+# or a leading \b would stop the regex engine from skipping ahead to the first letters, so the
+# word start is checked per hit and the currency told apart by the first letter.
+# Texts are normalized (lowercase) before tokenizing, so no IGNORECASE
+_CURRENCY_MENTION_RE = re.compile(r"(?:gbp|гбп|фунт\w*|rub|rur|руб\w*)\b")
+_GBP_INITIALS = "gгф"
+# A lone ruble sign right after an amount: "500р", "500 р", "5к р"
+_RUBLE_SIGN_RE = re.compile(r"[кk]? ?[рp]\b")
+# Cheap test for a GBP mention, which every offer without a keyword match needs
+_GBP_HINT_RE = re.compile(r"gbp|гбп|фунт")
+
+
+class AmountTokens:
+    """Numbers (value and span) and currency mention spans found in a message."""
+    __slots__ = ("numbers", "mentions")
+
+    def __init__(self):
+        self.numbers = []  # (value, start, end) in text order
+        self.mentions = {"gbp": [], "rub": []}  # currency key -> [(start, end)] in text order
+
+
+def tokenize_amounts(text: str) -> AmountTokens:
+    """
+    Collects numbers with their `к/k` multiplier and GBP/RUB mentions in one scan for numbers
+    and one for currency words, both linear in the text length. A lone "р" is only a RUB
+    mention right after a number.
+    """
+    tokens = AmountTokens()
+    ruble_signs = []
+    for match in _NUMBER_RE.finditer(text):
+        number_end = match.end("num")
+        value = _number_value(match.group("num"), match.group("k"))
+        if value is not None:
+            tokens.numbers.append((value, match.start("num"), number_end))
+        sign = _RUBLE_SIGN_RE.match(text, number_end)
+        if sign is not None:
+            ruble_signs.append((sign.end() - 1, sign.end()))
+    for match in _CURRENCY_MENTION_RE.finditer(text):
+        start = match.start()
+        if start and (text[start - 1].isalnum() or text[start - 1] == "_"):
+            continue  # Inside a word: no \b before the mention
+        tokens.mentions["gbp" if text[start] in _GBP_INITIALS else "rub"].append(match.span())
+    if ruble_signs:
+        tokens.mentions["rub"] = sorted(tokens.mentions["rub"] + ruble_signs)
+    return tokens
+
+
+def _number_value(num_str: str, k_suffix: str | None) -> float | None:
+    try:
+        return float(_NUMBER_SEPARATORS_RE.sub("", num_str)) * (1000 if k_suffix else 1)
+    except ValueError as e:
+        logger.debug(f"Error during amount extraction for '{num_str}': {e}")
+        return None
+
+
+def _nearest_number(numbers: list, mentions: list, skip: int | None = None) -> tuple | None:
+    """(value, gap, index in `numbers`) of the number closest to a mention within the window, else None."""
+    if not numbers or not mentions:
+        return None
+
+    mention_starts = [start for start, _ in mentions]
+    best, best_gap = None, AMOUNT_PROXIMITY_WINDOW
+    for index, (value, num_start, num_end) in enumerate(numbers):
+        if index == skip:
+            continue
+        i = bisect.bisect_left(mention_starts, num_start)
+        for cur_start, cur_end in mentions[max(i - 1, 0):i + 1]:
+            gap = min(abs(num_start - cur_end), abs(cur_start - num_end))
+            if gap < best_gap:
+                best, best_gap = (value, gap, index), gap
+    return best
+
+
+def nearest_amount(numbers: list, mentions: list) -> float | None:
+    """
+    Returns the number closest to any of the currency mentions, provided the gap is
+    within AMOUNT_PROXIMITY_WINDOW characters (e.g. "£50", "50 gbp", "gbp 350").
+    Both lists are in text order, so each number only checks its neighbouring mentions.
+    """
+    nearest = _nearest_number(numbers, mentions)
+    return nearest[0] if nearest else None
+
+
+def split_amounts(tokens: AmountTokens, prefer: str | None = None) -> tuple[float | None, float | None]:
+    """
+    GBP and RUB amounts of a message, each the number nearest to its currency mentions.
+    A number is never both: one near both mentions ("£150 за рубли") goes to the `prefer`
+    currency ("gbp"/"rub"; by default the nearer mention, GBP on a tie) and the other
+    currency takes its next nearest number, if any.
+    """
+    gbp = _nearest_number(tokens.numbers, tokens.mentions["gbp"])
+    rub = _nearest_number(tokens.numbers, tokens.mentions["rub"])
+    if gbp and rub and gbp[2] == rub[2]:
+        if prefer == "gbp" or (prefer is None and gbp[1] <= rub[1]):
+            rub = _nearest_number(tokens.numbers, tokens.mentions["rub"], skip=gbp[2])
+        else:
+            gbp = _nearest_number(tokens.numbers, tokens.mentions["gbp"], skip=rub[2])
+    return gbp[0] if gbp else None, rub[0] if rub else None
+
 
 def extract_amount(text: str, currency_regex_for_this_extraction: str) -> float | None:
     """ 
     Extracts an amount IF it's reasonably close to a specific currency mention defined by the regex.
-    This is still basic but tries to link number to a specific currency type.
+    `text` is expected in `normalize_text` form. Known currency regexes reuse the single-pass
+    tokenizer; any other regex is matched separately.
     """
-    try:
-        # Find all numbers
-        potential_amounts = re.findall(r"(\d[\d\s.,]*\d|\d+)\s*(к|k)?", text, re.IGNORECASE)
-        if not potential_amounts:
-            return None
+    key = _CURRENCY_KEYS.get(currency_regex_for_this_extraction)
+    if key is not None:
+        tokens = tokenize_amounts(text)
+        return nearest_amount(tokens.numbers, tokens.mentions[key])
 
-        # Find all occurrences of the specific currency we're looking for amount for
-        currency_mentions = list(re.finditer(currency_regex_for_this_extraction, text, re.IGNORECASE))
-        if not currency_mentions:
+    numbers = []
+    for match in _NUMBER_RE.finditer(text):
+        value = _number_value(match.group("num"), match.group("k"))
+        if value is not None:
+            numbers.append((value, match.start("num"), match.end("num")))
+    mentions = [m.span() for m in re.finditer(currency_regex_for_this_extraction, text, re.IGNORECASE)]
+    return nearest_amount(numbers, mentions)
+
+class OfferType(enum.IntEnum):
+    COUNTERPARTY_SELLS_GBP = 1
+    COUNTERPARTY_BUYS_RUB = 2
+    POTENTIAL_MENTION = 3
+
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+
+
+class Confidence(enum.IntEnum):
+    LOW = 1
+    MEDIUM = 2
+    HIGH = 3
+
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+
+
+# Binary layout: offer type, confidence, pattern id, GBP and RUB amounts in minor units, text length
+_OFFER_HEADER = struct.Struct("<BBHqqI")
+_NO_PATTERN = 0xFFFF
+_NO_AMOUNT = -(1 << 63)
+
+
+def to_minor_units(amount: float | None) -> int | None:
+    """Pence/kopecks for an amount in pounds/rubles."""
+    return None if amount is None else round(amount * 100)
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedOffer:
+    """
+    A parsed offer. Amounts are kept exactly in minor units (pence, kopecks); `pattern_id`
+    is the KEYWORD_MATCHER pattern that decided the classification, if any. `to_bytes()`
+    gives a fixed-layout header followed by the UTF-8 text, which is also what pickling
+    uses, so offers cross process boundaries compactly. `as_dict()` is the dict returned
+    by `parse_message_for_offer`.
+    """
+    offer_type: OfferType
+    confidence: Confidence
+    amount_gbp_minor: int | None
+    amount_rub_minor: int | None
+    pattern_id: int | None
+    original_message: str
+
+    @property
+    def amount_gbp(self) -> float | None:
+        return None if self.amount_gbp_minor is None else self.amount_gbp_minor / 100
+
+    @property
+    def amount_rub(self) -> float | None:
+        return None if self.amount_rub_minor is None else self.amount_rub_minor / 100
+
+    @property
+    def pattern(self) -> str | None:
+        """The deciding keyword pattern as "category:pattern"."""
+        if self.pattern_id is None:
             return None
+        category, pattern = KEYWORD_MATCHER.patterns[self.pattern_id]
+        return f"{category}:{pattern}"
+
+    def with_text(self, text: str) -> "ParsedOffer":
+        return replace(self, original_message=text)
+
+    def as_dict(self) -> dict:
+        return {
+            "offer_type": self.offer_type.label,
+            "amount_gbp": self.amount_gbp,
+            "amount_rub": self.amount_rub,
+            "confidence": self.confidence.label,
+            "original_message": self.original_message,
+        }
+
+    def to_bytes(self) -> bytes:
+        text = self.original_message.encode("utf-8")
+        return _OFFER_HEADER.pack(
+            self.offer_type, self.confidence, _NO_PATTERN if self.pattern_id is None else self.pattern_id,
+            _NO_AMOUNT if self.amount_gbp_minor is None else self.amount_gbp_minor,
+            _NO_AMOUNT if self.amount_rub_minor is None else self.amount_rub_minor, len(text),
+        ) + text
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ParsedOffer":
+        offer_type, confidence, pattern_id, gbp, rub, text_length = _OFFER_HEADER.unpack_from(data)
+        text = bytes(data[_OFFER_HEADER.size:_OFFER_HEADER.size + text_length]).decode("utf-8")
+        return cls(OfferType(offer_type), Confidence(confidence), None if gbp == _NO_AMOUNT else gbp,
+                   None if rub == _NO_AMOUNT else rub, None if pattern_id == _NO_PATTERN else pattern_id, text)
+
+    def __reduce__(self):
+        return ParsedOffer.from_bytes, (self.to_bytes(),)
+
+
+def _offer(offer_type: OfferType, confidence: Confidence, amount_gbp: float | None, amount_rub: float | None,
+           keyword_match: tuple[str, str] | None, text: str) -> ParsedOffer:
+    pattern_id = KEYWORD_MATCHER.pattern_id(*keyword_match) if keyword_match else None
+    return ParsedOffer(offer_type, confidence, to_minor_units(amount_gbp), to_minor_units(amount_rub), pattern_id, text)
 
-        for num_str, k_suffix in potential_amounts:
-            num_val = float(re.sub(r"[\s.,]", "", num_str)) * (1000 if k_suffix.lower() in ['k', 'к'] else 1)
-            
-            # Check proximity: is this number near any of the currency_mentions?
-            # This is a simple character distance check. More sophisticated checks are possible.
-            num_match_obj = re.search(re.escape(num_str.split()[0]), text) # Get match object for the number part
-            if not num_match_obj: continue
-            num_pos = num_match_obj.start()
-
-            for cur_match in currency_mentions:
-                cur_pos_start = cur_match.start()
-                cur_pos_end = cur_match.end()
-                # Check if number is before or after currency mention within a certain window (e.g., 10 chars)
-                # Or if currency symbol is directly attached (e.g. £50, 50gbp)
-                if (abs(num_pos - cur_pos_end) < 10) or (abs(cur_pos_start - (num_match_obj.end())) < 10) or \
-                   (cur_match.group().startswith('£') and num_match_obj.start() == cur_match.end()): # For £50 like patterns
-                    return num_val
-        return None # No number found close to the specified currency
-
-    except Exception as e:
-        logger.debug(f"Error during refined amount extraction: {e}")
-    return None
 
 def parse_message_for_offer(text: str) -> dict | None:
+    """Dict view of `parse_offer(text)`, kept for callers that predate ParsedOffer."""
+    offer = parse_offer(text)
+    return offer.as_dict() if offer is not None else None
+
+
+def parse_offer(text: str, normalized: str | None = None) -> ParsedOffer | None:
+    """Parses `text`; pass `normalized` when the caller already has `normalize_text(text)`."""
     original_text = text
-    text_lower = text.lower()
+    if normalized is None:
+        normalized = normalize_text(text)
     
-    offer_type = None
+    offer_type: OfferType | None = None
     amount_gbp = None
     amount_rub = None
-    confidence = "low"
-
-    for pattern in SELL_GBP_KEYWORDS:
-        if re.search(pattern, text_lower):
-            offer_type = "counterparty_sells_gbp"
-            confidence = "high"
-            logger.info(f"SELL_GBP keyword match on pattern '{pattern}' for text: '{original_text[:70]}...'")
-            amount_gbp = extract_amount(text_lower, CURRENCY_GBP_REGEX)
-            # If RUB is also mentioned, try to get its amount. (Still simplistic)
-            if re.search(CURRENCY_RUB_REGEX, text_lower):
-                amount_rub = extract_amount(text_lower, CURRENCY_RUB_REGEX)
-            break 
-
-    if not offer_type:
-        for pattern in BUY_RUB_KEYWORDS:
-            if re.search(pattern, text_lower):
-                offer_type = "counterparty_buys_rub"
-                confidence = "high"
-                logger.info(f"BUY_RUB keyword match on pattern '{pattern}' for text: '{original_text[:70]}...'")
-                amount_rub = extract_amount(text_lower, CURRENCY_RUB_REGEX)
-                if re.search(CURRENCY_GBP_REGEX, text_lower):
-                    amount_gbp = extract_amount(text_lower, CURRENCY_GBP_REGEX)
-                break
+    confidence = Confidence.LOW
+
+    keywords = KEYWORD_MATCHER.scan(normalized)
+    keyword_match = keywords.match(("sell_gbp", "buy_rub"))
+    # Without a keyword match only a GBP mention can still make an offer (potential mention,
+    # implied sell), so most chatter is done here without tokenizing
+    if keyword_match is None and not _GBP_HINT_RE.search(normalized):
+        logger.debug(f"No relevant offer found in text: '{original_text[:70]}...'")
+        return None
+
+    tokens = tokenize_amounts(normalized)
+    gbp_mentions = tokens.mentions["gbp"]
+    rub_mentions = tokens.mentions["rub"]
+
+    if keyword_match and keyword_match[0] == "sell_gbp":
+        pattern = keyword_match[1]
+        offer_type = OfferType.COUNTERPARTY_SELLS_GBP
+        confidence = Confidence.HIGH
+        logger.info(f"SELL_GBP keyword match on pattern '{pattern}' for text: '{original_text[:70]}...'")
+        # The offered currency has first claim on a number next to both mentions
+        amount_gbp, nearest_rub = split_amounts(tokens, prefer="gbp")
+        # If RUB is also mentioned, try to get its amount. (Still simplistic)
+        if rub_mentions:
+            amount_rub = nearest_rub
+
+    elif keyword_match and keyword_match[0] == "buy_rub":
+        pattern = keyword_match[1]
+        offer_type = OfferType.COUNTERPARTY_BUYS_RUB
+        confidence = Confidence.HIGH
+        logger.info(f"BUY_RUB keyword match on pattern '{pattern}' for text: '{original_text[:70]}...'")
+        nearest_gbp, amount_rub = split_amounts(tokens, prefer="rub")
+        if gbp_mentions:
+            amount_gbp = nearest_gbp
 
     if offer_type:
         # If only one currency was strongly identified by keywords, and an amount was extracted for it,
         # we can proceed. The other currency is implied by the context of the group.
-        if (offer_type == "counterparty_sells_gbp" and amount_gbp is not None) or \
-           (offer_type == "counterparty_buys_rub" and amount_rub is not None):
+        if (offer_type is OfferType.COUNTERPARTY_SELLS_GBP and amount_gbp is not None) or \
+           (offer_type is OfferType.COUNTERPARTY_BUYS_RUB and amount_rub is not None):
             # If the other currency wasn't mentioned, make sure its amount is None
-            if not re.search(CURRENCY_RUB_REGEX, text_lower) and offer_type == "counterparty_sells_gbp":
+            if not rub_mentions and offer_type is OfferType.COUNTERPARTY_SELLS_GBP:
                 amount_rub = None
-            if not re.search(CURRENCY_GBP_REGEX, text_lower) and offer_type == "counterparty_buys_rub":
+            if not gbp_mentions and offer_type is OfferType.COUNTERPARTY_BUYS_RUB:
                 amount_gbp = None
             
-            return {
-                "offer_type": offer_type,
-                "amount_gbp": amount_gbp,
-                "amount_rub": amount_rub,
-                "confidence": confidence,
-                "original_message": original_text
-            }
+            return _offer(offer_type, confidence, amount_gbp, amount_rub, keyword_match, original_text)
         else: # Strong keyword matched, but no amount found for the primary currency of the offer.
               # Or the logic above failed. This might become a potential_mention or None.
-              logger.info(f"Offer type '{offer_type}' (high conf) matched, but failed to extract primary amount. Re-evaluating as potential_mention.")
+              logger.info(f"Offer type '{offer_type.label}' (high conf) matched, but failed to extract primary amount. Re-evaluating as potential_mention.")
               # Fall through to potential_mention logic if both currencies are present.
               pass # Let it fall through to the potential_mention check
 
-    has_gbp_mention = re.search(CURRENCY_GBP_REGEX, text_lower)
-    has_rub_mention = re.search(CURRENCY_RUB_REGEX, text_lower)
+    has_gbp_mention = gbp_mentions
+    has_rub_mention = rub_mentions
 
     if has_gbp_mention and has_rub_mention:
         logger.info(f"Weak signal (potential_mention): Both GBP & RUB mentioned but no strong keywords OR amount extraction failed for high confidence. Text: '{original_text[:70]}...'")
         # If it was a high confidence but amount extraction failed, it might become low here.
         # Ensure amounts are re-extracted if not already done, or if offer_type was reset.
-        current_offer_type_for_potential = offer_type if offer_type else "potential_mention"
-        if amount_gbp is None: amount_gbp = extract_amount(text_lower, CURRENCY_GBP_REGEX)
-        if amount_rub is None: amount_rub = extract_amount(text_lower, CURRENCY_RUB_REGEX)
+        current_offer_type_for_potential = offer_type or OfferType.POTENTIAL_MENTION
+        if offer_type is None: amount_gbp, amount_rub = split_amounts(tokens)
         
-        return {
-            "offer_type": current_offer_type_for_potential, # Could be existing high conf type or potential_mention
-            "amount_gbp": amount_gbp,
-            "amount_rub": amount_rub,
-            "confidence": "low", # Always low if it reaches here due to no strong keywords or amount issues
-            "original_message": original_text
-        }
+        # Could be existing high conf type or potential_mention;
+        # always low confidence if it reaches here due to no strong keywords or amount issues
+        return _offer(current_offer_type_for_potential, Confidence.LOW, amount_gbp, amount_rub,
+                      keyword_match if offer_type else None, original_text)
         
     # Case: Only GBP mentioned with a selling keyword (like "продаю £50")
-    if not offer_type and has_gbp_mention and any(re.search(p,text_lower) for p in [r"продам.*£", r"продаю.*£", r"отдам.*£", r"предлагаю.*£"]):
+    implied_match = keywords.match(("implied_gbp_sell",)) if not offer_type and has_gbp_mention else None
+    if implied_match:
         logger.info(f"Potential GBP sell (implied RUB): Only GBP mentioned with sell keyword. Text: '{original_text[:70]}...'")
-        amount_gbp = extract_amount(text_lower, CURRENCY_GBP_REGEX)
+        amount_gbp = nearest_amount(tokens.numbers, gbp_mentions)
         if amount_gbp:
-            return {
-                "offer_type": "counterparty_sells_gbp", # Implied RUB context
-                "amount_gbp": amount_gbp,
-                "amount_rub": None, # RUB is implied, not extracted
-                "confidence": "medium", # Higher than potential_mention but lower than explicit two-currency match
-                "original_message": original_text
-            }
+            # Implied RUB context, so RUB is not extracted; confidence is higher than
+            # potential_mention but lower than an explicit two-currency match
+            return _offer(OfferType.COUNTERPARTY_SELLS_GBP, Confidence.MEDIUM, amount_gbp, None,
+                          implied_match, original_text)
 
     logger.debug(f"No relevant offer found in text: '{original_text[:70]}...'")
     return None
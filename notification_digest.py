@@ -0,0 +1,160 @@
+"""
+Coalesced owner notifications.
+
+Strong offers (confidence of at least `immediate_confidence`, other than potential
+mentions) are alerted right away, as before. Weaker ones and potential mentions are
+collected per owner and sent as one plain-text digest when the oldest collected alert is
+`window` seconds old or `max_items` alerts are waiting, so a busy hour costs a handful of
+sends instead of dozens. Alerts are keyed by (chat id, message id): an edit of a message
+still waiting in a digest updates its entry in place, and if the edit made it a strong
+offer the digest goes out at once. An edit of an already alerted message is only alerted
+again if it made the offer stronger. `knows()` tells the handler which edits are such
+updates; any other edit is subject to the handler's dedup rules before it gets here.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+from message_parser import Confidence, OfferType, ParsedOffer
+from utils.outbound_queue import PRIORITY_NOTIFICATION
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects longer messages; a digest is flushed before an entry would overflow it
+MAX_DIGEST_CHARS = 4000
+SNIPPET_CHARS = 160
+
+
+class DigestEntry:
+    __slots__ = ("offer", "sender_name", "link", "rate_vs_market", "edited")
+
+    def __init__(self, offer: ParsedOffer, sender_name: str, link: str, rate_vs_market: str | None, edited: bool):
+        self.offer = offer
+        self.sender_name = sender_name
+        self.link = link
+        self.rate_vs_market = rate_vs_market
+        self.edited = edited
+
+    def render(self, number: int) -> str:
+        offer = self.offer
+        amounts = " / ".join(part for part in (
+            f"£{offer.amount_gbp:,.2f}" if offer.amount_gbp is not None else "",
+            f"{offer.amount_rub:,.0f} RUB" if offer.amount_rub is not None else "",
+        ) if part) or "no amount"
+        text = " ".join(offer.original_message.split())
+        if len(text) > SNIPPET_CHARS:
+            text = text[:SNIPPET_CHARS - 1] + "…"
+        rate = f" - {self.rate_vs_market}" if self.rate_vs_market else ""
+        edited = " (edited)" if self.edited else ""
+        return (f"{number}. {offer.offer_type.label.replace('_', ' ')} ({offer.confidence.label}){edited} - "
+                f"{amounts}{rate} - {self.sender_name}: {text}\n   {self.link}")
+
+
+def format_digest(entries: list[DigestEntry]) -> str:
+    lines = [f"🗂 Offer digest: {len(entries)} alert(s)"]
+    lines += [entry.render(i) for i, entry in enumerate(entries, 1)]
+    return "\n".join(lines)
+
+
+class NotificationDigest:
+    """
+    Sends owner alerts through `outbound`: strong offers immediately, the rest batched.
+    A `window` of 0 disables batching. Digests are flushed by an event loop timer, so
+    `notify` must be called from the loop.
+    """
+
+    def __init__(self, outbound, window: float = 300.0, max_items: int = 10,
+                 immediate_confidence: Confidence = Confidence.HIGH, remember: int = 2000):
+        self.outbound = outbound
+        self.window = window
+        self.max_items = max_items
+        self.immediate_confidence = immediate_confidence
+        self.remember = remember
+        self.stats = {"immediate": 0, "digested": 0, "digests": 0, "folded_edits": 0, "ignored_edits": 0}
+        self._pending = {}  # notify user id -> OrderedDict (chat id, message id) -> DigestEntry
+        self._timers = {}  # notify user id -> TimerHandle of the pending digest
+        self._alerted = OrderedDict()  # (chat id, message id) -> (offer type, confidence) of the last alert sent
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._pending.values())
+
+    def knows(self, notify_user_id: int, key: tuple) -> bool:
+        """Whether message `key` is waiting in `notify_user_id`'s digest or was alerted since startup."""
+        pending = self._pending.get(notify_user_id)
+        return (pending is not None and key in pending) or key in self._alerted
+
+    def is_immediate(self, offer: ParsedOffer) -> bool:
+        return (self.window <= 0 or
+                (offer.offer_type is not OfferType.POTENTIAL_MENTION and offer.confidence >= self.immediate_confidence))
+
+    def notify(self, notify_user_id: int, key: tuple, offer: ParsedOffer, alert_text: str, sender_name: str,
+               link: str, rate_vs_market: str | None = None, received_at: float | None = None,
+               edited: bool = False, **send_kwargs):
+        """
+        Alerts `notify_user_id` about `offer` from message `key` = (chat id, message id).
+        `alert_text` (with `send_kwargs`, e.g. parse_mode) is the full alert for immediate sending;
+        digests are built from the offer, sender name and link.
+        """
+        pending = self._pending.get(notify_user_id)
+        if pending is not None and key in pending:
+            # The message is still waiting in a digest: update it there rather than alerting twice
+            pending[key] = DigestEntry(offer, sender_name, link, rate_vs_market, edited or pending[key].edited)
+            self.stats["folded_edits"] += 1
+            if self.is_immediate(offer):
+                self.flush(notify_user_id)
+            return
+        if edited and key in self._alerted and not self._stronger(offer, self._alerted[key]):
+            self.stats["ignored_edits"] += 1
+            return
+
+        if self.is_immediate(offer):
+            self.stats["immediate"] += 1
+            self._remember(key, offer)
+            self.outbound.enqueue(notify_user_id, alert_text, priority=PRIORITY_NOTIFICATION,
+                                  description=f"notification for message ID {key[1]}", kind="notification",
+                                  received_at=received_at, **send_kwargs)
+            return
+
+        pending = self._pending.setdefault(notify_user_id, OrderedDict())
+        entry = DigestEntry(offer, sender_name, link, rate_vs_market, edited)
+        if pending and len(format_digest([*pending.values(), entry])) > MAX_DIGEST_CHARS:
+            self.flush(notify_user_id)
+            pending = self._pending.setdefault(notify_user_id, OrderedDict())
+        pending[key] = entry
+        self.stats["digested"] += 1
+        if len(pending) >= self.max_items:
+            self.flush(notify_user_id)
+        elif notify_user_id not in self._timers:
+            self._timers[notify_user_id] = asyncio.get_running_loop().call_later(
+                self.window, self.flush, notify_user_id)
+
+    @staticmethod
+    def _stronger(offer: ParsedOffer, previous: tuple) -> bool:
+        offer_type, confidence = previous
+        return (offer.confidence > confidence or
+                (offer_type is OfferType.POTENTIAL_MENTION and offer.offer_type is not OfferType.POTENTIAL_MENTION))
+
+    def _remember(self, key: tuple, offer: ParsedOffer):
+        self._alerted[key] = (offer.offer_type, offer.confidence)
+        self._alerted.move_to_end(key)
+        while len(self._alerted) > self.remember:
+            self._alerted.popitem(last=False)
+
+    def flush(self, notify_user_id: int):
+        """Sends the pending digest for `notify_user_id`, if any."""
+        timer = self._timers.pop(notify_user_id, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(notify_user_id, None)
+        if not pending:
+            return
+        for key, entry in pending.items():
+            self._remember(key, entry.offer)
+        self.stats["digests"] += 1
+        self.outbound.enqueue(notify_user_id, format_digest(list(pending.values())), priority=PRIORITY_NOTIFICATION,
+                              description=f"digest of {len(pending)} alert(s)", kind="digest", link_preview=False)
+
+    def flush_all(self):
+        for notify_user_id in list(self._pending):
+            self.flush(notify_user_id)
@@ -0,0 +1,253 @@
+"""
+In-memory book of live offers.
+
+Every parsed offer with an amount is kept for `ttl` seconds, indexed per offer type by
+GBP amount, RUB amount and implied rate (RUB per GBP) in sorted lists, so range queries
+are a bisect plus the matching slice. Expired entries are dropped lazily through a heap
+ordered by posting time. The owner can query the book from Telegram with the `/offers`
+command (see `parse_book_query` for the syntax).
+"""
+
+import bisect
+import heapq
+import itertools
+import re
+import time
+
+from message_parser import ParsedOffer
+
+OFFER_TYPE_ALIASES = {
+    "sells": "counterparty_sells_gbp",
+    "sell": "counterparty_sells_gbp",
+    "counterparty_sells_gbp": "counterparty_sells_gbp",
+    "buys": "counterparty_buys_rub",
+    "buy": "counterparty_buys_rub",
+    "counterparty_buys_rub": "counterparty_buys_rub",
+    "mentions": "potential_mention",
+    "potential_mention": "potential_mention",
+    "all": None,
+}
+ORDERINGS = ("rate", "amount", "newest")
+BOOK_QUERY_USAGE = ("Usage: /offers [sells|buys|mentions|all] [MIN-MAX] [gbp|rub] [AGE like 30m, 2h, 1d] "
+                    "[rate|amount|newest]\nExample: /offers sells 200-800 2h")
+
+_AMOUNT_RANGE_RE = re.compile(r"^£?(\d+(?:\.\d+)?)?-£?(\d+(?:\.\d+)?)?$")
+_AGE_RE = re.compile(r"^(\d+(?:\.\d+)?)([mhd])$")
+_AGE_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+class BookEntry:
+    __slots__ = ("seq", "key", "offer_type", "confidence", "amount_gbp", "amount_rub", "rate", "sender_id",
+                 "sender_name", "link", "posted_at", "route")
+
+    def __init__(self, seq, key, offer_type, confidence, amount_gbp, amount_rub, sender_id, sender_name, link,
+                 posted_at, route):
+        self.seq = seq
+        self.key = key
+        self.offer_type = offer_type
+        self.confidence = confidence
+        self.amount_gbp = amount_gbp
+        self.amount_rub = amount_rub
+        # Implied RUB per GBP, only when the message states both amounts
+        self.rate = amount_rub / amount_gbp if amount_gbp and amount_rub else None
+        self.sender_id = sender_id
+        self.sender_name = sender_name
+        self.link = link
+        self.posted_at = posted_at
+        self.route = route
+
+    def __repr__(self):
+        return (f"BookEntry({self.offer_type}: gbp={self.amount_gbp}, rub={self.amount_rub}, rate={self.rate}, "
+                f"sender={self.sender_name}, posted_at={self.posted_at})")
+
+
+class _SortedIndex:
+    """(value, seq) pairs kept sorted; the seq breaks ties so removal finds the exact pair."""
+    __slots__ = ("_keys",)
+
+    def __init__(self):
+        self._keys = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, value: float, seq: int):
+        bisect.insort(self._keys, (value, seq))
+
+    def remove(self, value: float, seq: int):
+        i = bisect.bisect_left(self._keys, (value, seq))
+        if i < len(self._keys) and self._keys[i] == (value, seq):
+            del self._keys[i]
+
+    def range(self, low: float | None = None, high: float | None = None) -> list[int]:
+        """Seqs with low <= value <= high, in value order."""
+        start = 0 if low is None else bisect.bisect_left(self._keys, (low, -1))
+        end = len(self._keys) if high is None else bisect.bisect_right(self._keys, (high, float("inf")))
+        return [seq for _, seq in self._keys[start:end]]
+
+
+class OfferBook:
+    def __init__(self, ttl: float = 6 * 3600, max_size: int = 5000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}  # seq -> BookEntry
+        self._by_key = {}  # (chat_id, message_id) -> seq
+        self._indexes = {}  # offer_type -> {"gbp" | "rub" | "rate": _SortedIndex}
+        self._expiry = []  # heap of (posted_at, seq); stale seqs are skipped
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, parsed_offer: ParsedOffer, key, sender_id=None, sender_name: str = "", link: str = "",
+            posted_at: float | None = None, route: str = "") -> BookEntry | None:
+        """
+        Adds a parsed offer; `key` identifies the source message, so adding it again replaces it.
+        Offers without any amount are not kept. Returns the new entry or None.
+        """
+        amount_gbp = parsed_offer.amount_gbp
+        amount_rub = parsed_offer.amount_rub
+        if amount_gbp is None and amount_rub is None:
+            return None
+        self.expire()
+        if key in self._by_key:
+            self._remove(self._by_key[key])
+        elif len(self._entries) >= self.max_size:
+            # Full: make room by dropping the oldest entry
+            while self._expiry and len(self._entries) >= self.max_size:
+                _, seq = heapq.heappop(self._expiry)
+                self._remove(seq)
+
+        entry = BookEntry(next(self._seq), key, parsed_offer.offer_type.label, parsed_offer.confidence.label,
+                          amount_gbp, amount_rub, sender_id, sender_name, link,
+                          time.time() if posted_at is None else posted_at, route)
+        self._entries[entry.seq] = entry
+        self._by_key[key] = entry.seq
+        indexes = self._indexes.setdefault(entry.offer_type, {"gbp": _SortedIndex(), "rub": _SortedIndex(),
+                                                              "rate": _SortedIndex()})
+        for name, value in (("gbp", entry.amount_gbp), ("rub", entry.amount_rub), ("rate", entry.rate)):
+            if value is not None:
+                indexes[name].add(value, entry.seq)
+        heapq.heappush(self._expiry, (entry.posted_at, entry.seq))
+        return entry
+
+    def _remove(self, seq: int):
+        entry = self._entries.pop(seq, None)
+        if entry is None:
+            return
+        if self._by_key.get(entry.key) == seq:
+            del self._by_key[entry.key]
+        indexes = self._indexes[entry.offer_type]
+        for name, value in (("gbp", entry.amount_gbp), ("rub", entry.amount_rub), ("rate", entry.rate)):
+            if value is not None:
+                indexes[name].remove(value, seq)
+
+    def expire(self, now: float | None = None) -> int:
+        """Drops entries posted more than `ttl` seconds ago; returns how many were dropped."""
+        cutoff = (time.time() if now is None else now) - self.ttl
+        dropped = 0
+        while self._expiry and self._expiry[0][0] < cutoff:
+            _, seq = heapq.heappop(self._expiry)
+            if seq in self._entries:
+                self._remove(seq)
+                dropped += 1
+        return dropped
+
+    def query(self, offer_type: str | None = None, min_amount: float | None = None,
+              max_amount: float | None = None, currency: str = "gbp", min_rate: float | None = None,
+              max_rate: float | None = None, max_age: float | None = None, order_by: str = "rate",
+              limit: int | None = 20, now: float | None = None) -> list[BookEntry]:
+        """
+        Live offers of `offer_type` (None for all types) with `currency` amount and implied rate
+        within the given bounds, posted in the last `max_age` seconds.
+        `order_by` is "rate" (fewest RUB per GBP first, offers without a rate last),
+        "amount" (largest `currency` amount first) or "newest".
+        """
+        if order_by not in ORDERINGS:
+            raise ValueError(f"Unknown ordering '{order_by}' (known: {', '.join(ORDERINGS)})")
+        now = time.time() if now is None else now
+        self.expire(now)
+        offer_types = list(self._indexes) if offer_type is None else [offer_type]
+
+        has_amount_bounds = min_amount is not None or max_amount is not None
+        has_rate_bounds = min_rate is not None or max_rate is not None
+        seqs = []
+        for type_name in offer_types:
+            indexes = self._indexes.get(type_name)
+            if indexes is None:
+                continue
+            if has_amount_bounds:
+                seqs.extend(indexes[currency].range(min_amount, max_amount))
+            elif has_rate_bounds:
+                seqs.extend(indexes["rate"].range(min_rate, max_rate))
+            else:
+                seqs.extend(seq for seq in self._entries if self._entries[seq].offer_type == type_name)
+
+        entries = [self._entries[seq] for seq in seqs]
+        if has_amount_bounds and has_rate_bounds:
+            entries = [e for e in entries if e.rate is not None and (min_rate is None or e.rate >= min_rate)
+                       and (max_rate is None or e.rate <= max_rate)]
+        if max_age is not None:
+            entries = [e for e in entries if e.posted_at >= now - max_age]
+
+        if order_by == "rate":
+            entries.sort(key=lambda e: (e.rate is None, e.rate or 0.0, -e.posted_at))
+        elif order_by == "amount":
+            amount_attr = "amount_gbp" if currency == "gbp" else "amount_rub"
+            entries.sort(key=lambda e: (getattr(e, amount_attr) is None, -(getattr(e, amount_attr) or 0.0)))
+        else:
+            entries.sort(key=lambda e: -e.posted_at)
+        return entries if limit is None else entries[:limit]
+
+
+def parse_book_query(args: list[str]) -> dict:
+    """
+    Turns `/offers` command arguments into `OfferBook.query` keyword arguments.
+    Tokens may come in any order: an offer type alias, an amount range `MIN-MAX` (either side
+    optional), a currency `gbp`/`rub`, an age like `45m`/`2h`/`1d` and an ordering.
+    Raises ValueError on an unrecognised token.
+    """
+    query = {}
+    for token in (arg.lower() for arg in args):
+        if token in OFFER_TYPE_ALIASES:
+            query["offer_type"] = OFFER_TYPE_ALIASES[token]
+        elif token in ("gbp", "rub"):
+            query["currency"] = token
+        elif token in ORDERINGS:
+            query["order_by"] = token
+        elif _AGE_RE.match(token):
+            value, unit = _AGE_RE.match(token).groups()
+            query["max_age"] = float(value) * _AGE_UNITS[unit]
+        elif _AMOUNT_RANGE_RE.match(token) and token not in ("-", "£-"):
+            low, high = _AMOUNT_RANGE_RE.match(token).groups()
+            query["min_amount"] = float(low) if low else None
+            query["max_amount"] = float(high) if high else None
+        elif token.replace(".", "", 1).isdigit():
+            query["min_amount"] = float(token)
+        else:
+            raise ValueError(f"Unrecognised argument '{token}'.")
+    return query
+
+
+def _age_text(seconds: float) -> str:
+    if seconds < 3600:
+        return f"{max(seconds, 0) / 60:.0f}m ago"
+    return f"{seconds / 3600:.1f}h ago"
+
+
+def format_book_entries(entries: list[BookEntry], now: float | None = None) -> str:
+    """Plain-text reply for the `/offers` command, one numbered line per entry."""
+    if not entries:
+        return "No live offers match."
+    now = time.time() if now is None else now
+    lines = [f"📒 {len(entries)} live offer(s):"]
+    for i, entry in enumerate(entries, 1):
+        amounts = " / ".join(part for part in (
+            f"£{entry.amount_gbp:,.2f}" if entry.amount_gbp is not None else "",
+            f"{entry.amount_rub:,.0f} RUB" if entry.amount_rub is not None else "",
+        ) if part)
+        rate = f" @ {entry.rate:.2f}" if entry.rate is not None else ""
+        offer_type = (entry.offer_type or "unknown").replace("_", " ")
+        lines.append(f"{i}. {amounts}{rate} - {offer_type} - {entry.sender_name or 'Unknown Sender'} - "
+                     f"{_age_text(now - entry.posted_at)}\n   {entry.link}")
+    return "\n".join(lines)
@@ -1,320 +1,399 @@
 #!/usr/bin/env python3
-from telethon import TelegramClient, errors, events
+"""
+Entry point of the offer monitor bot.
+
+Importing this module has no side effects and does not import Telethon: `create_app`
+builds the client, routes, handlers and state on demand, and `main` adds the process
+setup (config, logging). Tools and worker processes can import the handler logic
+without bootstrapping the bot.
+"""
+
 import asyncio
 import logging
-import logging.handlers # For RotatingFileHandler
-import configparser
 import os
-from message_parser import parse_message_for_offer
-
-# --- Configuration Loading ---
-def load_config():
-    cfg = {}
-    
-    # Try to load from environment variables first (for Railway deployment)
-    if os.getenv('API_ID'):
+import time
+from contextlib import contextmanager
+from catchup import catch_up, snapshot_cursors
+from config import SESSIONS_DIR, ConfigError, load_config, session_path
+from message_handler import HandlerContext, handle_edited_message, handle_new_message
+from message_parser import Confidence
+from notification_digest import NotificationDigest
+from offer_book import BOOK_QUERY_USAGE, OfferBook, format_book_entries, parse_book_query
+from parse_executor import ParseExecutor
+from rate_analytics import RateAnalytics
+from routing import RoutingTable, resolve_input_peers
+from sharding import OutboundPool, Shard, assign_shards
+from stream_watchdog import Watchdog
+from utils.dedup_store import DedupStore
+from utils.logging_config import setup_logging
+from utils.metrics import METRICS, log_summary_periodically, start_metrics_server
+from utils.offer_history import OfferHistory
+from utils.outbound_queue import PRIORITY_NOTIFICATION, OutboundDispatcher
+from utils.parse_memo import ParseMemo
+from utils.sender_cache import SenderCache
+
+logger = logging.getLogger(__name__)
+
+class BotApp:
+    """The accounts (shards), routes and shared per-process state of one bot instance; built by `create_app`."""
+
+    def __init__(self, config: dict, routes: RoutingTable, shards: list[Shard], sessions_dir: str,
+                 peer_from_message=None):
+        self.config = config
+        self.routes = routes
+        self.shards = shards
+        # The first account is the primary one: it answers when no other account can
+        self.client = shards[0].client
+        self.sessions_dir = sessions_dir
+        self.session_path = shards[0].session_path
+        # Senders of recent offers, persisted next to the session so restarts keep a warm cache
+        self.sender_cache = SenderCache(max_size=1000, ttl=6 * 3600,
+                                        path=os.path.join(sessions_dir, 'sender_cache.json'))
+        # Every account sends through its own paced queue; the pool picks the one with the most budget left
+        self.outbound = OutboundPool(shards, peer_from_message=peer_from_message)
+        # High-confidence alerts go out at once; weaker ones and mentions are batched per 5 minutes / 10 alerts
+        window = config.get('notify_digest_window')
+        self.notifier = NotificationDigest(
+            self.outbound, window=300.0 if window is None else window, max_items=config.get('notify_digest_size') or 10,
+            immediate_confidence=Confidence[(config.get('notify_immediate_confidence') or 'high').upper()])
+        # Processed messages and reply cooldowns survive restarts, so replays never double-send
+        self.dedup = DedupStore(os.path.join(sessions_dir, 'dedup.sqlite3'))
+        # Long messages are parsed on a worker pool with a time budget so they can't stall the loop
+        # Reposts of a recently parsed text (up to case, whitespace and emoji) reuse its result
+        self.parser = ParseExecutor(inline_max_chars=2000, max_chars=20000, timeout=0.5,
+                                    memo=ParseMemo(max_size=2000, ttl=6 * 3600))
+        # Parsed offers stay queryable with /offers for 6 hours
+        self.book = OfferBook(ttl=6 * 3600)
+        # Notifications compare each offer's implied rate with the last 200 rates seen
+        self.analytics = RateAnalytics(window=200)
+        # Every routed message and its parse result, kept for analysis and parser re-evaluation
+        self.history = OfferHistory(os.path.join(sessions_dir, 'history'))
+        # Silent routes are probed every minute; gaps are resynced, or reconnected if they recur
+        self.watchdog = Watchdog(self.dedup, self.catch_up)
+        # What the message handlers (live and catch-up) work with
+        self.handler_context = HandlerContext(self.outbound, sender_cache=self.sender_cache, dedup=self.dedup,
+                                              parser=self.parser, book=self.book, analytics=self.analytics,
+                                              history=self.history, notifier=self.notifier)
+
+    async def catch_up(self, shard: Shard, routes: RoutingTable, start_cursors: dict | None = None) -> int:
+        """Processes the messages of `routes` missed by `shard` (after `start_cursors`, default: the stored cursors)."""
+        return await catch_up(shard.client, routes, self.handler_context, start_cursors=start_cursors)
+
+
+def create_app(config: dict, routes: RoutingTable | None = None, sessions_dir: str = SESSIONS_DIR) -> BotApp:
+    """
+    Builds the bot from loaded settings: routing table (unless given), one session, Telegram
+    client and outbound queue per account with the routes sharded across them, state stores
+    and event handlers. Nothing connects until `run(app)`. Raises ValueError (or
+    KeyError/TypeError) on an invalid route, account or session configuration.
+    """
+    from telethon import TelegramClient
+    from telethon.tl.types import InputPeerUserFromMessage
+    from session_backend import open_session
+
+    routes = RoutingTable.from_config(config) if routes is None else routes
+    accounts = config.get('accounts') or [{'name': config['session_name'], 'session_name': config['session_name'],
+                                           'phone_number': config.get('phone_number'),
+                                           'session_string': config.get('session_string')}]
+    shard_routes = assign_shards(routes, [account['name'] for account in accounts])
+    # Created on demand (for cloud deployment, where the directory doesn't exist yet)
+    os.makedirs(sessions_dir, exist_ok=True)
+    shards = []
+    for account in accounts:
+        path = session_path(account, sessions_dir)
+        # Routed chats and notify users must stay resolvable however small the entity cap is
+        session = open_session({**config, 'session_string': account['session_string']}, path,
+                               pinned_ids=[*routes.chat_ids, *routes.notify_user_ids])
+        client = TelegramClient(session, config['api_id'], config['api_hash'])
+        # ~1 msg/s with short bursts per account keeps clear of per-account limits
+        outbound = OutboundDispatcher(client, rate=1.0, burst=3, max_depth=100)
+        shards.append(Shard(account['name'], client, shard_routes[account['name']], outbound,
+                            session_path=path, phone_number=account['phone_number']))
+    app = BotApp(config, routes, shards, sessions_dir, peer_from_message=InputPeerUserFromMessage)
+    register_handlers(app)
+    return app
+
+
+def register_handlers(app: BotApp):
+    from telethon import events
+
+    for shard in app.shards:
+        _register_shard_handlers(app, shard, events)
+
+
+def _register_shard_handlers(app: BotApp, shard: Shard, events):
+    routes = shard.routes
+    for route in routes.routes:
+        logger.info(f"[{shard.name}] Listening to {route}")
+
+    # Any update shows the account's update stream is alive
+    @shard.client.on(events.Raw)
+    async def update_handler(update):
+        app.watchdog.observe_update(shard.name)
+
+    # Messages from unrouted topics are dropped by the event filter, before the handler runs
+    if routes.routes:
+        @shard.client.on(events.NewMessage(chats=routes.chat_ids, func=routes.accepts_event))
+        async def new_message_handler(event):
+            with METRICS.timer("stage_seconds", stage="route"):
+                route = routes.route_for(event.message)
+            app.watchdog.observe(route.name)
+            await handle_new_message(event.message, route, app.handler_context)
+
+        # An edit can turn a vague message into an offer; the notifier folds it into the pending digest
+        @shard.client.on(events.MessageEdited(chats=routes.chat_ids, func=routes.accepts_event))
+        async def edited_message_handler(event):
+            await handle_edited_message(event.message, routes.route_for(event.message), app.handler_context)
+
+    # The owners can query the offer book, e.g. "/offers sells 200-800 2h"; the account asked replies
+    @shard.client.on(events.NewMessage(from_users=app.routes.notify_user_ids, pattern=r'(?i)^/offers\b'))
+    async def offers_command_handler(event):
         try:
-            cfg['api_id'] = int(os.getenv('API_ID'))
-            cfg['api_hash'] = os.getenv('API_HASH')
-            cfg['phone_number'] = os.getenv('PHONE_NUMBER')
-            cfg['target_group_id'] = int(os.getenv('TARGET_GROUP_ID'))
-            cfg['target_topic_id'] = int(os.getenv('TARGET_TOPIC_ID'))
-            cfg['notify_user_id'] = int(os.getenv('NOTIFY_USER_ID'))
-            cfg['session_name'] = os.getenv('SESSION_NAME', 'my_telegram_session')
-            print("✅ Configuration loaded from environment variables")
-            return cfg
-        except (ValueError, TypeError) as e:
-            print(f"🔴 [CRITICAL] Error parsing environment variables: {e}")
-            exit(1)
-    
-    # Fallback to config.ini for local development
-    parser = configparser.ConfigParser()
-    if not os.path.exists('config.ini'):
-        print("🔴 [CRITICAL] config.ini not found and no environment variables set!")
-        print("Please copy config.example.ini to config.ini and fill in your details.")
-        exit(1)
-    
-    parser.read('config.ini')
-    try:
-        cfg['api_id'] = parser.getint('telegram_credentials', 'api_id')
-        cfg['api_hash'] = parser.get('telegram_credentials', 'api_hash')
-        cfg['phone_number'] = parser.get('telegram_credentials', 'phone_number')
-        
-        cfg['target_group_id'] = parser.getint('bot_settings', 'target_group_id')
-        cfg['target_topic_id'] = parser.getint('bot_settings', 'target_topic_id')
-        cfg['notify_user_id'] = parser.getint('bot_settings', 'notify_user_id')
-        cfg['session_name'] = parser.get('bot_settings', 'session_name', fallback='my_telegram_session')
-    except (configparser.NoSectionError, configparser.NoOptionError) as e:
-        print(f"🔴 [CRITICAL] Error in config.ini: {e}")
-        print("Please ensure config.ini is correctly formatted based on config.example.ini.")
-        exit(1)
-    
-    # Validate that placeholder values have been changed
-    if cfg['api_id'] == 'YOUR_API_ID_HERE' or \
-       str(cfg['target_group_id']) == 'GROUP_ID_OF_THE_TARGET_CHAT':
-        print("🔴 [CRITICAL] Placeholder values found in config.ini.")
-        print("Please replace all YOUR_..._HERE placeholders with your actual values.")
-        exit(1)
-    
-    print("✅ Configuration loaded from config.ini")
-    return cfg
-
-def setup_session_from_env(session_name):
-    """Decode base64 session from environment variable if available"""
-    session_b64 = os.getenv('SESSION_BASE64')
-    if not session_b64:
-        print("No SESSION_BASE64 environment variable found")
-        return False
-        
+            query = parse_book_query(event.raw_text.split()[1:])
+        except ValueError as e:
+            reply = f"{e}\n{BOOK_QUERY_USAGE}"
+        else:
+            reply = format_book_entries(app.book.query(**query))
+        shard.outbound.enqueue(event.chat_id, reply, priority=PRIORITY_NOTIFICATION,
+                               description="offer book reply", kind="command", link_preview=False)
+
+@contextmanager
+def startup_phase(timings: dict, name: str):
+    """Records how long the `with` block took as startup phase `name`."""
+    started = time.perf_counter()
     try:
-        import base64
-        print(f"Found SESSION_BASE64 environment variable (length: {len(session_b64)})")
-        
-        # Decode base64 data
-        session_data = base64.b64decode(session_b64)
-        print(f"Successfully decoded base64 data (size: {len(session_data)} bytes)")
-        
-        # Create sessions directory
-        os.makedirs('sessions', exist_ok=True)
-        
-        # Write session file
-        session_path = os.path.join('sessions', session_name + '.session')
-        with open(session_path, 'wb') as f:
-            f.write(session_data)
-        
-        # Verify file was written
-        if os.path.exists(session_path):
-            file_size = os.path.getsize(session_path)
-            print(f"✅ Session restored from environment variable to {session_path} ({file_size} bytes)")
-            return True
+        yield
+    finally:
+        timings[name] = time.perf_counter() - started
+        METRICS.observe("startup_seconds", timings[name], phase=name)
+
+# A connection that lasted this long (seconds) resets the shard's reconnect backoff
+SHARD_STABLE_AFTER = 300.0
+
+async def authorize_shard(app: BotApp, shard: Shard, interactive: bool) -> bool:
+    """
+    Checks a connected account's authorization (signing in on the console if `interactive`)
+    and pre-resolves the routed chats and notify users for it. Returns False if the
+    account is not authorized.
+    """
+    from telethon import errors
+
+    client = shard.client
+    # get_me() returns None on an unauthorized session, so it doubles as the auth check
+    # and runs alongside entity pre-resolution
+    me, shard.outbound.input_peers = await asyncio.gather(client.get_me(), resolve_input_peers(client, app.routes))
+
+    if me is None:
+        if interactive:
+            logger.info(f"[{shard.name}] User not authorized. Attempting sign-in...")
+            try:
+                await client.send_code_request(shard.phone_number)
+                code = input(f"Telegram sent a code for {shard.phone_number}. Please enter it: ")
+                await client.sign_in(shard.phone_number, code)
+            except errors.SessionPasswordNeededError:
+                password = input("2FA password needed: ")
+                await client.sign_in(password=password)
+
+            if not await client.is_user_authorized():
+                logger.error(f"[{shard.name}] Still not authorized.")
+                return False
+            logger.info(f"[{shard.name}] Re-authorized successfully.")
+            me, shard.outbound.input_peers = await asyncio.gather(client.get_me(),
+                                                                  resolve_input_peers(client, app.routes))
         else:
-            print(f"🔴 Failed to write session file to {session_path}")
+            logger.error(f"[{shard.name}] Session not authorized. This indicates a problem with session restoration.")
+            logger.error("For Railway deployment, session must be pre-authorized and properly restored.")
+            logger.error("Check that the SESSION_STRING environment variable is correctly set "
+                         "(printed by authorize_session.py).")
             return False
-            
-    except Exception as e:
-        print(f"🔴 Failed to restore session from environment: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
-
-config = load_config()
-
-# --- Logging Setup ---
-logger = logging.getLogger(__name__) # Get logger for this module
-# Prevent Telethon from flooding logs unless it's an error
-logging.getLogger('telethon').setLevel(logging.ERROR)
-
-log_formatter = logging.Formatter('[%(levelname)5s/%(asctime)s] %(name)s: %(message)s')
-
-# Console Handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_formatter)
-console_handler.setLevel(logging.INFO) # Set console to INFO
-
-# File Handler (Rotating)
-log_file = 'bot.log'
-file_handler = logging.handlers.RotatingFileHandler(
-    log_file, maxBytes=5*1024*1024, backupCount=2 # 5MB per file, 2 backups
-)
-file_handler.setFormatter(log_formatter)
-file_handler.setLevel(logging.DEBUG) # Log DEBUG and above to file
-
-# Get the root logger and add handlers
-root_logger = logging.getLogger() 
-root_logger.setLevel(logging.DEBUG) # Set root logger to DEBUG to allow file handler to catch DEBUG
-root_logger.addHandler(console_handler)
-root_logger.addHandler(file_handler)
-
-# --- Telegram Client Setup (using loaded config) ---
-API_ID = config['api_id']
-API_HASH = config['api_hash']
-PHONE_NUMBER = config['phone_number']
-SESSION_NAME = config['session_name']
-TARGET_GROUP_ID = config['target_group_id']
-TARGET_TOPIC_ID = config['target_topic_id']
-NOTIFY_USER_ID = config['notify_user_id']
-
-# Create sessions directory if it doesn't exist (for cloud deployment)
-sessions_dir = 'sessions'
-if not os.path.exists(sessions_dir):
-    os.makedirs(sessions_dir)
-    logger.info(f"Created sessions directory: {sessions_dir}")
-
-# Use sessions directory for session file
-session_path = os.path.join(sessions_dir, SESSION_NAME)
-
-# Restore session from environment if available (MUST happen before TelegramClient creation)
-# Temporarily disabled for Railway deployment - SESSION_BASE64 too large
-# session_restored = setup_session_from_env(SESSION_NAME)
-session_restored = False
-if session_restored:
-    logger.info("Session successfully restored from environment variable")
-else:
-    logger.info("No session restoration needed (running locally or session already exists)")
-
-# Check if session file exists after restoration attempt
-if os.path.exists(session_path):
-    logger.info(f"Session file found at: {session_path}")
-else:
-    logger.warning(f"No session file at: {session_path}")
-
-async def run_listener(client: TelegramClient):
-    logger.info(f"Listening to Group ID: {TARGET_GROUP_ID}, specifically for Topic ID: {TARGET_TOPIC_ID}")
-
-    @client.on(events.NewMessage(chats=TARGET_GROUP_ID))
-    async def new_message_handler(event):
-        message = event.message
-        actual_topic_id = None
-        is_topic_message_context = False
-
-        # --- Topic ID Determination Logic (simplified logging) ---
-        if hasattr(message, 'topic_id') and message.topic_id:
-            actual_topic_id = message.topic_id
-            is_topic_message_context = True
-        elif message.reply_to:
-            if hasattr(message.reply_to, 'reply_to_top_id') and message.reply_to.reply_to_top_id is not None:
-                actual_topic_id = message.reply_to.reply_to_top_id
-                is_topic_message_context = True
-            elif getattr(message.reply_to, 'forum_topic', False) and hasattr(message.reply_to, 'reply_to_msg_id') and message.reply_to.reply_to_msg_id is not None:
-                actual_topic_id = message.reply_to.reply_to_msg_id
-                is_topic_message_context = True
-        # --- End of Topic ID Determination Logic ---
-
-        if is_topic_message_context and actual_topic_id == TARGET_TOPIC_ID:
-            sender = await message.get_sender()
-            sender_name = (f"{sender.first_name} {sender.last_name or ''}").strip() if sender else "Unknown Sender"
-            
-            logger.info(f"==== TARGET TOPIC MESSAGE from {sender_name} ====")
-            logger.info(f"  Original Text: {message.text}")
-            
-            parsed_offer = parse_message_for_offer(message.text)
-            
-            if parsed_offer:
-                logger.info(f"  Parsed Offer: {parsed_offer}")
-                # Construct and send notification
-                offer_type = parsed_offer.get("offer_type", "N/A")
-                confidence = parsed_offer.get("confidence", "N/A")
-                amount_gbp = parsed_offer.get("amount_gbp", "N/A")
-                amount_rub = parsed_offer.get("amount_rub", "N/A")
-                original_msg_text = parsed_offer.get("original_message", "Error fetching original message.")
-
-                # Store sender information for potential auto-response
-                sender_id = sender.id if sender else None
-                sender_username = getattr(sender, 'username', None)
-
-                # Check if this is a ruble buying offer that should trigger auto-response
-                should_auto_respond = (offer_type == "counterparty_buys_rub" and 
-                                     confidence in ["high", "medium"] and 
-                                     sender_id is not None)
-
-                if should_auto_respond:
-                    # Send auto-response to the person looking to buy rubles
-                    auto_response_text = "Привет, если рубли еще нужны, скажи пожалуйста куда перевести, в течении часа переведу"
-                    
-                    try:
-                        await client.send_message(sender_id, auto_response_text)
-                        logger.info(f"Auto-response sent to {sender_name} (ID: {sender_id}) for ruble buying offer.")
-                    except Exception as e:
-                        logger.error(f"Failed to send auto-response to {sender_name} (ID: {sender_id}): {e}")
-                        # If auto-response fails, fall back to notification to bot owner
-                        should_auto_respond = False
-
-                # If not auto-responding or auto-response failed, send notification to bot owner
-                if not should_auto_respond:
-                    # Construct deep link to the message if possible
-                    # Format: https://t.me/c/CHAT_ID/MSG_ID (CHAT_ID without -100 prefix)
-                    # Or for groups with username: https://t.me/GROUP_USERNAME/MSG_ID
-                    # This requires knowing if the group is public/has a username, or its specific chat_id structure.
-                    # For now, we'll skip the deep link and focus on the text.
-                    
-                    # Try to get a link to the message
-                    msg_link = f"https://t.me/c/{str(message.chat_id).replace('-100', '')}/{message.id}"
-                    # Check if chat has a username for a potentially more stable link
-                    if hasattr(message.chat, 'username') and message.chat.username:
-                        msg_link = f"https://t.me/{message.chat.username}/{message.id}"
-
-                    notification_lines = [
-                        "🔔 *New Exchange Offer Alert!* 🔔",
-                        "-------------------------------------",
-                        f"*Type*: {offer_type.replace('_', ' ').title()}",
-                        f"*Confidence*: {confidence.title()}",
-                        f"*GBP Amount*: {amount_gbp}",
-                        f"*RUB Amount*: {amount_rub}",
-                        "-------------------------------------",
-                        f"*Original Message (from {sender_name})*:",
-                        f"> {original_msg_text}",
-                        "-------------------------------------",
-                        f"Link to message: {msg_link}"
-                    ]
-                    notification_text = "\n".join(notification_lines)
-                    
-                    try:
-                        await client.send_message(NOTIFY_USER_ID, notification_text, parse_mode='md') # Using Markdown
-                        logger.info(f"Notification sent to User ID {NOTIFY_USER_ID} for message ID {message.id}.")
-                    except Exception as e:
-                        logger.error(f"Failed to send notification message: {e}")
-            else:
-                logger.info("  Parser Result: No relevant offer identified by parser.")
-            logger.info("==============================================")
-        elif is_topic_message_context:
-            logger.debug(f"--- IGNORING (Wrong Topic) --- Deduced Topic {actual_topic_id}. Text: {message.text[:60]}...")
-        else:
-            logger.debug(f"--- IGNORING (No/Unknown Topic Context) --- Text: {message.text[:60]}...")
 
-async def main():
-    client = TelegramClient(session_path, API_ID, API_HASH)
+    shard.connected = True
+    shard.stats["connects"] += 1
+    app.watchdog.on_connected(shard)
+    logger.info(f"[{shard.name}] Successfully connected as: {me.first_name}")
+    logger.info(f"[{shard.name}] Pre-resolved {len(shard.outbound.input_peers)} route/notify entities.")
+    return True
+
+async def reconnect_shard(app: BotApp, shard: Shard) -> dict | None:
+    """
+    Reconnects an account with backoff until it is back; returns its route cursors from before
+    reconnecting (for catch-up), or None if the session is no longer authorized.
+    """
+    while True:
+        delay = shard.backoff.next_delay()
+        logger.warning(f"[{shard.name}] Disconnected; reconnecting in {delay:.1f}s (other accounts keep running).")
+        await asyncio.sleep(delay)
+        # Cursors from before reconnecting, so live events can't hide messages missed meanwhile
+        cursors = snapshot_cursors(shard.routes, app.dedup)
+        try:
+            await shard.client.connect()
+            return cursors if await authorize_shard(app, shard, interactive=False) else None
+        except Exception as e:
+            shard.stats["failed_connects"] += 1
+            logger.error(f"[{shard.name}] Reconnect failed: {e}")
+
+async def serve_shard(app: BotApp, shard: Shard, start_cursors: dict, connected: bool = True):
+    """
+    Serves one account: catches up its routes, listens until disconnected, then reconnects
+    with backoff (catching up again) until cancelled. Starts with a reconnect if not
+    `connected`. Returns if the account's session stops being authorized.
+    """
+    while True:
+        if not connected:
+            start_cursors = await reconnect_shard(app, shard)
+            if start_cursors is None:
+                return
+        # Pick up offers posted while the account was offline, alongside live events
+        catchup_task = asyncio.create_task(
+            app.catch_up(shard, shard.routes, start_cursors)
+        ) if shard.routes.routes else None
+        connected_at = time.monotonic()
+        try:
+            await shard.client.run_until_disconnected()
+        except Exception as e:
+            logger.error(f"[{shard.name}] Connection failed: {e}")
+        finally:
+            shard.connected = False
+            if catchup_task is not None and not catchup_task.done():
+                catchup_task.cancel()
+        connected = False
+        shard.stats["disconnects"] += 1
+        if time.monotonic() - connected_at >= SHARD_STABLE_AFTER:
+            shard.backoff.reset()
+
+async def run(app: BotApp):
+    """
+    Connects and authorizes every account and serves them side by side, each reconnecting on
+    its own, until all have stopped; then shuts the app's state down.
+    """
+    startup_started = time.perf_counter()
+    timings = {}
+    outbound, dedup, parser = app.outbound, app.dedup, app.parser
+    book, analytics, history, sender_cache = app.book, app.analytics, app.history, app.sender_cache
+    routes, config, shards = app.routes, app.config, app.shards
+    metrics_server = None
+    summary_task = None
+    watchdog_task = None
 
     try:
-        logger.info("Initializing Telegram client...")
-        logger.info(f"Session path: {session_path}")
-        logger.info(f"Session file exists: {os.path.exists(session_path)}")
-        
-        await client.connect()
-        logger.info("Connected to Telegram successfully")
-        
-        if not await client.is_user_authorized():
-            # Check if running locally (config.ini exists) or in cloud (env vars)
-            is_local_run = os.path.exists('config.ini') and not os.getenv('API_ID')
-            
+        logger.info(f"Initializing {len(shards)} Telegram client(s)...")
+        for shard in shards:
+            logger.info(f"[{shard.name}] Session: {shard.session_path} "
+                        f"({config.get('session_backend') or 'snapshot'} backend), {len(shard.routes)} route(s)")
+
+        # Local state and handlers are ready before the first network round trip,
+        # so updates delivered right after connecting are not missed
+        with startup_phase(timings, "local_state"):
+            sender_cache.load()
+            # The rate band picks up where the last run left off instead of starting empty
+            analytics.seed_from_history(history)
+            outbound.start()
+            dedup.start()
+            history.start()
+            start_cursors = snapshot_cursors(routes, dedup)
+
+        with startup_phase(timings, "connect"):
+            results = await asyncio.gather(*(shard.client.connect() for shard in shards), return_exceptions=True)
+        ready, offline = [], []
+        for shard, result in zip(shards, results):
+            if isinstance(result, Exception):
+                shard.stats["failed_connects"] += 1
+                logger.error(f"[{shard.name}] Could not connect to Telegram: {result}")
+                offline.append(shard)
+            else:
+                ready.append(shard)
+        if ready:
+            logger.info("Connected to Telegram successfully")
+
+        # Check if running locally (config.ini exists) or in cloud (env vars)
+        is_local_run = os.path.exists('config.ini') and not os.getenv('API_ID')
+        with startup_phase(timings, "authorize_and_resolve"):
             if is_local_run:
-                logger.info("User not authorized. Attempting sign-in...")
-                try:
-                    await client.send_code_request(PHONE_NUMBER)
-                    code = input("Telegram sent a code. Please enter it: ")
-                    await client.sign_in(PHONE_NUMBER, code)
-                except errors.SessionPasswordNeededError:
-                    password = input("2FA password needed: ")
-                    await client.sign_in(password=password)
-                
-                if not await client.is_user_authorized():
-                    logger.error("Still not authorized. Exiting.")
-                    return
-                logger.info("Re-authorized successfully.")
+                # Console sign-in prompts can't interleave, so accounts are authorized one at a time
+                authorized = [await authorize_shard(app, shard, True) for shard in ready]
             else:
-                logger.error("Session not authorized. This indicates a problem with session restoration.")
-                logger.error(f"Session file exists: {os.path.exists(session_path)}")
-                if os.path.exists(session_path):
-                    logger.error(f"Session file size: {os.path.getsize(session_path)} bytes")
-                logger.error("For Railway deployment, session must be pre-authorized and properly restored.")
-                logger.error("Check that SESSION_BASE64 environment variable is correctly set.")
-                return
-        else:
-            logger.info("User is already authorized.")
+                authorized = await asyncio.gather(*(authorize_shard(app, shard, False) for shard in ready))
+        live = [shard for shard, ok in zip(ready, authorized) if ok]
+        if not live and not offline:
+            logger.error("No account could be authorized. Exiting.")
+            return
+        if len(live) + len(offline) < len(shards):
+            # Chats are not re-sharded: those of an unauthorized account stay unmonitored until restart
+            logger.warning(f"{len(shards) - len(live) - len(offline)} account(s) not authorized; "
+                           f"their routes are not monitored.")
 
-        me = await client.get_me()
-        logger.info(f"Successfully connected as: {me.first_name}")
-        
-        # Start the event listener
-        await run_listener(client)
-        logger.info("Event listener started. Running until disconnected...")
-        await client.run_until_disconnected()
+        with startup_phase(timings, "services"):
+            if config.get('metrics_port'):
+                metrics_server = await start_metrics_server(config['metrics_port'])
+            summary_task = asyncio.create_task(log_summary_periodically(300.0))
+            watchdog_task = asyncio.create_task(app.watchdog.run(shards))
+        breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items())
+        logger.info(f"Startup finished in {(time.perf_counter() - startup_started) * 1000:.0f}ms ({breakdown}). "
+                    f"Running {len(live)} account(s) until disconnected...")
+        await asyncio.gather(*(serve_shard(app, shard, start_cursors) for shard in live),
+                             *(serve_shard(app, shard, start_cursors, connected=False) for shard in offline))
 
     except Exception as e:
         logger.exception(f"An unexpected error occurred: {e}")
     finally:
-        if client.is_connected():
-            await client.disconnect()
+        if summary_task is not None:
+            summary_task.cancel()
+        if watchdog_task is not None:
+            watchdog_task.cancel()
+            logger.info(f"Watchdog stats: {app.watchdog.stats}")
+        if metrics_server is not None:
+            metrics_server.close()
+        logger.info(f"Metrics summary: {METRICS.summary()}")
+        # Pending digests are sent rather than lost
+        app.notifier.flush_all()
+        logger.info(f"Notification digest stats: {app.notifier.stats}")
+        # Nothing can be sent once disconnected, so accounts that dropped don't wait for their queue to drain
+        await outbound.stop(10.0)
+        logger.info(f"Outbound queue stats: {outbound.stats}")
+        for shard in shards:
+            logger.info(f"[{shard.name}] Shard stats: {shard.stats}, outbound: {shard.outbound.stats}")
+        logger.info(f"Dedup store stats: {dedup.stats}")
+        logger.info(f"Parse executor stats: {parser.stats}")
+        logger.info(f"Parse memo stats: {parser.memo.stats()}")
+        logger.info(f"Offer book held {len(book)} live offer(s).")
+        logger.info(f"Rate analytics stats: {analytics.stats}")
+        parser.shutdown()
+        await dedup.close()
+        await history.close()
+        logger.info(f"Offer history holds {len(history)} message(s).")
+        logger.info(f"Sender cache stats: {sender_cache.stats()}")
+        sender_cache.save()
+        for shard in shards:
+            client = shard.client
+            if client.is_connected():
+                await client.disconnect()  # also writes the final session snapshot
+            else:
+                client.session.close()
+            if hasattr(client.session, 'stats'):
+                logger.info(f"[{shard.name}] Session stats: {client.session.stats}")
+
+async def serve(config: dict, routes: RoutingTable | None = None):
+    """Builds the app inside the running event loop and runs it."""
+    await run(create_app(config, routes))
+
+
+def main():
+    try:
+        config = load_config()
+    except ConfigError as e:
+        print(f"🔴 [CRITICAL] {e}")
+        exit(1)
+    print(f"✅ Configuration loaded from {config['source']}")
+    # Queue-backed handlers: console INFO, rotating file DEBUG, written off the event loop
+    setup_logging(log_file=os.getenv('LOG_FILE', 'bot.log'), json_format=os.getenv('LOG_FORMAT') == 'json')
+
+    try:
+        routes = RoutingTable.from_config(config)
+    except (KeyError, ValueError, TypeError) as e:
+        print(f"🔴 [CRITICAL] Invalid route configuration: {e}")
+        exit(1)
+    asyncio.run(serve(config, routes))
+
 
 if __name__ == '__main__':
-    # The initial check for placeholder API_ID etc. is now done in load_config()
-    asyncio.run(main()) 
\ No newline at end of file
+    main()
@@ -0,0 +1,113 @@
+"""
+Bounded-time parsing for the event loop.
+
+Short messages (the common case) are parsed inline. Messages longer than
+`inline_max_chars` are parsed on a worker process pool with a per-message time budget,
+so a long or adversarial message cannot stall other events. A parse that overruns the
+budget is abandoned together with its pool: the next offload starts a fresh pool, and
+the stuck worker (a separate process, so it holds no GIL of ours) exits once it is done.
+Messages longer than `max_chars` are cut to their head and tail, where offers are
+stated. Counters record how often each path is taken. With a ParseMemo, reposts of a
+recently parsed text are answered without parsing.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils.parse_memo import ParseMemo
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARK = "\n…\n"
+
+
+def _init_worker():
+    # Forked workers inherit the bot's queue logging handler, but not its listener thread
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.WARNING)
+
+
+def head_and_tail(text: str, max_chars: int) -> str:
+    """`text` cut to at most `max_chars`: its first and last parts, joined by a marker."""
+    if len(text) <= max_chars:
+        return text
+    keep = max(0, max_chars - len(TRUNCATION_MARK))
+    head = keep - keep // 2
+    return text[:head] + TRUNCATION_MARK + (text[-(keep // 2):] if keep // 2 else "")
+
+
+class ParseExecutor:
+    def __init__(self, inline_max_chars: int = 2000, max_chars: int = 20000, timeout: float = 0.5,
+                 workers: int = 2, use_processes: bool = True, memo: ParseMemo | None = None):
+        self.inline_max_chars = inline_max_chars
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self.workers = workers
+        self.use_processes = use_processes
+        self.memo = memo
+        self.stats = {"inline": 0, "offloaded": 0, "timeouts": 0, "truncated": 0, "errors": 0, "recycled": 0}
+        self._pool: Executor | None = None
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            # Process workers can be abandoned on timeout without holding the GIL; threads are cheaper to start
+            if self.use_processes:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _recycle_pool(self):
+        """Abandons the pool holding an overrunning parse; the next offload starts a new one."""
+        if self._pool is not None:
+            self.stats["recycled"] += 1
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def parse(self, parse_func, text: str):
+        """Runs `parse_func(text)` within the time budget; returns None on timeout or error."""
+        if len(text) > self.max_chars:
+            self.stats["truncated"] += 1
+            logger.warning(f"Oversized message ({len(text)} chars) cut to its first and last "
+                           f"{self.max_chars // 2} chars for parsing.")
+            text = head_and_tail(text, self.max_chars)
+
+        memo_key = None
+        if self.memo is not None:
+            memo_key = self.memo.key(parse_func, text)
+            found, result = self.memo.get(memo_key, text)
+            if found:
+                return result
+
+        if len(text) <= self.inline_max_chars:
+            self.stats["inline"] += 1
+            result = parse_func(text)
+            if memo_key is not None:
+                self.memo.put(memo_key, result)
+            return result
+
+        self.stats["offloaded"] += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_pool(), parse_func, text)
+        try:
+            result = await asyncio.wait_for(future, self.timeout)
+            if memo_key is not None:
+                self.memo.put(memo_key, result)
+            return result
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.warning(f"Parsing a {len(text)}-char message exceeded {self.timeout}s; message skipped.")
+            # The worker keeps running the parse; a fresh pool keeps later offloads from queueing behind it
+            self._recycle_pool()
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Parsing failed on worker pool: {e}")
+        return None
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
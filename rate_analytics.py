@@ -0,0 +1,232 @@
+"""
+Exchange-rate analytics over the offer history.
+
+Offers that state both amounts imply a rate (RUB per GBP). `RateAnalytics` keeps the last
+`window` such rates and derives the market band from them in one batch: median,
+percentile band and median absolute deviation (MAD). The band is recomputed every
+`refresh_every` new rates; in between, each new offer is scored against the cached band
+with a binary search over the sorted window, so scoring stays O(log n) per offer.
+Offers far outside the band (robust z-score above `outlier_z`) are flagged and kept out
+of the history, so typos like "100 GBP for 1000 RUB" don't move the market. Flagged rates
+wait in a side buffer; once the last `readmit_after` of them agree with each other, the
+market has moved rather than someone mistyping, and they are admitted to the history.
+
+At startup the history is seeded from the offer history (`seed_from_history`), so the
+band survives restarts. NumPy is used for the batch computations when it is installed
+(`pip install numpy`); otherwise the band is computed with the standard library,
+`outlier_flags` is unavailable and seeding filters outliers against the seed's median.
+"""
+
+import bisect
+import logging
+import statistics
+import time
+from collections import deque
+
+from message_parser import ParsedOffer
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python fallback for the live band
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Scales the MAD to a standard deviation estimate for normally distributed rates
+MAD_SCALE = 1.4826
+# Spread floor relative to the median; round-number quotes often make the MAD zero
+MIN_RELATIVE_SPREAD = 0.01
+
+
+def implied_rate(parsed_offer: ParsedOffer) -> float | None:
+    """RUB per GBP implied by an offer, or None unless it states both amounts."""
+    if not parsed_offer.amount_gbp_minor or not parsed_offer.amount_rub_minor:
+        return None
+    return parsed_offer.amount_rub_minor / parsed_offer.amount_gbp_minor
+
+
+def history_rates(history, since: float | None = None) -> list[float]:
+    """Implied rates of the offers in an OfferHistory posted since `since`, oldest first."""
+    rates = []
+    for record in history.scan(since=since, offers_only=True, with_text=False):
+        if record.amount_gbp and record.amount_rub:
+            rates.append(record.amount_rub / record.amount_gbp)
+    return rates
+
+
+def outlier_flags(rates, window: int, outlier_z: float = 3.5):
+    """Boolean array: True where a rate's robust z-score against its trailing window exceeds `outlier_z`."""
+    _require_numpy()
+    rates = np.asarray(rates, dtype=np.float64)
+    flags = np.zeros(rates.shape, dtype=bool)
+    if len(rates) < window:
+        return flags
+    windows = np.lib.stride_tricks.sliding_window_view(rates, window)
+    medians = np.median(windows, axis=1)
+    spreads = np.maximum(np.median(np.abs(windows - medians[:, None]), axis=1) * MAD_SCALE,
+                         np.abs(medians) * MIN_RELATIVE_SPREAD)
+    deviations = np.abs(rates[window - 1:] - medians)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        flags[window - 1:] = np.where(spreads > 0, deviations / spreads > outlier_z, deviations > 0)
+    return flags
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("NumPy is required for batch rate analytics (pip install numpy)")
+
+
+class RateBand:
+    __slots__ = ("median", "low", "high", "mad", "samples", "sorted_rates")
+
+    def __init__(self, median: float, low: float, high: float, mad: float, sorted_rates: list[float]):
+        self.median = median
+        self.low = low
+        self.high = high
+        self.mad = mad
+        self.samples = len(sorted_rates)
+        self.sorted_rates = sorted_rates
+
+
+class RateScore:
+    __slots__ = ("rate", "band", "percentile", "deviation", "outlier")
+
+    def __init__(self, rate: float, band: RateBand, percentile: float, deviation: float, outlier: bool):
+        self.rate = rate
+        self.band = band
+        self.percentile = percentile  # share of recent rates at or below this one, 0-100
+        self.deviation = deviation  # relative to the median, e.g. -0.02 is 2% below
+        self.outlier = outlier
+
+    def describe(self) -> str:
+        """One line for the owner notification, e.g. '98.50 RUB/GBP, 2.1% below median 100.60 (p10-p90 96.00-104.00, 40 offers)'."""
+        direction = "above" if self.deviation > 0 else "below"
+        text = (f"{self.rate:.2f} RUB/GBP, {abs(self.deviation) * 100:.1f}% {direction} median {self.band.median:.2f} "
+                f"(p10-p90 {self.band.low:.2f}-{self.band.high:.2f}, {self.band.samples} offers)")
+        return text + " ⚠️ outlier" if self.outlier else text
+
+
+class RateAnalytics:
+    def __init__(self, window: int = 200, band_percentiles: tuple = (10, 90), outlier_z: float = 3.5,
+                 min_samples: int = 5, refresh_every: int = 10, readmit_after: int = 5):
+        self.window = window
+        self.band_percentiles = band_percentiles
+        self.outlier_z = outlier_z
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self.readmit_after = readmit_after
+        self.stats = {"scored": 0, "outliers": 0, "readmitted": 0, "seeded": 0, "band_refreshes": 0}
+        self._rates = deque(maxlen=window)
+        self._rejected = deque(maxlen=readmit_after)  # latest outlier rates, oldest first
+        self._band: RateBand | None = None
+        self._since_refresh = 0
+
+    def __len__(self) -> int:
+        return len(self._rates)
+
+    def extend(self, rates):
+        """
+        Seeds the history with past rates (oldest first) and recomputes the band. Rates that
+        were outliers against their trailing window (without NumPy: against all the given
+        rates) are left out.
+        """
+        rates = [float(rate) for rate in rates][-self.window * 2:]
+        if np is not None and len(rates) > self.window // 4 >= self.min_samples:
+            flags = outlier_flags(rates, self.window // 4, self.outlier_z)
+            rates = [rate for rate, flagged in zip(rates, flags) if not flagged]
+        elif len(rates) >= self.min_samples:
+            median = statistics.median(rates)
+            spread = max(statistics.median(abs(rate - median) for rate in rates) * MAD_SCALE,
+                         abs(median) * MIN_RELATIVE_SPREAD)
+            rates = [rate for rate in rates if abs(rate - median) <= spread * self.outlier_z]
+        self._rates.extend(rates)
+        self.stats["seeded"] += len(rates)
+        self._refresh()
+
+    def seed_from_history(self, history, max_age: float = 7 * 24 * 3600):
+        """Seeds the band with the implied rates of offers recorded in `history` within `max_age` seconds."""
+        self.extend(history_rates(history, since=time.time() - max_age))
+        logger.info(f"Rate analytics seeded with {len(self._rates)} rate(s) from the offer history.")
+
+    @property
+    def band(self) -> RateBand | None:
+        if self._band is None and len(self._rates) >= self.min_samples:
+            self._refresh()
+        return self._band
+
+    def _refresh(self):
+        self._since_refresh = 0
+        if len(self._rates) < self.min_samples:
+            self._band = None
+            return
+        low_q, high_q = self.band_percentiles
+        if np is not None:
+            rates = np.sort(np.fromiter(self._rates, dtype=np.float64, count=len(self._rates)))
+            low, median, high = np.percentile(rates, (low_q, 50, high_q))
+            mad = float(np.median(np.abs(rates - median)))
+            self._band = RateBand(float(median), float(low), float(high), mad, rates.tolist())
+        else:
+            rates = sorted(self._rates)
+            cuts = statistics.quantiles(rates, n=100, method="inclusive")
+            median = statistics.median(rates)
+            mad = statistics.median(abs(rate - median) for rate in rates)
+            self._band = RateBand(median, cuts[low_q - 1], cuts[high_q - 1], mad, rates)
+        self.stats["band_refreshes"] += 1
+
+    def score(self, rate: float) -> RateScore | None:
+        """Scores `rate` against the current band without adding it; None until `min_samples` rates are known."""
+        band = self.band
+        if band is None:
+            return None
+        percentile = bisect.bisect_right(band.sorted_rates, rate) / band.samples * 100
+        deviation = rate / band.median - 1 if band.median else 0.0
+        spread = max(band.mad * MAD_SCALE, abs(band.median) * MIN_RELATIVE_SPREAD)
+        outlier = abs(rate - band.median) / spread > self.outlier_z if spread else rate != band.median
+        return RateScore(rate, band, percentile, deviation, outlier)
+
+    def observe(self, parsed_offer: ParsedOffer) -> RateScore | None:
+        """
+        Scores the offer's implied rate against the current band, then adds it to the history
+        unless it is an outlier. Returns None for offers without a rate or before `min_samples`.
+        """
+        rate = implied_rate(parsed_offer)
+        if rate is None:
+            return None
+        result = self.score(rate)
+        if result is not None:
+            self.stats["scored"] += 1
+            if result.outlier:
+                self.stats["outliers"] += 1
+                self._rejected.append(rate)
+                if self._rejected_agree():
+                    self._readmit()
+                else:
+                    logger.info(f"Implied rate {rate:.2f} is an outlier against median {result.band.median:.2f}; "
+                                f"not added to history.")
+                return result
+        self._add(rate)
+        return result
+
+    def _add(self, rate: float):
+        self._rates.append(rate)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh_every:
+            self._refresh()
+
+    def _rejected_agree(self) -> bool:
+        """True once the side buffer is full of outliers that are not outliers against each other."""
+        if len(self._rejected) < self.readmit_after:
+            return False
+        median = statistics.median(self._rejected)
+        spread = max(statistics.median(abs(rate - median) for rate in self._rejected) * MAD_SCALE,
+                     abs(median) * MIN_RELATIVE_SPREAD)
+        return all(abs(rate - median) <= spread * self.outlier_z for rate in self._rejected)
+
+    def _readmit(self):
+        # Consistent "outliers" mean the market moved: let them into the band instead of freezing it
+        logger.info(f"{len(self._rejected)} consistent outlier rates around {statistics.median(self._rejected):.2f}; "
+                    f"admitting them to the history.")
+        self.stats["readmitted"] += len(self._rejected)
+        self._rates.extend(self._rejected)
+        self._rejected.clear()
+        self._refresh()
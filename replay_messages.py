@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Offline replay of recorded group messages through the live message handling pipeline.
+
+Feeds messages from a JSONL file, a Telegram Desktop JSON export or an offer history
+directory (sessions/history, see utils/offer_history.py) through
+message_handler.handle_new_message (topic resolution → parse → sender →
+auto-respond/notify) using a local stand-in client that records `send_message`
+calls instead of talking to Telegram. Reports per-message end-to-end latency and
+throughput.
+
+JSONL input: one message per line, e.g.
+    {"id": 10, "chat_id": -1001234, "topic_id": 5, "date": 1717000000,
+     "sender": {"id": 42, "first_name": "Ivan", "username": "ivan"}, "text": "Куплю рубли 50000"}
+`topic_id` may be replaced by a `reply_to` object with `reply_to_top_id`,
+`reply_to_msg_id` and `forum_topic` fields, as on Telethon messages.
+
+Usage:
+    python replay_messages.py messages.jsonl --topic-id 5
+    python replay_messages.py result.json --topic-id 5 --speed 10   # 10x real time
+    python replay_messages.py messages.jsonl --topic-id 5 --speed 0 # as fast as possible (default)
+    python replay_messages.py sessions/history --topic-id 5         # recorded live traffic
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from message_handler import HandlerContext, handle_new_message
+from parse_executor import ParseExecutor
+from rate_analytics import RateAnalytics
+from routing import Route, RoutingTable
+from utils.dedup_store import DedupStore
+from utils.offer_history import OfferHistory
+from utils.outbound_queue import OutboundDispatcher
+from utils.parse_memo import ParseMemo
+from utils.sender_cache import SenderCache
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayClient:
+    """Stand-in for TelegramClient that records outgoing messages instead of sending them."""
+
+    def __init__(self, send_latency: float = 0.0):
+        self.send_latency = send_latency
+        self.sent = []  # (entity, text, kwargs)
+
+    async def send_message(self, entity, message, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent.append((entity, message, kwargs))
+        return SimpleNamespace(id=len(self.sent), peer_id=entity, message=message)
+
+
+class ReplayMessage:
+    """Minimal message object exposing the attributes the handler reads from Telethon messages."""
+
+    def __init__(self, record: dict):
+        self.id = record.get("id")
+        self.chat_id = record.get("chat_id")
+        self.text = record.get("text") or ""
+        self.date = record.get("date")
+        self.topic_id = record.get("topic_id")
+        reply_to = record.get("reply_to")
+        self.reply_to = SimpleNamespace(
+            reply_to_top_id=reply_to.get("reply_to_top_id"),
+            reply_to_msg_id=reply_to.get("reply_to_msg_id"),
+            forum_topic=reply_to.get("forum_topic", False),
+        ) if reply_to else None
+        self.chat = SimpleNamespace(username=record.get("chat_username"))
+        sender = record.get("sender")
+        self._sender = SimpleNamespace(
+            id=sender.get("id"),
+            first_name=sender.get("first_name") or "",
+            last_name=sender.get("last_name"),
+            username=sender.get("username"),
+        ) if sender else None
+
+    @property
+    def sender_id(self):
+        return self._sender.id if self._sender else None
+
+    async def get_sender(self):
+        return self._sender
+
+
+def _export_text(text) -> str:
+    # Telegram Desktop exports store formatted text as a list of plain strings and entity dicts
+    if isinstance(text, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text or ""
+
+
+def _export_chat_id(chat: dict) -> int | None:
+    chat_id = chat.get("id")
+    # Exports store supergroup ids without the -100 prefix used by the Bot API and Telethon
+    if chat_id is not None and chat.get("type") in ("private_supergroup", "public_supergroup"):
+        return int(f"-100{chat_id}")
+    return chat_id
+
+
+def record_from_export(chat: dict, raw: dict) -> dict | None:
+    """Converts one message of a Telegram Desktop export into a replay record (None for service messages)."""
+    if raw.get("type") != "message":
+        return None
+    from_id = str(raw.get("from_id") or "")
+    sender_id = int(from_id[4:]) if from_id.startswith("user") and from_id[4:].isdigit() else None
+    name_parts = (raw.get("from") or "").split(" ", 1)
+    record = {
+        "id": raw.get("id"),
+        "chat_id": _export_chat_id(chat),
+        "text": _export_text(raw.get("text")),
+        "date": int(raw["date_unixtime"]) if raw.get("date_unixtime") else None,
+        "sender": {"id": sender_id, "first_name": name_parts[0], "last_name": name_parts[1] if len(name_parts) > 1 else None},
+    }
+    # Desktop exports only keep the replied-to id; in forum groups this is the topic for top-level posts
+    if raw.get("reply_to_message_id") is not None:
+        record["reply_to"] = {"reply_to_msg_id": raw["reply_to_message_id"], "forum_topic": True}
+    return record
+
+
+class _JsonStream:
+    """Reads a JSON document one value at a time from a file, keeping only the unread tail in memory."""
+
+    def __init__(self, f, read_size: int):
+        self.f = f
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next non-whitespace character without consuming it ("" at the end of the input)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may go on in the next read
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _members(self, opening: str, closing: str):
+        self.expect(opening)
+        if self.peek() == closing:
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            if char == closing:
+                self.pos += 1
+                return
+            self.expect(",")
+
+    def keys(self):
+        """Yields the keys of the object starting here; the caller consumes each value."""
+        for _ in self._members("{", "}"):
+            key = self.value()
+            self.expect(":")
+            yield key
+
+    def elements(self):
+        """Yields once per element of the array starting here; the caller consumes each element."""
+        yield from self._members("[", "]")
+
+
+def _iter_export_object(stream: _JsonStream):
+    """
+    Yields the records of the export object starting at the stream: its own `messages`
+    (a chat), then those of every chat in `chats.list` and `left_chats.list` (a full
+    account export). Returns whether the object had either.
+    """
+    chat = {}
+    found = False
+    for key in stream.keys():
+        if key == "messages" and stream.peek() == "[":
+            found = True
+            for _ in stream.elements():
+                record = record_from_export(chat, stream.value())
+                if record:
+                    yield record
+        elif key in ("chats", "left_chats") and stream.peek() == "{":
+            for list_key in stream.keys():
+                if list_key != "list" or stream.peek() != "[":
+                    stream.value()
+                    continue
+                found = True
+                for _ in stream.elements():
+                    yield from _iter_export_object(stream)
+        else:
+            # Exports write the chat fields (name, type, id) before the messages list
+            chat[key] = stream.value()
+    return found
+
+
+def _iter_export(f, read_size: int = 1 << 20):
+    """
+    Streams the messages of a Telegram Desktop export without loading the whole file. Both
+    a single chat export (top-level `messages`) and a full account export (`chats.list[*].messages`)
+    are read; anything else raises ValueError.
+    """
+    if not (yield from _iter_export_object(_JsonStream(f, read_size))):
+        raise ValueError('Not a Telegram Desktop export: expected a "messages" list (single chat export) '
+                         'or "chats": {"list": [...]} (full account export) at the top level')
+
+
+def iter_messages(path: str):
+    """Streams message records from a JSONL file, a Telegram Desktop JSON export or an offer history directory."""
+    if os.path.isdir(path):
+        for record in OfferHistory(path).scan():
+            yield record.as_message_record()
+        return
+    with open(path, encoding="utf-8") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "{" and path.endswith(".json"):
+            yield from _iter_export(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_messages(path: str) -> list[dict]:
+    """Loads message records from a JSONL file, a Telegram Desktop JSON export or an offer history directory."""
+    return list(iter_messages(path))
+
+
+def _record_time(record: dict) -> float | None:
+    date = record.get("date")
+    if isinstance(date, (int, float)):
+        return float(date)
+    if isinstance(date, str):
+        try:
+            return datetime.fromisoformat(date).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+async def replay(records: list[dict], client: ReplayClient, routes: RoutingTable,
+                 speed: float = 0.0, sender_cache: SenderCache | None = None,
+                 send_rate: float = 1000.0, dedup: DedupStore | None = None,
+                 parser: ParseExecutor | None = None, analytics: RateAnalytics | None = None) -> list[float]:
+    """
+    Replays `records` through the handler and returns per-message handler latencies in seconds.
+
+    With speed > 0, messages are released at their recorded spacing divided by `speed` and
+    handled concurrently, as live events would be; latency is measured from the scheduled
+    arrival time. With speed == 0, messages are handled back to back as fast as possible.
+    Outgoing messages are paced at `send_rate` per second and fully drained before returning.
+    """
+    latencies = []
+    outbound = OutboundDispatcher(client, rate=send_rate, burst=max(1, int(send_rate)), max_depth=len(records) + 1)
+    outbound.start()
+    context = HandlerContext(outbound, sender_cache=sender_cache, dedup=dedup, parser=parser, analytics=analytics)
+
+    async def handle(record: dict, arrival: float):
+        # Same order as the live bot: the routing filter runs before any handler work
+        message = ReplayMessage(record)
+        route = routes.route_for(message)
+        if route is not None:
+            await handle_new_message(message, route, context)
+        latencies.append(time.perf_counter() - arrival)
+
+    if speed <= 0:
+        for record in records:
+            await handle(record, time.perf_counter())
+        await outbound.stop(drain_timeout=None)
+        return latencies
+
+    tasks = []
+    started = time.perf_counter()
+    first_time = None
+    for record in records:
+        record_time = _record_time(record)
+        if record_time is not None:
+            first_time = record_time if first_time is None else first_time
+            arrival = started + (record_time - first_time) / speed
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            arrival = time.perf_counter()
+        tasks.append(asyncio.create_task(handle(record, arrival)))
+    await asyncio.gather(*tasks)
+    await outbound.stop(drain_timeout=None)
+    return latencies
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def print_report(latencies: list[float], elapsed: float, client: ReplayClient, notify_user_id: int):
+    print(f"--- Replay report ({len(latencies)} messages in {elapsed:.3f}s) ---")
+    if latencies:
+        ordered = sorted(latencies)
+        print(f"  Throughput: {len(latencies) / elapsed if elapsed else float('inf'):.1f} msgs/sec")
+        print("  Latency (ms): " + ", ".join(
+            f"p{int(q * 100)}={_percentile(ordered, q) * 1000:.2f}" for q in (0.5, 0.9, 0.99)
+        ) + f", max={ordered[-1] * 1000:.2f}")
+    notifications = sum(1 for entity, _, _ in client.sent if entity == notify_user_id)
+    print(f"  Owner notifications: {notifications}")
+    print(f"  Auto-responses: {len(client.sent) - notifications}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Replay recorded messages through the bot pipeline offline.")
+    arg_parser.add_argument('input', help="JSONL file, Telegram Desktop JSON export (result.json) or offer history directory")
+    arg_parser.add_argument('--topic-id', type=int, required=True, help="Target topic ID to treat as monitored")
+    arg_parser.add_argument('--chat-id', type=int, help="Monitored chat ID (default: every chat in the input)")
+    arg_parser.add_argument('--notify-user-id', type=int, default=0, help="Owner user ID recorded for notifications")
+    arg_parser.add_argument('--speed', type=float, default=0.0,
+                            help="Replay speed relative to recorded timestamps; 0 = as fast as possible")
+    arg_parser.add_argument('--send-latency', type=float, default=0.0, help="Simulated send_message latency in seconds")
+    arg_parser.add_argument('--send-rate', type=float, default=1000.0, help="Outbound queue pacing in messages/sec")
+    arg_parser.add_argument('--dedup-db', help="SQLite dedup store to use (e.g. ':memory:'); disabled by default")
+    arg_parser.add_argument('--verbose', action='store_true', help="Show the handler's INFO logs")
+    arg_parser.add_argument('--dump-sent', action='store_true', help="Print every recorded outgoing message")
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='[%(levelname)5s/%(asctime)s] %(name)s: %(message)s')
+
+    records = load_messages(args.input)
+    chat_ids = [args.chat_id] if args.chat_id is not None else sorted({r.get("chat_id") for r in records} - {None})
+    routes = RoutingTable([Route(chat_id, args.topic_id, args.notify_user_id) for chat_id in chat_ids])
+    client = ReplayClient(send_latency=args.send_latency)
+    sender_cache = SenderCache()
+    dedup = DedupStore(args.dedup_db) if args.dedup_db else None
+    parser = ParseExecutor(memo=ParseMemo())
+    analytics = RateAnalytics()
+
+    started = time.perf_counter()
+    latencies = asyncio.run(replay(records, client, routes, args.speed, sender_cache,
+                                   args.send_rate, dedup, parser, analytics))
+    elapsed = time.perf_counter() - started
+
+    print_report(latencies, elapsed, client, args.notify_user_id)
+    print(f"  Sender cache: {sender_cache.stats()}")
+    print(f"  Parse executor: {parser.stats}")
+    print(f"  Parse memo: {parser.memo.stats()}")
+    print(f"  Rate analytics: {analytics.stats}")
+    parser.shutdown()
+    if dedup is not None:
+        print(f"  Dedup store: {dedup.stats}")
+        dedup.flush()
+    if args.dump_sent:
+        for entity, text, _ in client.sent:
+            print(f"\n→ {entity}:\n{text}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
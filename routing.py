@@ -0,0 +1,149 @@
+"""
+Routing table for monitored groups and topics.
+
+Maps `(chat_id, topic_id)` to a Route carrying the parser profile, auto-response setting
+and notify target for that topic. A route with `topic_id=None` covers the whole chat
+(groups without topics). Lookups are one or two dict probes, independent of the number
+of routes, and are cheap enough to run in the Telethon event filter so messages from
+unrouted topics are dropped before the handler runs.
+"""
+
+import asyncio
+import json
+import logging
+
+from message_parser import parse_offer
+
+# Parser profile name -> function returning a ParsedOffer or None
+PARSER_PROFILES = {
+    "gbp_rub": parse_offer,
+}
+DEFAULT_PROFILE = "gbp_rub"
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_topic_id(message) -> int | None:
+    """Returns the forum topic id a message belongs to, or None if it has no topic context."""
+    if hasattr(message, 'topic_id') and message.topic_id:
+        return message.topic_id
+    if message.reply_to:
+        if hasattr(message.reply_to, 'reply_to_top_id') and message.reply_to.reply_to_top_id is not None:
+            return message.reply_to.reply_to_top_id
+        if getattr(message.reply_to, 'forum_topic', False) and hasattr(message.reply_to, 'reply_to_msg_id') and message.reply_to.reply_to_msg_id is not None:
+            return message.reply_to.reply_to_msg_id
+    return None
+
+
+class Route:
+    __slots__ = ("name", "chat_id", "topic_id", "notify_user_id", "profile", "parse", "auto_respond", "account")
+
+    def __init__(self, chat_id: int, topic_id: int | None, notify_user_id: int, profile: str = DEFAULT_PROFILE,
+                 auto_respond: bool = True, name: str | None = None, account: str | None = None):
+        if profile not in PARSER_PROFILES:
+            raise ValueError(f"Unknown parser profile '{profile}' (known: {', '.join(PARSER_PROFILES)})")
+        self.name = name or f"{chat_id}/{topic_id if topic_id is not None else '*'}"
+        self.chat_id = chat_id
+        self.topic_id = topic_id
+        self.notify_user_id = notify_user_id
+        self.profile = profile
+        self.parse = PARSER_PROFILES[profile]
+        self.auto_respond = auto_respond
+        self.account = account  # account that must listen to this chat (see sharding.py); None = any
+
+    def __repr__(self):
+        return (f"Route({self.name}: chat={self.chat_id}, topic={self.topic_id}, notify={self.notify_user_id}, "
+                f"profile={self.profile}, auto_respond={self.auto_respond})")
+
+
+class RoutingTable:
+    def __init__(self, routes: list[Route]):
+        self.routes = list(routes)
+        self._by_key = {}
+        for route in self.routes:
+            key = (route.chat_id, route.topic_id)
+            if key in self._by_key:
+                raise ValueError(f"Duplicate route for chat {route.chat_id}, topic {route.topic_id}")
+            self._by_key[key] = route
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    @property
+    def chat_ids(self) -> list[int]:
+        return sorted({route.chat_id for route in self.routes})
+
+    @property
+    def notify_user_ids(self) -> list[int]:
+        return sorted({route.notify_user_id for route in self.routes})
+
+    def route_for(self, message) -> Route | None:
+        """Returns the route for `message`: exact (chat, topic) first, then the chat-wide route."""
+        chat_id = message.chat_id
+        topic_id = resolve_topic_id(message)
+        if topic_id is not None:
+            route = self._by_key.get((chat_id, topic_id))
+            if route is not None:
+                return route
+        return self._by_key.get((chat_id, None))
+
+    def accepts_event(self, event) -> bool:
+        """Telethon event filter (`events.NewMessage(func=...)`): True if the message has a route."""
+        return self.route_for(event.message) is not None
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> "RoutingTable":
+        """
+        Builds the table from `cfg['routes']` (list of dicts with chat_id, topic_id, and optional
+        notify_user_id, profile, auto_respond, name, account) or, if absent, from the single
+        target_group_id/target_topic_id pair. Routes without notify_user_id use cfg['notify_user_id'].
+        """
+        raw_routes = cfg.get('routes') or [{
+            "chat_id": cfg['target_group_id'],
+            "topic_id": cfg['target_topic_id'],
+        }]
+        routes = []
+        for raw in raw_routes:
+            topic_id = raw.get("topic_id")
+            routes.append(Route(
+                chat_id=int(raw["chat_id"]),
+                topic_id=int(topic_id) if topic_id not in (None, "", "*") else None,
+                notify_user_id=int(raw.get("notify_user_id") or cfg['notify_user_id']),
+                profile=raw.get("profile", DEFAULT_PROFILE),
+                auto_respond=_as_bool(raw.get("auto_respond", True)),
+                name=raw.get("name"),
+                account=raw.get("account") or None,
+            ))
+        return cls(routes)
+
+
+async def resolve_input_peers(client, routes: RoutingTable) -> dict:
+    """
+    Resolves the routed chats and notify users to input peers concurrently.
+    Returns id -> input peer for the ids that resolved; failures are logged and left out,
+    so sends to them fall back to Telethon's own lookup.
+    """
+    peer_ids = list(dict.fromkeys(routes.chat_ids + routes.notify_user_ids))
+    results = await asyncio.gather(*(client.get_input_entity(peer_id) for peer_id in peer_ids),
+                                   return_exceptions=True)
+    resolved = {}
+    for peer_id, result in zip(peer_ids, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not pre-resolve entity {peer_id}: {result}")
+        else:
+            resolved[peer_id] = result
+    return resolved
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def parse_routes_json(value: str) -> list[dict]:
+    """Parses the ROUTES environment variable: a JSON list of route objects."""
+    routes = json.loads(value)
+    if not isinstance(routes, list):
+        raise ValueError("ROUTES must be a JSON list of route objects")
+    return routes
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Telethon session storage with low write traffic.
+
+`SnapshotSession` keeps the whole session in memory and writes it to
+`sessions/<name>.snapshot` as one compressed binary snapshot (temp file + fsync +
+rename, so a crash leaves either the old or the new snapshot). Telethon calls `save()`
+after connecting and about once a minute; a snapshot is written immediately when the
+connection or auth key changed and otherwise at most every `snapshot_interval`
+seconds, plus once on disconnect. Entities are kept in a dict (O(1) lookups by id),
+optionally capped at `max_entities` with least-recently-used eviction; pinned ids
+(our own user, routed chats, notify users) are never evicted.
+
+The same encoding, restricted to the auth key and pinned entities, base64-encoded, is
+short enough (a few hundred characters) for the SESSION_STRING environment variable:
+
+    python session_backend.py sessions/my_telegram_session
+prints it for an existing session.
+
+`open_session` picks the backend: the snapshot file, else SESSION_STRING, else the
+entities and auth key of a legacy SQLite `.session` file. `session_backend = sqlite`
+keeps using the SQLite file directly.
+"""
+
+import base64
+import datetime
+import logging
+import os
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from collections import OrderedDict
+
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.tl import types
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = '.snapshot'
+BACKENDS = ('snapshot', 'sqlite')
+_MAGIC = b'GBS1'
+_HEADER = struct.Struct('<HBH')  # dc_id, address length, port
+_STATE = struct.Struct('<qiiqi')  # entity id, pts, qts, date, seq
+_ENTITY = struct.Struct('<qqB')  # id, access hash, has text fields
+_COUNT = struct.Struct('<I')
+_TEXT = struct.Struct('<H')
+
+
+def _pack_text(value: str | None) -> bytes:
+    data = (value or '').encode('utf-8')[:0xFFFF]
+    return _TEXT.pack(len(data)) + data
+
+
+class _Reader:
+    __slots__ = ('data', 'pos')
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def read(self, size: int) -> bytes:
+        chunk = self.data[self.pos:self.pos + size]
+        if len(chunk) != size:
+            raise ValueError('Truncated session data')
+        self.pos += size
+        return chunk
+
+    def text(self) -> str | None:
+        (size,) = self.unpack(_TEXT)
+        return self.read(size).decode('utf-8') or None
+
+
+class SnapshotSession(MemorySession):
+    """
+    Telethon `MemorySession` persisted as a snapshot file at `path` (no file if None).
+    `stats` counts snapshots written, the last snapshot's size and evicted entities.
+    """
+
+    def __init__(self, path: str | None = None, max_entities: int | None = None, snapshot_interval: float = 300.0,
+                 pinned_ids=()):
+        super().__init__()
+        self.path = path
+        self.max_entities = max_entities
+        self.snapshot_interval = snapshot_interval
+        self.pinned_ids = {0, *pinned_ids}
+        self.stats = {'snapshots': 0, 'snapshot_bytes': 0, 'evicted': 0}
+        self._entities = OrderedDict()  # marked id -> (id, hash, username, phone, name), least recently used first
+        self._dirty = False
+        self._saved_connection = None  # (dc_id, address, port, auth key) as of the last snapshot
+        self._saved_at = 0.0
+
+    # --- Encoding ---
+
+    def to_bytes(self, entity_ids=None, with_text: bool = True, with_states: bool = True) -> bytes:
+        """
+        The session as compressed binary: connection, auth key, update states and the
+        entities in `entity_ids` (all if None), with usernames/phones/names if `with_text`.
+        """
+        address = (self.server_address or '').encode('ascii')
+        parts = [_HEADER.pack(self.dc_id or 0, len(address), self.port or 0), address]
+        key = self.auth_key.key if self.auth_key and self.auth_key.key else b''
+        parts += [_TEXT.pack(len(key)), key]
+
+        states = list(self._update_states.items()) if with_states else []
+        parts.append(_COUNT.pack(len(states)))
+        for entity_id, state in states:
+            parts.append(_STATE.pack(entity_id, state.pts, state.qts, int(state.date.timestamp()), state.seq))
+
+        rows = [row for entity_id, row in self._entities.items() if entity_ids is None or entity_id in entity_ids]
+        parts.append(_COUNT.pack(len(rows)))
+        for entity_id, access_hash, username, phone, name in rows:
+            parts.append(_ENTITY.pack(entity_id, access_hash, with_text))
+            if with_text:
+                parts += [_pack_text(username), _pack_text(phone), _pack_text(name)]
+        return _MAGIC + zlib.compress(b''.join(parts), 9)
+
+    def load_bytes(self, data: bytes):
+        """Replaces the session's contents with a `to_bytes()` snapshot; raises ValueError if it is invalid."""
+        if not data.startswith(_MAGIC):
+            raise ValueError('Not a session snapshot')
+        try:
+            reader = _Reader(zlib.decompress(data[len(_MAGIC):]))
+            dc_id, address_length, port = reader.unpack(_HEADER)
+            address = reader.read(address_length).decode('ascii') or None
+            (key_length,) = reader.unpack(_TEXT)
+            key = reader.read(key_length)
+
+            states = {}
+            (count,) = reader.unpack(_COUNT)
+            for _ in range(count):
+                entity_id, pts, qts, date, seq = reader.unpack(_STATE)
+                states[entity_id] = types.updates.State(
+                    pts, qts, datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc), seq, unread_count=0)
+
+            entities = OrderedDict()
+            (count,) = reader.unpack(_COUNT)
+            for _ in range(count):
+                entity_id, access_hash, with_text = reader.unpack(_ENTITY)
+                fields = (reader.text(), reader.text(), reader.text()) if with_text else (None, None, None)
+                entities[entity_id] = (entity_id, access_hash, *fields)
+        except (zlib.error, struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f'Corrupt session snapshot: {e}') from e
+
+        self._dc_id, self._server_address, self._port = dc_id, address, port
+        self._auth_key = AuthKey(key) if key else None
+        self._update_states = states
+        self._entities = entities
+        self._saved_connection = self._connection()
+
+    def to_string(self, entity_ids=None) -> str:
+        """Compact form for SESSION_STRING: auth key and the given entities (default: pinned ones), no update states."""
+        entity_ids = self.pinned_ids | self._self_ids() if entity_ids is None else set(entity_ids)
+        return base64.urlsafe_b64encode(self.to_bytes(entity_ids, with_text=False, with_states=False)).decode('ascii')
+
+    def load_string(self, value: str):
+        try:
+            data = base64.urlsafe_b64decode(value.strip())
+        except ValueError as e:  # binascii.Error is a ValueError
+            raise ValueError(f'SESSION_STRING is not valid base64: {e}') from e
+        self.load_bytes(data)
+
+    # --- Persistence ---
+
+    def _connection(self) -> tuple:
+        return self.dc_id, self.server_address, self.port, self.auth_key.key if self.auth_key else None
+
+    def load(self) -> bool:
+        """Loads the snapshot file; returns False if there is none."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            self.load_bytes(f.read())
+        self._saved_at = time.monotonic()
+        return True
+
+    def save(self, force: bool = False):
+        """
+        Writes a snapshot if the connection or auth key changed, or if other changes are
+        pending and `snapshot_interval` has passed since the last one (always with `force`).
+        Nothing is written before the session has an auth key.
+        """
+        if not self.path or self.auth_key is None:
+            return  # an unauthorized session must not shadow SESSION_STRING on the next start
+        connection_changed = self._connection() != self._saved_connection
+        due = self._dirty and time.monotonic() - self._saved_at >= self.snapshot_interval
+        if not (connection_changed or due or (force and self._dirty)):
+            return
+        data = self.to_bytes()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._dirty = False
+        self._saved_connection = self._connection()
+        self._saved_at = time.monotonic()
+        self.stats['snapshots'] += 1
+        self.stats['snapshot_bytes'] = len(data)
+
+    def close(self):
+        self.save(force=True)
+
+    def delete(self):
+        self._saved_connection = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # --- Session state ---
+
+    def set_update_state(self, entity_id, state):
+        self._update_states[entity_id] = state
+        self._dirty = True
+
+    def _self_ids(self) -> set:
+        # Telethon stores our own user id as the access hash of entity 0
+        row = self._entities.get(0)
+        return {row[1]} if row else set()
+
+    def process_entities(self, tlo):
+        for row in self._entities_to_rows(tlo):
+            if self._entities.get(row[0]) != row:
+                self._entities[row[0]] = row
+                self._dirty = True
+            self._entities.move_to_end(row[0])
+        self._evict()
+
+    def _evict(self):
+        if self.max_entities is None or len(self._entities) <= self.max_entities:
+            return
+        keep = self.pinned_ids | self._self_ids()
+        for entity_id in list(self._entities):
+            if len(self._entities) <= self.max_entities:
+                break
+            if entity_id not in keep:
+                del self._entities[entity_id]
+                self.stats['evicted'] += 1
+
+    def add_entity_rows(self, rows):
+        """Adds (id, hash, username, phone, name) rows, e.g. from a legacy session file."""
+        for row in rows:
+            self._entities[row[0]] = tuple(row)
+        self._dirty = True
+        self._evict()
+
+    def get_entity_rows_by_phone(self, phone):
+        return next(((id, hash) for id, hash, _, found_phone, _ in self._entities.values() if found_phone == phone),
+                    None)
+
+    def get_entity_rows_by_username(self, username):
+        return next(((id, hash) for id, hash, found_username, _, _ in self._entities.values()
+                     if found_username == username), None)
+
+    def get_entity_rows_by_name(self, name):
+        return next(((id, hash) for id, hash, _, _, found_name in self._entities.values() if found_name == name),
+                    None)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        # A bare id may be a user, chat or channel; the marked forms are Telethon's, as in MemorySession
+        ids = (id,) if exact else (utils.get_peer_id(types.PeerUser(id)), utils.get_peer_id(types.PeerChat(id)),
+                                   utils.get_peer_id(types.PeerChannel(id)))
+        for entity_id in ids:
+            row = self._entities.get(entity_id)
+            if row is not None:
+                self._entities.move_to_end(entity_id)
+                return row[0], row[1]
+        return None
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+
+def import_sqlite_session(session: SnapshotSession, filename: str):
+    """Copies connection, auth key, update states and entities from a Telethon SQLite session file."""
+    legacy = SQLiteSession(filename)
+    try:
+        session.set_dc(legacy.dc_id, legacy.server_address, legacy.port)
+        session.auth_key = legacy.auth_key
+        for entity_id, state in legacy.get_update_states():
+            session.set_update_state(entity_id, state)
+    finally:
+        legacy.close()
+    with sqlite3.connect(legacy.filename) as conn:
+        rows = conn.execute('select id, hash, username, phone, name from entities order by date').fetchall()
+    session.add_entity_rows(rows)
+
+
+def open_session(config: dict, path: str, pinned_ids=()):
+    """
+    The session for `TelegramClient`: a path for the SQLite backend, or a SnapshotSession
+    restored from `<path>.snapshot`, the SESSION_STRING setting or a legacy `<path>.session`.
+    """
+    backend = config.get('session_backend') or 'snapshot'
+    if backend == 'sqlite':
+        return path
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown session backend '{backend}' (known: {', '.join(BACKENDS)})")
+
+    session = SnapshotSession(path + SNAPSHOT_SUFFIX, max_entities=config.get('session_max_entities'),
+                              pinned_ids=pinned_ids)
+    if session.load():
+        logger.info(f"Session loaded from {session.path} ({len(session)} entities)")
+    elif config.get('session_string'):
+        session.load_string(config['session_string'])
+        logger.info(f"Session restored from SESSION_STRING ({len(session)} entities)")
+    elif os.path.exists(path + '.session'):
+        import_sqlite_session(session, path + '.session')
+        logger.info(f"Session imported from {path}.session ({len(session)} entities)")
+    else:
+        logger.warning(f"No session at {session.path}; the account must be authorized first")
+    return session
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(f"Usage: python {sys.argv[0]} sessions/<SESSION_NAME>")
+        sys.exit(2)
+    snapshot = SnapshotSession(sys.argv[1] + SNAPSHOT_SUFFIX)
+    if not snapshot.load():
+        if not os.path.exists(sys.argv[1] + '.session'):
+            print(f"No session found at {sys.argv[1]}")
+            sys.exit(1)
+        import_sqlite_session(snapshot, sys.argv[1] + '.session')
+    # Without a routing table, only our own user is known to be needed
+    print(snapshot.to_string())
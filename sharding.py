@@ -0,0 +1,165 @@
+"""
+Multi-account operation: several Telegram accounts in one process.
+
+Each account is a Shard with its own client, session and OutboundDispatcher. Routed chats
+are split across the shards (`assign_shards`), so every chat is listened to by exactly
+one account. Outgoing messages go through an OutboundPool, which sends each message from
+the connected account with the most remaining rate budget that can reach the recipient,
+so sending capacity grows with the number of accounts. Every shard reconnects on its
+own schedule (`Backoff`), so one dropped account does not stop the others. No Telethon
+imports; the bot passes in the pieces that need it.
+"""
+
+import logging
+import random
+
+from routing import RoutingTable
+from utils.outbound_queue import PRIORITY_NOTIFICATION, OutboundDispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    """Exponential reconnect delays: base, base*factor, ... capped at `max_delay`, with ±`jitter` spread."""
+
+    def __init__(self, base: float = 2.0, max_delay: float = 300.0, factor: float = 2.0, jitter: float = 0.1):
+        self.base = base
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        delay = min(self.max_delay, self.base * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class Shard:
+    """One account: its client, the routes it listens to and its own paced outbound queue."""
+
+    def __init__(self, name: str, client, routes: RoutingTable, outbound: OutboundDispatcher,
+                 session_path: str | None = None, phone_number: str | None = None):
+        self.name = name
+        self.client = client
+        self.routes = routes
+        self.outbound = outbound
+        self.session_path = session_path
+        self.phone_number = phone_number
+        self.connected = False
+        self.backoff = Backoff()
+        self.stats = {"connects": 0, "disconnects": 0, "failed_connects": 0}
+
+    def __repr__(self):
+        return f"Shard({self.name}: {len(self.routes)} route(s), chats={self.routes.chat_ids})"
+
+
+def assign_shards(routes: RoutingTable, accounts: list[str]) -> dict[str, RoutingTable]:
+    """
+    Splits `routes` across `accounts` by chat: all routes of a chat go to one account.
+    Routes naming an `account` stay there; the other chats go, in chat id order, to the
+    account with the fewest chats so far. Returns account -> routing table (possibly empty).
+    """
+    if not accounts:
+        raise ValueError("At least one account is needed")
+    by_chat = {}
+    for route in routes.routes:
+        by_chat.setdefault(route.chat_id, []).append(route)
+    assigned = {account: [] for account in accounts}
+    chats = {account: set() for account in accounts}
+    unpinned = []
+    for chat_id, chat_routes in sorted(by_chat.items()):
+        pinned = {route.account for route in chat_routes if route.account}
+        if len(pinned) > 1:
+            raise ValueError(f"Routes for chat {chat_id} name different accounts: {', '.join(sorted(pinned))}")
+        if pinned:
+            account = pinned.pop()
+            if account not in assigned:
+                raise ValueError(f"Route for chat {chat_id} names unknown account '{account}' "
+                                 f"(known: {', '.join(accounts)})")
+            assigned[account] += chat_routes
+            chats[account].add(chat_id)
+        else:
+            unpinned.append((chat_id, chat_routes))
+    for chat_id, chat_routes in unpinned:
+        account = min(accounts, key=lambda name: len(chats[name]))  # first account wins ties
+        assigned[account] += chat_routes
+        chats[account].add(chat_id)
+    return {account: RoutingTable(account_routes) for account, account_routes in assigned.items()}
+
+
+class OutboundPool:
+    """
+    OutboundDispatcher interface over the shards' dispatchers.
+
+    `enqueue` picks, among connected shards that can reach the recipient, the one whose
+    dispatcher has the largest `budget()` (ties go to the shard listening to the chat the
+    message came from). A shard can reach an entity it pre-resolved (`input_peers`), and,
+    given `via_message=(chat_id, message_id)`, a user seen in a chat it also has resolved,
+    through `peer_from_message(chat_peer, message_id, user_id)` (Telethon's
+    InputPeerUserFromMessage). When no shard qualifies, the listening shard (else the
+    first one) sends, as a single-account bot would.
+    """
+
+    def __init__(self, shards: list[Shard], peer_from_message=None):
+        self.shards = list(shards)
+        self.peer_from_message = peer_from_message
+        self._home = {chat_id: shard for shard in self.shards for chat_id in shard.routes.chat_ids}
+        self.balanced = 0  # messages sent by a shard other than the listening one
+
+    def __len__(self) -> int:
+        return sum(len(shard.outbound) for shard in self.shards)
+
+    @property
+    def stats(self) -> dict:
+        totals = {}
+        for shard in self.shards:
+            for key, value in shard.outbound.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        totals["balanced"] = self.balanced
+        return totals
+
+    def pick(self, entity, via_message: tuple | None = None) -> tuple[Shard, object]:
+        """Returns the shard to send through and the entity to send to from that shard."""
+        chat_id, message_id = via_message if via_message else (None, None)
+        home = self._home.get(chat_id)
+        ordered = [home, *(shard for shard in self.shards if shard is not home)] if home else self.shards
+        candidates = []
+        for shard in ordered:
+            if not shard.connected:
+                continue
+            if shard is home or entity in shard.outbound.input_peers:
+                candidates.append((shard, entity))
+            elif via_message and self.peer_from_message and chat_id in shard.outbound.input_peers:
+                chat_peer = shard.outbound.input_peers[chat_id]
+                candidates.append((shard, self.peer_from_message(chat_peer, message_id, entity)))
+        if not candidates:
+            return home or self.shards[0], entity
+        # max() keeps the first of equal budgets, so the listening shard is preferred
+        return max(candidates, key=lambda candidate: candidate[0].outbound.budget())
+
+    def enqueue(self, entity, text: str, priority: int = PRIORITY_NOTIFICATION, on_failure=None,
+                description: str = "", kind: str = "message", received_at: float | None = None,
+                via_message: tuple | None = None, **send_kwargs) -> bool:
+        shard, target = self.pick(entity, via_message)
+        if via_message and shard is not self._home.get(via_message[0]):
+            self.balanced += 1
+        if len(self.shards) > 1:
+            description = f"{description or 'message'} via {shard.name}"
+        return shard.outbound.enqueue(target, text, priority=priority, on_failure=on_failure,
+                                      description=description, kind=kind, received_at=received_at, **send_kwargs)
+
+    def start(self):
+        for shard in self.shards:
+            shard.outbound.start()
+
+    async def join(self, timeout: float | None = None):
+        for shard in self.shards:
+            await shard.outbound.join(timeout)
+
+    async def stop(self, drain_timeout: float | None = 10.0):
+        for shard in self.shards:
+            await shard.outbound.stop(drain_timeout if shard.client.is_connected() else 0)
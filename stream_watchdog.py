@@ -0,0 +1,210 @@
+"""
+Update-stream liveness watchdog.
+
+A connected client can stop receiving updates without disconnecting, and offers posted
+meanwhile are only found at the next restart. The watchdog notes every live event per
+route and every raw update per account, and every `check_interval` seconds:
+
+*   probes each account that received no update for `idle_update_timeout` with a cheap
+    request (`get_me`); a failed or hung probe reconnects the account;
+*   probes each route that has been silent for longer than its expected gap (an average of
+    its recent message intervals times `gap_factor`, clamped to `min_silence`..`max_silence`)
+    by fetching the newest messages of its topic; a text message newer than the route's
+    cursor (the last processed message id) that was never delivered live is a gap.
+
+A gap is first repaired in place by a resync: Telethon's `catch_up()` (update difference)
+and the bot's history catch-up for the affected routes. A second gap on the same account
+within `escalate_window` seconds reconnects it instead (the shard loop reconnects and
+catches up), all without restarting the process. Time-to-detect (age of the oldest missed
+message) and time-to-recover are exported as `watchdog_detect_seconds` and
+`watchdog_recover_seconds`. No Telethon imports; clients are used through their methods.
+"""
+
+import asyncio
+import logging
+import time
+
+from routing import RoutingTable
+from sharding import Shard
+from utils.dedup_store import DedupStore
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class RouteActivity:
+    __slots__ = ("last_event_at", "checked_at", "mean_gap")
+
+    def __init__(self, now: float):
+        self.last_event_at = None  # monotonic time of the last live event
+        self.checked_at = now  # last time the route was known to be up to date (event or clean probe)
+        self.mean_gap = None  # moving average of the seconds between live events
+
+
+class Watchdog:
+    def __init__(self, dedup: DedupStore, catch_up_routes, check_interval: float = 60.0,
+                 min_silence: float = 600.0, max_silence: float = 3 * 3600.0, gap_factor: float = 6.0,
+                 idle_update_timeout: float = 600.0, probe_timeout: float = 15.0, grace: float = 30.0,
+                 escalate_window: float = 1800.0, smoothing: float = 0.2):
+        """
+        `catch_up_routes(shard, routes)` processes a shard's missed messages for the given
+        RoutingTable (the bot's history catch-up) and returns how many were handled.
+        Messages younger than `grace` seconds may still be in flight and don't count as missed.
+        """
+        self.dedup = dedup
+        self.catch_up_routes = catch_up_routes
+        self.check_interval = check_interval
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.gap_factor = gap_factor
+        self.idle_update_timeout = idle_update_timeout
+        self.probe_timeout = probe_timeout
+        self.grace = grace
+        self.escalate_window = escalate_window
+        self.smoothing = smoothing
+        self.stats = {"probes": 0, "probe_failures": 0, "gaps": 0, "resyncs": 0, "reconnects": 0}
+        self._routes = {}  # route name -> RouteActivity
+        self._last_update = {}  # shard name -> monotonic time of the last raw update
+        self._last_resync = {}  # shard name -> monotonic time of the last resync
+        self._reconnecting = {}  # shard name -> monotonic time the reconnect was forced
+
+    def _activity(self, route_name: str) -> RouteActivity:
+        activity = self._routes.get(route_name)
+        if activity is None:
+            activity = self._routes[route_name] = RouteActivity(time.monotonic())
+        return activity
+
+    def observe(self, route_name: str):
+        """Notes a live message event for a route."""
+        now = time.monotonic()
+        activity = self._activity(route_name)
+        if activity.last_event_at is not None:
+            gap = now - activity.last_event_at
+            activity.mean_gap = gap if activity.mean_gap is None else (
+                activity.mean_gap + self.smoothing * (gap - activity.mean_gap))
+        activity.last_event_at = activity.checked_at = now
+
+    def observe_update(self, shard_name: str):
+        """Notes any update received by an account."""
+        self._last_update[shard_name] = time.monotonic()
+
+    def on_connected(self, shard: Shard):
+        """Called when an account (re)connects: restarts its silence clocks and closes a forced reconnect."""
+        now = time.monotonic()
+        self._last_update[shard.name] = now
+        for route in shard.routes.routes:
+            self._activity(route.name).checked_at = now
+        forced_at = self._reconnecting.pop(shard.name, None)
+        if forced_at is not None:
+            METRICS.observe("watchdog_recover_seconds", now - forced_at, action="reconnect")
+            logger.info(f"[{shard.name}] Watchdog: reconnected {now - forced_at:.1f}s after the gap was detected.")
+
+    def silence_threshold(self, route_name: str) -> float:
+        """Seconds of silence after which the route is probed."""
+        mean_gap = self._activity(route_name).mean_gap
+        if mean_gap is None:
+            return self.max_silence
+        return min(self.max_silence, max(self.min_silence, self.gap_factor * mean_gap))
+
+    async def run(self, shards: list[Shard]):
+        """Checks the connected shards every `check_interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await asyncio.gather(*(self.check_shard(shard) for shard in shards if shard.connected))
+
+    async def check_shard(self, shard: Shard):
+        now = time.monotonic()
+        try:
+            if now - self._last_update.get(shard.name, now) >= self.idle_update_timeout:
+                if not await self._probe_connection(shard):
+                    idle = now - self._last_update[shard.name]
+                    METRICS.observe("watchdog_detect_seconds", idle, route="*")
+                    await self._reconnect(shard, f"no updates for {idle:.0f}s and the probe failed")
+                    return
+            missed = {}
+            for route in shard.routes.routes:
+                activity = self._activity(route.name)
+                if now - activity.checked_at < self.silence_threshold(route.name):
+                    continue
+                oldest_missed = await self._probe_route(shard, route)
+                if oldest_missed is None:
+                    activity.checked_at = time.monotonic()
+                else:
+                    missed[route.name] = oldest_missed
+            if missed:
+                await self._recover(shard, missed)
+        except Exception as e:
+            logger.error(f"[{shard.name}] Watchdog check failed: {e}")
+
+    async def _probe_connection(self, shard: Shard) -> bool:
+        self.stats["probes"] += 1
+        try:
+            await asyncio.wait_for(shard.client.get_me(), self.probe_timeout)
+        except Exception as e:  # asyncio.TimeoutError included
+            self.stats["probe_failures"] += 1
+            METRICS.inc("watchdog_probes_total", kind="connection", outcome="failed")
+            logger.warning(f"[{shard.name}] Watchdog: connection probe failed: {e!r}")
+            return False
+        METRICS.inc("watchdog_probes_total", kind="connection", outcome="ok")
+        self._last_update[shard.name] = time.monotonic()
+        return True
+
+    async def _probe_route(self, shard: Shard, route) -> float | None:
+        """Returns the Unix time of the oldest missed message found in the route's newest messages, or None."""
+        self.stats["probes"] += 1
+        try:
+            messages = await asyncio.wait_for(
+                shard.client.get_messages(route.chat_id, limit=5, reply_to=route.topic_id), self.probe_timeout)
+        except Exception as e:
+            self.stats["probe_failures"] += 1
+            METRICS.inc("watchdog_probes_total", kind="route", outcome="failed")
+            logger.warning(f"[{shard.name}] Watchdog: probe of {route.name} failed: {e!r}")
+            return None
+        cursor = self.dedup.get_cursor(route.name) or 0
+        settled_before = time.time() - self.grace
+        # Only text messages reach the handler (see catchup.fetch_missed); service messages never advance the cursor
+        missed = [message.date.timestamp() for message in messages
+                  if message.id > cursor and message.text and message.date is not None
+                  and message.date.timestamp() <= settled_before]
+        METRICS.inc("watchdog_probes_total", kind="route", outcome="gap" if missed else "ok")
+        return min(missed) if missed else None
+
+    async def _recover(self, shard: Shard, missed: dict):
+        detected_at = time.monotonic()
+        self.stats["gaps"] += 1
+        for route_name, oldest in missed.items():
+            METRICS.observe("watchdog_detect_seconds", max(0.0, time.time() - oldest), route=route_name)
+        names = ", ".join(missed)
+        last_resync = self._last_resync.get(shard.name)
+        if last_resync is not None and detected_at - last_resync < self.escalate_window:
+            await self._reconnect(shard, f"update gap in {names} again after a resync")
+            return
+
+        logger.warning(f"[{shard.name}] Watchdog: update gap in {names}; resyncing.")
+        METRICS.inc("watchdog_gaps_total", action="resync")
+        self.stats["resyncs"] += 1
+        catch_up_updates = getattr(shard.client, 'catch_up', None)
+        if catch_up_updates is not None:
+            try:
+                await asyncio.wait_for(catch_up_updates(), self.probe_timeout)
+            except Exception as e:  # asyncio.TimeoutError included
+                # The history catch-up below still recovers the missed messages
+                logger.warning(f"[{shard.name}] Watchdog: update resync failed: {e!r}")
+        routes = RoutingTable([route for route in shard.routes.routes if route.name in missed])
+        handled = await self.catch_up_routes(shard, routes)
+        now = time.monotonic()
+        # Only a completed resync counts towards escalation; a failed one is simply retried at the next check
+        self._last_resync[shard.name] = now
+        for route in routes.routes:
+            self._activity(route.name).checked_at = now
+        METRICS.observe("watchdog_recover_seconds", now - detected_at, action="resync")
+        logger.info(f"[{shard.name}] Watchdog: resync recovered {handled} message(s) in {now - detected_at:.1f}s.")
+
+    async def _reconnect(self, shard: Shard, reason: str):
+        logger.warning(f"[{shard.name}] Watchdog: {reason}; forcing a reconnect.")
+        METRICS.inc("watchdog_gaps_total", action="reconnect")
+        self.stats["reconnects"] += 1
+        self._reconnecting[shard.name] = time.monotonic()
+        self._last_resync.pop(shard.name, None)
+        # The shard loop sees the disconnect, reconnects with backoff and catches up
+        await shard.client.disconnect()
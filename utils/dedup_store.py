@@ -0,0 +1,290 @@
+"""Persistent dedup of processed messages and cooldowns for auto-responses and owner alerts."""
+
+import asyncio
+import hashlib
+import logging
+import math
+import sqlite3
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size bloom filter; `might_contain` is False only for keys that were never added."""
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def might_contain(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupStore:
+    """
+    Remembers processed `(chat_id, message_id)` pairs, cooldown keys and the last processed
+    message id per route (the catch-up cursor) in SQLite.
+
+    A handler `claim_message`s a message before processing it and `complete_message`s it
+    afterwards (or `release_message`s it if processing failed). Only completed messages
+    are written to disk, and the stored cursor of a route stays below its lowest message
+    still in progress, so a crash mid-handle leaves the message to catch-up.
+
+    Lookups are answered from memory: a bloom filter rules out unseen messages and an
+    LRU of recent ids confirms seen ones, so the database is only queried when the
+    bloom filter reports a possible hit that the LRU cannot confirm. Writes are buffered
+    and committed in batches by `flush()` (run every `flush_interval` seconds once
+    `start()` is called). Entries older than `retention` seconds are removed by `compact()`,
+    which runs on a worker thread with its own connection.
+    """
+
+    def __init__(self, path: str, retention: float = 7 * 24 * 3600, lru_size: int = 10_000,
+                 bloom_capacity: int = 100_000, flush_interval: float = 5.0, compact_interval: float = 3600.0):
+        self.path = path
+        self.retention = retention
+        self.lru_size = lru_size
+        self.bloom_capacity = bloom_capacity
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.stats = {"memory_hits": 0, "bloom_rejects": 0, "disk_lookups": 0, "duplicates": 0}
+        self._conn = sqlite3.connect(path)
+        # Must precede table creation to apply to a new file; compact() converts older files once
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_messages ("
+            "chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, processed_at REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cooldowns (key TEXT PRIMARY KEY, until REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS route_cursors (route TEXT PRIMARY KEY, last_message_id INTEGER NOT NULL)")
+        self._conn.commit()
+        self._recent = OrderedDict()
+        self._in_progress = {}  # (chat_id, message_id) -> route name of messages being handled
+        self._compacting = None  # messages completed while compact() rebuilds the memory front
+        self._cooldowns = {}  # key -> until (epoch seconds)
+        self._pending_messages = set()
+        self._pending_cooldowns = {}
+        self._cursors = dict(self._conn.execute("SELECT route, last_message_id FROM route_cursors"))
+        self._pending_cursors = {}
+        self._task = None
+        self._load()
+
+    def _load(self):
+        now = time.time()
+        self._bloom, self._recent = self._build_front(self._conn, now)
+        self._cooldowns = dict(self._conn.execute("SELECT key, until FROM cooldowns WHERE until > ?", (now,)))
+
+    def _build_front(self, conn: sqlite3.Connection, now: float) -> tuple:
+        """Bloom filter and LRU of the messages processed within the retention period."""
+        bloom = BloomFilter(self.bloom_capacity)
+        recent = OrderedDict()
+        rows = conn.execute(
+            "SELECT chat_id, message_id FROM processed_messages WHERE processed_at >= ? ORDER BY processed_at",
+            (now - self.retention,),
+        )
+        for chat_id, message_id in rows:
+            self._remember(chat_id, message_id, bloom, recent)
+        return bloom, recent
+
+    def _remember(self, chat_id: int, message_id: int, bloom: BloomFilter | None = None,
+                  recent: OrderedDict | None = None):
+        bloom = self._bloom if bloom is None else bloom
+        recent = self._recent if recent is None else recent
+        key = (chat_id, message_id)
+        bloom.add(f"{chat_id}:{message_id}")
+        recent[key] = None
+        recent.move_to_end(key)
+        if len(recent) > self.lru_size:
+            recent.popitem(last=False)
+
+    def is_processed(self, chat_id: int, message_id: int) -> bool:
+        if (chat_id, message_id) in self._recent:
+            self.stats["memory_hits"] += 1
+            return True
+        if not self._bloom.might_contain(f"{chat_id}:{message_id}"):
+            self.stats["bloom_rejects"] += 1
+            return False
+        if (chat_id, message_id) in self._pending_messages:
+            return True
+        self.stats["disk_lookups"] += 1
+        row = self._conn.execute(
+            "SELECT 1 FROM processed_messages WHERE chat_id = ? AND message_id = ? AND processed_at >= ?",
+            (chat_id, message_id, time.time() - self.retention),
+        ).fetchone()
+        return row is not None
+
+    def claim_message(self, chat_id: int, message_id: int, route: str | None = None) -> bool:
+        """
+        Marks the message as being processed (for `route`, whose stored cursor is held below it);
+        returns False if it is already being processed or was processed before.
+        """
+        if (chat_id, message_id) in self._in_progress or self.is_processed(chat_id, message_id):
+            self.stats["duplicates"] += 1
+            return False
+        self._in_progress[(chat_id, message_id)] = route
+        return True
+
+    def complete_message(self, chat_id: int, message_id: int):
+        """Records a claimed message as processed and advances its route's cursor."""
+        route = self._in_progress.pop((chat_id, message_id), None)
+        self._remember(chat_id, message_id)
+        self._pending_messages.add((chat_id, message_id))
+        if self._compacting is not None:
+            self._compacting.append((chat_id, message_id))
+        if route is not None:
+            self.advance_cursor(route, message_id)
+
+    def release_message(self, chat_id: int, message_id: int):
+        """Drops the claim of a message whose processing failed, so it can be processed again."""
+        self._in_progress.pop((chat_id, message_id), None)
+
+    def in_cooldown(self, key: str) -> bool:
+        until = self._cooldowns.get(key)
+        if until is None:
+            return False
+        if until <= time.time():
+            del self._cooldowns[key]
+            return False
+        return True
+
+    def start_cooldown(self, key: str, duration: float):
+        until = time.time() + duration
+        self._cooldowns[key] = until
+        self._pending_cooldowns[key] = until
+
+    def get_cursor(self, route: str) -> int | None:
+        """Returns the highest message id processed for `route`, or None if it was never seen."""
+        return self._cursors.get(route)
+
+    def advance_cursor(self, route: str, message_id: int):
+        if message_id > self._cursors.get(route, 0):
+            self._cursors[route] = message_id
+            self._pending_cursors[route] = message_id
+
+    def flush(self):
+        """Commits buffered writes in one transaction."""
+        if not self._pending_messages and not self._pending_cooldowns and not self._pending_cursors:
+            return
+        now = time.time()
+        cursors, held_cursors = self._stored_cursors()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO processed_messages (chat_id, message_id, processed_at) VALUES (?, ?, ?)",
+                [(chat_id, message_id, now) for chat_id, message_id in self._pending_messages],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cooldowns (key, until) VALUES (?, ?)",
+                list(self._pending_cooldowns.items()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO route_cursors (route, last_message_id) VALUES (?, ?)",
+                list(cursors.items()),
+            )
+        self._pending_messages.clear()
+        self._pending_cooldowns.clear()
+        self._pending_cursors = held_cursors
+
+    def _stored_cursors(self) -> tuple[dict, dict]:
+        """
+        Cursor values to write now, and those to write again later: a route's stored cursor
+        stays below its lowest message still in progress, so catch-up would process it.
+        """
+        lowest = {}
+        for (_, message_id), route in self._in_progress.items():
+            if route is not None and message_id < lowest.get(route, message_id + 1):
+                lowest[route] = message_id
+        cursors, held = {}, {}
+        for route, message_id in self._pending_cursors.items():
+            if route in lowest and lowest[route] <= message_id:
+                cursors[route] = lowest[route] - 1
+                held[route] = message_id
+            else:
+                cursors[route] = message_id
+        return cursors, held
+
+    async def compact(self):
+        """
+        Deletes expired entries, reclaims file space and rebuilds the in-memory front.
+        The database work runs on a worker thread with its own connection, so handlers
+        keep running; messages completed meanwhile are carried over into the new front.
+        """
+        self.flush()
+        self._compacting = []
+        try:
+            if self.path == ":memory:":  # a second connection would open a different, empty database
+                removed, bloom, recent = self._compact_database(self._conn)
+            else:
+                removed, bloom, recent = await asyncio.to_thread(self._compact_database)
+        finally:
+            completed, self._compacting = self._compacting, None
+        # Bloom filters cannot forget keys, so the rebuilt one replaces the old
+        for chat_id, message_id in completed:
+            self._remember(chat_id, message_id, bloom, recent)
+        self._bloom, self._recent = bloom, recent
+        now = time.time()
+        self._cooldowns = {key: until for key, until in self._cooldowns.items() if until > now}
+        logger.info(f"Dedup store compacted: removed {removed} expired entries.")
+
+    def _compact_database(self, conn: sqlite3.Connection | None = None) -> tuple:
+        own_connection = conn is None
+        if own_connection:
+            conn = sqlite3.connect(self.path, timeout=30.0)
+        try:
+            now = time.time()
+            with conn:
+                removed = conn.execute(
+                    "DELETE FROM processed_messages WHERE processed_at < ?", (now - self.retention,)
+                ).rowcount
+                removed += conn.execute("DELETE FROM cooldowns WHERE until <= ?", (now,)).rowcount
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # A file created before incremental vacuuming: one full VACUUM switches it over
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            elif removed:
+                conn.execute("PRAGMA incremental_vacuum")
+            return (removed, *self._build_front(conn, now))
+        finally:
+            if own_connection:
+                conn.close()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintain(), name="dedup-store-maintenance")
+
+    async def _maintain(self):
+        last_compact = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - last_compact >= self.compact_interval:
+                    await self.compact()
+                    last_compact = time.monotonic()
+            except sqlite3.Error as e:
+                logger.error(f"Dedup store maintenance failed: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+        self._conn.close()
@@ -1,53 +1,148 @@
 """Logging configuration for the Telegram bot."""
 
+import atexit
+import json
 import logging
 import logging.handlers
-import os
+import queue
+import time
 
+# High-volume per-message lines that are rate limited by default (per-message traces are
+# logged at DEBUG and so only reach the log file)
+DEFAULT_RATE_LIMITED_PREFIXES = ("  Parser Result:",)
 
-def setup_logging(log_file: str = 'bot.log', 
+_listener = None
+_queue_handler = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `max_per_interval` records per prefix through every `interval` seconds.
+    The first record after a window with suppressed records notes how many were dropped.
+    """
+
+    def __init__(self, prefixes: tuple = DEFAULT_RATE_LIMITED_PREFIXES, max_per_interval: int = 20,
+                 interval: float = 60.0):
+        super().__init__()
+        self.prefixes = tuple(prefixes)
+        self.max_per_interval = max_per_interval
+        self.interval = interval
+        self._windows = {}  # prefix -> [window start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        msg = record.msg if isinstance(record.msg, str) else ""
+        prefix = next((p for p in self.prefixes if msg.startswith(p)), None)
+        if prefix is None:
+            return True
+
+        now = time.monotonic()
+        window = self._windows.get(prefix)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            window = self._windows[prefix] = [now, 0, 0]
+            if suppressed:
+                record.msg = f"{msg} (+{suppressed} similar lines suppressed)"
+        window[1] += 1
+        if window[1] > self.max_per_interval:
+            window[2] += 1
+            return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with timestamp, level, logger name and message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def setup_logging(log_file: str = 'bot.log',
                   console_level: int = logging.INFO,
-                  file_level: int = logging.DEBUG) -> logging.Logger:
+                  file_level: int = logging.DEBUG,
+                  json_format: bool = False,
+                  rate_limit: RateLimitFilter | None = None) -> logging.Logger:
     """
     Set up logging configuration with console and file handlers.
-    
+
+    Records are put on an in-memory queue by a QueueHandler on the root logger and
+    written to the console/file handlers by a QueueListener thread, so the event loop
+    never blocks on log I/O. Calling it again is a no-op.
+
     Args:
         log_file: Path to the log file
         console_level: Logging level for console output
         file_level: Logging level for file output
-        
+        json_format: Write structured JSON lines instead of the text format
+        rate_limit: Filter for high-volume lines (default: RateLimitFilter())
+
     Returns:
         Configured logger instance
     """
+    global _listener, _queue_handler
+
     # Get logger for the main module
     logger = logging.getLogger('__main__')
-    
+    if _listener is not None:
+        return logger
+
     # Prevent Telethon from flooding logs unless it's an error
     logging.getLogger('telethon').setLevel(logging.ERROR)
-    
+
     # Create formatter
-    log_formatter = logging.Formatter(
-        '[%(levelname)5s/%(asctime)s] %(name)s: %(message)s'
-    )
-    
+    if json_format:
+        log_formatter = JsonFormatter()
+    else:
+        log_formatter = logging.Formatter(
+            '[%(levelname)5s/%(asctime)s] %(name)s: %(message)s'
+        )
+
     # Console Handler
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(log_formatter)
     console_handler.setLevel(console_level)
-    
+
     # File Handler (Rotating)
     file_handler = logging.handlers.RotatingFileHandler(
-        log_file, 
+        log_file,
         maxBytes=5*1024*1024,  # 5MB per file
         backupCount=2
     )
     file_handler.setFormatter(log_formatter)
     file_handler.setLevel(file_level)
-    
+
+    # Queue front: the only handler on the root logger
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(rate_limit or RateLimitFilter())
+
     # Configure root logger
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(file_handler)
-    
-    return logger 
\ No newline at end of file
+    root_logger.setLevel(min(console_level, file_level))
+    root_logger.addHandler(queue_handler)
+    _queue_handler = queue_handler
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+
+    return logger
+
+
+def stop_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
@@ -0,0 +1,172 @@
+"""In-process latency histograms and counters with Prometheus text output."""
+
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; tuned for a pipeline whose stages take from microseconds (parse) to seconds (sends)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Seconds to minutes/hours, for outage detection and recovery times
+OUTAGE_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0, 7200.0, 14400.0)
+METRIC_PREFIX = "gbp_bot_"
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (bucket resolution estimate)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms = {}  # name -> {labels key: Histogram}
+        self._counters = {}  # name -> {labels key: float}
+        self._help = {}
+        self._buckets = {}  # name -> bucket bounds, for histograms outside DEFAULT_BUCKETS' range
+
+    def describe(self, name: str, help_text: str, buckets: tuple | None = None):
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def observe(self, name: str, value: float, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = _labels_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+        histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observes the duration of the `with` block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, series in sorted(self._counters.items()):
+            full_name = METRIC_PREFIX + name
+            if name in self._help:
+                lines.append(f"# HELP {full_name} {self._help[name]}")
+            lines.append(f"# TYPE {full_name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{full_name}{_format_labels(key)} {value}")
+        for name, series in sorted(self._histograms.items()):
+            full_name = METRIC_PREFIX + name
+            if name in self._help:
+                lines.append(f"# HELP {full_name} {self._help[name]}")
+            lines.append(f"# TYPE {full_name} histogram")
+            for key, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{full_name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+                lines.append(f"{full_name}_sum{_format_labels(key)} {histogram.total}")
+                lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """One-line digest: count and p50/p99 (ms) per histogram series."""
+        parts = []
+        for name, series in sorted(self._histograms.items()):
+            for key, histogram in sorted(series.items()):
+                label = ",".join(v for _, v in key)
+                parts.append(f"{name}[{label}] n={histogram.count} "
+                             f"p50<={histogram.quantile(0.5) * 1000:g}ms p99<={histogram.quantile(0.99) * 1000:g}ms")
+        return "; ".join(parts) if parts else "no observations yet"
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("stage_seconds", "Time spent in each message handling stage.")
+METRICS.describe("parse_seconds", "Parse time by resulting offer type and confidence.")
+METRICS.describe("reply_latency_seconds", "Time from a message being handled to its reply being sent.")
+METRICS.describe("messages_total", "Routed messages handled.")
+METRICS.describe("offers_total", "Parsed offers by type and confidence.")
+METRICS.describe("startup_seconds", "Time spent in each startup phase.")
+METRICS.describe("watchdog_detect_seconds", "Time from the start of an update gap (oldest missed message, or last update) to its detection.",
+                 buckets=OUTAGE_BUCKETS)
+METRICS.describe("watchdog_recover_seconds", "Time from detecting an update gap to having recovered from it.",
+                 buckets=OUTAGE_BUCKETS)
+METRICS.describe("watchdog_probes_total", "Liveness probes by outcome.")
+METRICS.describe("watchdog_gaps_total", "Detected update gaps by recovery action.")
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        # Drain the request headers
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.split(b" ")[1] if request_line.count(b" ") >= 2 else b"/"
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", METRICS.render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"Not found. Try /metrics\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+    """Serves METRICS in Prometheus text format at http://host:port/metrics."""
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
+
+
+async def log_summary_periodically(interval: float = 300.0):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Metrics summary: {METRICS.summary()}")
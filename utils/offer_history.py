@@ -0,0 +1,321 @@
+"""
+Append-only, column-oriented history of routed messages and their parse results.
+
+Every column lives in its own file of fixed-width native values (`<name>.col`), so a
+column can be memory-mapped and scanned without touching the others; message texts
+are concatenated in `text.bin` and located through the cumulative `text_end` column.
+Rows are buffered in memory and appended to the files in batches by `flush()` (run
+every `flush_interval` seconds once `start()` is called). `text_end` is written last,
+so after a crash the row count is that of the shortest column and any partial tail
+is truncated on the next open.
+
+`scan()` streams matching rows chunk by chunk through read-only memory maps; with
+NumPy installed the filters are evaluated per chunk in vectorized form.
+"""
+
+import array
+import asyncio
+import json
+import logging
+import math
+import mmap
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # optional: scans fall back to a per-row loop
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+# (name, array typecode); missing ids are stored as 0 and missing amounts as NaN
+COLUMNS = (
+    ("posted_at", "d"),
+    ("chat_id", "q"),
+    ("topic_id", "q"),
+    ("message_id", "q"),
+    ("sender_id", "q"),
+    ("amount_gbp", "d"),
+    ("amount_rub", "d"),
+    ("offer_type", "B"),
+    ("confidence", "B"),
+    ("text_end", "q"),
+)
+# Code 0 means the parser found no offer; the others match message_parser.OfferType/Confidence
+OFFER_TYPE_CODES = ("none", "counterparty_sells_gbp", "counterparty_buys_rub", "potential_mention", "other")
+CONFIDENCE_CODES = ("none", "low", "medium", "high", "other")
+NUMPY_DTYPES = {"d": "<f8" if sys.byteorder == "little" else ">f8",
+                "q": "<i8" if sys.byteorder == "little" else ">i8",
+                "B": "u1"}
+
+
+def _code(codes: tuple, value: str | None) -> int:
+    if value is None:
+        return 0
+    try:
+        return codes.index(value)
+    except ValueError:
+        return len(codes) - 1
+
+
+class HistoryRecord:
+    __slots__ = ("row", "posted_at", "chat_id", "topic_id", "message_id", "sender_id", "amount_gbp", "amount_rub",
+                 "offer_type", "confidence", "text")
+
+    def __init__(self, row, posted_at, chat_id, topic_id, message_id, sender_id, amount_gbp, amount_rub,
+                 offer_type, confidence, text):
+        self.row = row
+        self.posted_at = posted_at
+        self.chat_id = chat_id
+        self.topic_id = topic_id or None
+        self.message_id = message_id
+        self.sender_id = sender_id or None
+        self.amount_gbp = None if math.isnan(amount_gbp) else amount_gbp
+        self.amount_rub = None if math.isnan(amount_rub) else amount_rub
+        self.offer_type = None if offer_type == "none" else offer_type
+        self.confidence = None if confidence == "none" else confidence
+        self.text = text
+
+    def as_message_record(self) -> dict:
+        """The record in the JSONL form read by replay_messages.py."""
+        return {"id": self.message_id, "chat_id": self.chat_id, "topic_id": self.topic_id, "date": self.posted_at,
+                "sender": {"id": self.sender_id} if self.sender_id else None, "text": self.text}
+
+    def __repr__(self):
+        return (f"HistoryRecord(row={self.row}, posted_at={self.posted_at}, chat={self.chat_id}, "
+                f"message={self.message_id}, type={self.offer_type}, gbp={self.amount_gbp}, rub={self.amount_rub})")
+
+
+class OfferHistory:
+    def __init__(self, directory: str, flush_interval: float = 5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self._check_schema()
+        self._pending = {name: array.array(typecode) for name, typecode in COLUMNS}
+        self._pending_text = bytearray()
+        self.rows = self._recover()
+        self._text_size = self._last_text_end()
+        self._task = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.col" if name != "text" else "text.bin")
+
+    def _check_schema(self):
+        schema = {"version": SCHEMA_VERSION, "byteorder": sys.byteorder, "columns": [list(c) for c in COLUMNS],
+                  "offer_types": list(OFFER_TYPE_CODES), "confidences": list(CONFIDENCE_CODES)}
+        schema_path = os.path.join(self.directory, "schema.json")
+        if os.path.exists(schema_path):
+            with open(schema_path, encoding="utf-8") as f:
+                existing = json.load(f)
+            if existing != schema:
+                raise ValueError(f"Offer history at {self.directory} has an incompatible schema: {existing}")
+        else:
+            with open(schema_path, "w", encoding="utf-8") as f:
+                json.dump(schema, f)
+
+    def _recover(self) -> int:
+        """Returns the number of complete rows, truncating any partially written tail."""
+        sizes = {}
+        for name, typecode in COLUMNS:
+            path = self._path(name)
+            sizes[name] = os.path.getsize(path) // array.array(typecode).itemsize if os.path.exists(path) else 0
+        rows = min(sizes.values())
+        for name, typecode in COLUMNS:
+            path = self._path(name)
+            expected = rows * array.array(typecode).itemsize
+            if not os.path.exists(path):
+                open(path, "wb").close()
+            elif os.path.getsize(path) != expected:
+                logger.warning(f"Offer history column {name} has a partial tail; truncating to {rows} rows.")
+                os.truncate(path, expected)
+        return rows
+
+    def _last_text_end(self) -> int:
+        text_path = self._path("text")
+        text_end = 0
+        if self.rows:
+            with open(self._path("text_end"), "rb") as f:
+                f.seek((self.rows - 1) * 8)
+                text_end = array.array("q", f.read(8))[0]
+        if not os.path.exists(text_path):
+            open(text_path, "wb").close()
+        elif os.path.getsize(text_path) != text_end:
+            os.truncate(text_path, text_end)
+        return text_end
+
+    def __len__(self) -> int:
+        return self.rows + len(self._pending["text_end"])
+
+    def append(self, posted_at: float, chat_id: int, message_id: int, text: str, sender_id: int | None = None,
+               topic_id: int | None = None, parsed_offer=None):
+        """Buffers one row; `parsed_offer` is the message's ParsedOffer, if any."""
+        amount_gbp = parsed_offer.amount_gbp if parsed_offer is not None else None
+        amount_rub = parsed_offer.amount_rub if parsed_offer is not None else None
+        encoded = (text or "").encode("utf-8")
+        self._pending_text += encoded
+        values = {
+            "posted_at": posted_at,
+            "chat_id": chat_id,
+            "topic_id": topic_id or 0,
+            "message_id": message_id,
+            "sender_id": sender_id or 0,
+            "amount_gbp": math.nan if amount_gbp is None else amount_gbp,
+            "amount_rub": math.nan if amount_rub is None else amount_rub,
+            "offer_type": int(parsed_offer.offer_type) if parsed_offer is not None else 0,
+            "confidence": int(parsed_offer.confidence) if parsed_offer is not None else 0,
+            "text_end": self._text_size + len(self._pending_text),
+        }
+        for name, _ in COLUMNS:
+            self._pending[name].append(values[name])
+
+    def flush(self):
+        """
+        Appends buffered rows to the column files; `text_end` goes last and marks rows complete.
+        Buffers are only cleared once every file is written: on `OSError` the files are
+        truncated back to their previous lengths and the rows stay buffered for the next flush.
+        """
+        pending_rows = len(self._pending["text_end"])
+        if not pending_rows:
+            return
+        previous_sizes = {"text": self._text_size}
+        previous_sizes.update((name, self.rows * array.array(typecode).itemsize) for name, typecode in COLUMNS)
+        try:
+            with open(self._path("text"), "ab") as f:
+                f.write(self._pending_text)
+            for name, _ in COLUMNS:
+                with open(self._path(name), "ab") as f:
+                    self._pending[name].tofile(f)
+        except OSError:
+            self._rollback(previous_sizes)
+            raise
+        for name, typecode in COLUMNS:
+            self._pending[name] = array.array(typecode)
+        self._text_size += len(self._pending_text)
+        self._pending_text = bytearray()
+        self.rows += pending_rows
+
+    def _rollback(self, sizes: dict):
+        """Truncates the files back to `sizes` after a failed flush; `_recover` handles whatever is left."""
+        for name, size in sizes.items():
+            try:
+                if os.path.getsize(self._path(name)) > size:
+                    os.truncate(self._path(name), size)
+            except OSError as e:
+                logger.error(f"Offer history column {name} could not be truncated to {size} bytes: {e}")
+
+    def scan(self, since: float | None = None, until: float | None = None, offer_types: tuple | None = None,
+             offers_only: bool = False, with_text: bool = True, chunk_rows: int = 65536):
+        """
+        Yields HistoryRecords for rows posted in [since, until) whose offer type is in
+        `offer_types` (or that carry any offer, with `offers_only`), oldest row first.
+        Memory use is bounded by `chunk_rows`; rows appended during the scan are not included.
+        """
+        self.flush()
+        rows = self.rows
+        if not rows:
+            return
+        type_codes = None
+        if offer_types is not None:
+            type_codes = {_code(OFFER_TYPE_CODES, t) for t in offer_types}
+        elif offers_only:
+            type_codes = set(range(1, len(OFFER_TYPE_CODES)))
+
+        files = {}
+        maps = {}
+        try:
+            for name, _ in COLUMNS + (("text", "B"),):
+                if name == "text" and (not with_text or not self._text_size):
+                    continue
+                files[name] = open(self._path(name), "rb")
+                maps[name] = mmap.mmap(files[name].fileno(), 0, access=mmap.ACCESS_READ)
+            previous_text_end = 0
+            for start in range(0, rows, chunk_rows):
+                end = min(rows, start + chunk_rows)
+                columns = self._read_chunk(maps, start, end)
+                indices = self._matching(columns, end - start, since, until, type_codes)
+                selected = self._select(columns, indices)
+                text_ends = columns["text_end"]
+                text_starts = [int(text_ends[i - 1]) if i else previous_text_end for i in indices]
+                previous_text_end = int(text_ends[-1])
+                # Drop the views into the maps before yielding, so an early close can unmap them
+                del columns, text_ends
+                for j, i in enumerate(indices):
+                    text = None
+                    if with_text:
+                        text = maps["text"][text_starts[j]:selected["text_end"][j]].decode("utf-8") if "text" in maps else ""
+                    yield HistoryRecord(start + i, selected["posted_at"][j], selected["chat_id"][j],
+                                        selected["topic_id"][j], selected["message_id"][j], selected["sender_id"][j],
+                                        selected["amount_gbp"][j], selected["amount_rub"][j],
+                                        OFFER_TYPE_CODES[selected["offer_type"][j]],
+                                        CONFIDENCE_CODES[selected["confidence"][j]], text)
+        finally:
+            for mapped in maps.values():
+                mapped.close()
+            for f in files.values():
+                f.close()
+
+    @staticmethod
+    def _read_chunk(maps: dict, start: int, end: int) -> dict:
+        """Rows [start, end) of every numeric column as arrays (NumPy views of the maps when available)."""
+        columns = {}
+        for name, typecode in COLUMNS:
+            itemsize = array.array(typecode).itemsize
+            if np is not None:
+                columns[name] = np.frombuffer(maps[name], dtype=NUMPY_DTYPES[typecode], count=end - start,
+                                              offset=start * itemsize)
+            else:
+                chunk = array.array(typecode)
+                chunk.frombytes(maps[name][start * itemsize:end * itemsize])
+                columns[name] = chunk
+        return columns
+
+    @staticmethod
+    def _select(columns: dict, indices: list[int]) -> dict:
+        """The given rows of every column as plain Python values."""
+        if np is not None:
+            positions = np.asarray(indices, dtype=np.intp)
+            return {name: column[positions].tolist() for name, column in columns.items()}
+        return {name: [column[i] for i in indices] for name, column in columns.items()}
+
+    @staticmethod
+    def _matching(columns: dict, count: int, since, until, type_codes) -> list[int]:
+        """Chunk-relative indices of rows passing the filters."""
+        posted_at = columns["posted_at"]
+        offer_type = columns["offer_type"]
+        if np is not None:
+            mask = np.ones(count, dtype=bool)
+            if since is not None:
+                mask &= posted_at >= since
+            if until is not None:
+                mask &= posted_at < until
+            if type_codes is not None:
+                mask &= np.isin(offer_type, list(type_codes))
+            return np.flatnonzero(mask).tolist()
+        return [i for i in range(count)
+                if (since is None or posted_at[i] >= since) and (until is None or posted_at[i] < until)
+                and (type_codes is None or offer_type[i] in type_codes)]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintain(), name="offer-history-flush")
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"Offer history flush failed: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
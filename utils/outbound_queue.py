@@ -0,0 +1,221 @@
+"""Prioritized outbound message dispatcher with token-bucket pacing and FloodWait handling."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_AUTO_RESPONSE = 0
+PRIORITY_NOTIFICATION = 1
+
+
+def flood_wait_seconds(exc: Exception) -> int | None:
+    """Returns the wait Telegram asked for if `exc` is a FloodWait-style error, else None."""
+    # telethon.errors.FloodWaitError / FloodPremiumWaitError carry the wait in `seconds`
+    seconds = getattr(exc, 'seconds', None)
+    if type(exc).__name__.startswith('Flood') and isinstance(seconds, int):
+        return seconds
+    return None
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        """Tokens available right now."""
+        self._refill()
+        return self.tokens
+
+    async def acquire(self):
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    __slots__ = ("priority", "seq", "entity", "text", "send_kwargs", "on_failure", "description", "kind",
+                 "received_at", "enqueued_at")
+
+    def __init__(self, priority, seq, entity, text, send_kwargs, on_failure, description, kind, received_at):
+        self.priority = priority
+        self.seq = seq
+        self.entity = entity
+        self.text = text
+        self.send_kwargs = send_kwargs
+        self.on_failure = on_failure
+        self.description = description
+        self.kind = kind
+        self.received_at = received_at
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundDispatcher:
+    """
+    Sends queued messages through `client.send_message` from a single background task.
+
+    Handlers call `enqueue()` and return immediately. Messages leave in priority order
+    (auto-responses before owner notifications, FIFO within a priority), paced by a token
+    bucket. A FloodWait pauses all sending for the requested time and the message is
+    retried, unless the wait exceeds `max_flood_wait`. When the queue holds `max_depth`
+    messages, the newest lowest-priority message is dropped to make room for a more
+    urgent one; otherwise the incoming message is dropped. Entities found in `input_peers`
+    (id -> pre-resolved input peer) are sent to without another entity lookup.
+    `budget()` tells an OutboundPool how many sends this dispatcher can make without waiting.
+    """
+
+    def __init__(self, client, rate: float = 1.0, burst: int = 3, max_depth: int = 100,
+                 max_flood_wait: int = 300):
+        self.client = client
+        self.bucket = TokenBucket(rate, burst)
+        self.max_depth = max_depth
+        self.max_flood_wait = max_flood_wait
+        self.stats = {"enqueued": 0, "sent": 0, "failed": 0, "dropped": 0, "flood_waits": 0}
+        self.input_peers = {}
+        self.paused_until = 0.0  # monotonic time a FloodWait pause ends
+        self._heap = []
+        self._seq = itertools.count()
+        self._available = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._in_flight = 0
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def budget(self) -> float:
+        """Sends possible right now: bucket tokens minus queued messages; -inf while paused by a FloodWait."""
+        if time.monotonic() < self.paused_until:
+            return float("-inf")
+        return self.bucket.available() - self._in_flight
+
+    def enqueue(self, entity, text: str, priority: int = PRIORITY_NOTIFICATION, on_failure=None,
+                description: str = "", kind: str = "message", received_at: float | None = None,
+                via_message: tuple | None = None, **send_kwargs) -> bool:
+        """
+        Queues a message for sending. `on_failure(exc)` is called if it is finally not delivered.
+        `kind` labels the send metrics; `received_at` (time.perf_counter() when the triggering
+        message was received) enables the reply latency metric. `via_message` (chat id, message
+        id where the recipient was seen) only matters to an OutboundPool and is ignored here.
+        Returns False if the message was dropped because the queue is full.
+        """
+        item = OutboundMessage(priority, next(self._seq), entity, text, send_kwargs, on_failure, description,
+                               kind, received_at)
+        if len(self._heap) >= self.max_depth:
+            victim = max(self._heap)
+            if not item < victim:
+                self.stats["dropped"] += 1
+                logger.warning(f"Outbound queue full ({self.max_depth}); dropped {description or 'message'} to {entity}.")
+                return False
+            self._heap.remove(victim)
+            heapq.heapify(self._heap)
+            self._in_flight -= 1
+            self.stats["dropped"] += 1
+            logger.warning(f"Outbound queue full ({self.max_depth}); dropped queued {victim.description or 'message'} "
+                           f"to {victim.entity} for a higher-priority message.")
+        heapq.heappush(self._heap, item)
+        self._in_flight += 1
+        self.stats["enqueued"] += 1
+        self._idle.clear()
+        self._available.set()
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="outbound-dispatcher")
+            self._task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        # _run never returns; anything but a cancellation means replies would pile up unsent
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Outbound dispatcher task died; {len(self._heap)} queued message(s) will not be sent.",
+                         exc_info=task.exception())
+
+    async def join(self, timeout: float | None = None):
+        """Waits until every queued message has been sent, failed or dropped."""
+        await asyncio.wait_for(self._idle.wait(), timeout)
+
+    async def stop(self, drain_timeout: float | None = 10.0):
+        """Gives queued messages up to `drain_timeout` seconds to go out, then stops the task."""
+        if self._task is None:
+            return
+        try:
+            await self.join(drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Outbound queue not drained on shutdown; {len(self._heap)} message(s) discarded.")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            while not self._heap:
+                self._available.clear()
+                await self._available.wait()
+            item = heapq.heappop(self._heap)
+            try:
+                await self.bucket.acquire()
+                await self._deliver(item)
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception(f"Unexpected error while sending {item.description or 'message'} to {item.entity}")
+            finally:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._idle.set()
+
+    async def _deliver(self, item: OutboundMessage):
+        while True:
+            send_started = time.perf_counter()
+            try:
+                entity = self.input_peers.get(item.entity, item.entity)
+                await self.client.send_message(entity, item.text, **item.send_kwargs)
+            except Exception as e:
+                wait = flood_wait_seconds(e)
+                if wait is not None and wait <= self.max_flood_wait:
+                    self.stats["flood_waits"] += 1
+                    self.paused_until = time.monotonic() + wait
+                    logger.warning(f"FloodWait of {wait}s while sending {item.description or 'message'}; pausing outbound queue.")
+                    await asyncio.sleep(wait)
+                    continue
+                self.stats["failed"] += 1
+                logger.error(f"Failed to send {item.description or 'message'} to {item.entity}: {e}")
+                if item.on_failure is not None:
+                    try:
+                        item.on_failure(e)
+                    except Exception:
+                        logger.exception(f"Failure callback for {item.description or 'message'} raised")
+                return
+            self.stats["sent"] += 1
+            sent_at = time.perf_counter()
+            METRICS.observe("stage_seconds", sent_at - send_started, stage=f"send_{item.kind}")
+            if item.received_at is not None:
+                METRICS.observe("reply_latency_seconds", sent_at - item.received_at, kind=item.kind)
+            queued_for = time.monotonic() - item.enqueued_at
+            logger.info(f"Sent {item.description or 'message'} to {item.entity} (queued {queued_for:.2f}s).")
+            return
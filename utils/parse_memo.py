@@ -0,0 +1,73 @@
+"""Bounded TTL/LRU memo of parse results for reposted offer texts."""
+
+import hashlib
+import time
+from collections import OrderedDict
+
+from message_parser import normalize_text
+
+
+class ParseMemo:
+    """
+    Caches parse results keyed by parser function and a hash of `normalize_text(text)`,
+    so a reposted offer that differs only in case, look-alike letters or space characters
+    skips the parser. Nothing beyond the parser's own normalization is folded: amounts
+    are matched by character distance, so texts that differ in spacing may parse differently.
+
+    Results (including "no offer") are stored for `ttl` seconds; the least recently used
+    entry is evicted once `max_size` is reached. Cached offers are returned as copies
+    with `original_message` set to the text being parsed (`ParsedOffer.with_text`).
+    """
+
+    def __init__(self, max_size: int = 2000, ttl: float = 6 * 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (parse_func, digest) -> (stored_at, result)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(parse_func, text: str) -> tuple:
+        return parse_func, hashlib.blake2b(normalize_text(text).encode(), digest_size=16).digest()
+
+    def get(self, key: tuple, text: str) -> tuple[bool, object]:
+        """Returns (found, result) for `key`; the result carries `text` as its original message."""
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        result = entry[1]
+        if result is None:
+            return True, None
+        return True, result.with_text(text)
+
+    def put(self, key: tuple, result):
+        self._entries[key] = (time.time(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def parse(self, parse_func, text: str):
+        """`parse_func(text)`, answered from the memo when an equivalent text was parsed recently."""
+        key = self.key(parse_func, text)
+        found, result = self.get(key, text)
+        if not found:
+            result = parse_func(text)
+            self.put(key, result)
+        return result
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,111 @@
+"""Bounded TTL/LRU cache of message senders to avoid get_sender round trips."""
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+
+class SenderCache:
+    """
+    Caches the sender fields the bot uses (id, names, username) keyed by sender id.
+
+    Entries expire after `ttl` seconds and the least recently used entry is evicted
+    once `max_size` is reached. When `path` is given the cache can be loaded from and
+    saved to a JSON file so it survives restarts.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 6 * 3600, path: str | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # sender_id -> (stored_at, sender snapshot)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_cached(self, sender_id: int):
+        """Returns the cached sender for `sender_id` or None if missing or expired (does not count stats)."""
+        entry = self._entries.get(sender_id)
+        if entry is None:
+            return None
+        stored_at, sender = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[sender_id]
+            return None
+        self._entries.move_to_end(sender_id)
+        return sender
+
+    def put(self, sender):
+        """Stores a snapshot of `sender` (any object with an `id`)."""
+        if sender is None or getattr(sender, 'id', None) is None:
+            return
+        snapshot = SimpleNamespace(
+            id=sender.id,
+            first_name=getattr(sender, 'first_name', None) or getattr(sender, 'title', None) or "",
+            last_name=getattr(sender, 'last_name', None),
+            username=getattr(sender, 'username', None),
+        )
+        self._entries[sender.id] = (time.time(), snapshot)
+        self._entries.move_to_end(sender.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_sender(self, message):
+        """Returns the sender of `message`, calling `message.get_sender()` only on a cache miss."""
+        sender_id = getattr(message, 'sender_id', None)
+        if sender_id is not None:
+            sender = self.get_cached(sender_id)
+            if sender is not None:
+                self.hits += 1
+                return sender
+        self.misses += 1
+        sender = await message.get_sender()
+        self.put(sender)
+        return sender
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def load(self):
+        """Loads unexpired entries from `path`, if it exists."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                raw_entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load sender cache from {self.path}: {e}")
+            return
+        now = time.time()
+        for stored_at, fields in raw_entries:
+            if now - stored_at <= self.ttl:
+                self._entries[fields["id"]] = (stored_at, SimpleNamespace(**fields))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(self._entries)} cached senders from {self.path}")
+
+    def save(self):
+        """Writes the cache to `path` atomically (temp file + rename)."""
+        if not self.path:
+            return
+        raw_entries = [(stored_at, vars(sender)) for stored_at, sender in self._entries.values()]
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(raw_entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save sender cache to {self.path}: {e}")